@@ -1,9 +1,10 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
-from __future__ import with_statement
+from __future__ import absolute_import, with_statement
 
 import os
 import sys
+import hashlib
 import zipfile
 from getopt import getopt
 from shutil import copyfile
@@ -29,7 +30,11 @@ def copytree(src, dest, **kw):
 
 
 def usage(app_name):
-    return 'Usage: %s <project name>' % app_name
+    return '\n'.join([
+        'Usage: %s <project name>' % app_name,
+        '       %s compile-routes [project home]' % app_name,
+        '       %s compile-templates [--check] [project home]' % app_name,
+        ])
 
 
 def recursively_rmdir(dirname):
@@ -308,9 +313,143 @@ def main(argv):
     print 'The "%s" project has been created.' % project_name
 
 
+def compile_routes(argv):
+    """Compiles routes.yaml into compiled_routes.py of the project.
+
+    The compiled module holds the routing rules as Python literals and the
+    SHA-1 of the routes.yaml it was built from, so the application can skip
+    the YAML parsing on start while the hash still matches.
+    """
+    import yaml
+
+    project_home = os.path.abspath(argv[0] if argv else os.getcwd())
+    routes_file = os.path.join(project_home, 'routes.yaml')
+    if not os.path.exists(routes_file):
+        print '%s does not exist' % routes_file
+        return
+
+    with open(routes_file) as f:
+        source = f.read()
+    route_config = yaml.safe_load(source) or {}
+
+    content = [
+        '# -*- coding: utf-8 -*-',
+        '"""The routing table compiled from routes.yaml by `gaeo compile-routes`.',
+        '',
+        'DO NOT EDIT. Run `gaeo compile-routes` again after changing routes.yaml.',
+        '"""',
+        '',
+        'ROUTES_HASH = %r' % hashlib.sha1(source).hexdigest(),
+        '',
+        'ROUTES = [',
+        ]
+    for route in route_config.get('routes', []):
+        content.append('    %r,' % ((route.get('rule', ''),
+                                     tuple(route.get('regex', [])),
+                                     route.get('parameters', {})), ))
+    content.extend([']', ''])
+
+    create_file(os.path.join(project_home, 'compiled_routes.py'), content)
+    print 'The routing table has been compiled.'
+
+
+def compile_templates(argv):
+    """Precompiles the templates into compiled_templates.py of the project.
+
+    Each template under application/templates gets its {% extends %} chain
+    resolved into a single source, stored with the SHA-1 of the chain's
+    files, so the application neither reads nor resolves the template files
+    at runtime. The templates which need the template directory at runtime
+    (variable extends, include, ssi and url tags) are left out.
+
+    With --check, reports the stale and missing templates instead, and exits
+    with 1 if there is any.
+    """
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'oildrum', 'lib'))
+    from gaeo.templating import TemplateNotCompilable, flatten_template, \
+        needs_template_dir, chain_digest
+
+    (optlist, args) = getopt(argv, '', ['check'])
+    check = ('--check', '') in optlist
+
+    project_home = os.path.abspath(args[0] if args else os.getcwd())
+    templates_dir = os.path.join(project_home, 'application', 'templates')
+    if not os.path.isdir(templates_dir):
+        print '%s does not exist' % templates_dir
+        return
+
+    compiled = {}
+    for (root, dirs, files) in os.walk(templates_dir):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for filename in files:
+            if filename.startswith('.'):
+                continue
+            path = os.path.join(root, filename)
+            name = path[len(templates_dir) + 1:].replace(os.sep, '/')
+            try:
+                source, chain = flatten_template(templates_dir, name)
+            except TemplateNotCompilable, e:
+                print 'skipped %s: %s' % (name, e)
+                continue
+            if needs_template_dir(source):
+                print 'skipped %s: it needs the template directory' % name
+                continue
+            compiled[name] = (chain_digest(templates_dir, chain),
+                              tuple(chain), source)
+
+    module_file = os.path.join(project_home, 'compiled_templates.py')
+    if check:
+        stale = []
+        existing = {}
+        if os.path.exists(module_file):
+            namespace = {}
+            execfile(module_file, namespace)
+            existing = namespace.get('TEMPLATES', {})
+        for name, entry in sorted(compiled.iteritems()):
+            if name not in existing:
+                stale.append('missing %s' % name)
+            elif existing[name][0] != entry[0]:
+                stale.append('stale %s' % name)
+        for line in stale:
+            print line
+        if stale:
+            sys.exit(1)
+        print 'The compiled templates are up to date.'
+        return
+
+    content = [
+        '# -*- coding: utf-8 -*-',
+        '"""The templates precompiled by `gaeo compile-templates`.',
+        '',
+        'DO NOT EDIT. Run `gaeo compile-templates` again after changing the',
+        'templates.',
+        '"""',
+        '',
+        'TEMPLATES = {',
+        ]
+    for name, entry in sorted(compiled.iteritems()):
+        content.append('    %r: %r,' % (name, entry))
+    content.extend(['}', ''])
+
+    create_file(module_file, content)
+    print '%d templates have been compiled.' % len(compiled)
+
+
+# sub-commands, the other arguments create a project.
+COMMANDS = {
+    'compile-routes': compile_routes,
+    'compile-templates': compile_templates,
+}
+
+
 def commandline():
     if len(sys.argv) > 1:
-        main(sys.argv[1:])
+        command = COMMANDS.get(sys.argv[1])
+        if command:
+            command(sys.argv[2:])
+        else:
+            main(sys.argv[1:])
     else:
         print usage(sys.argv[0])
 
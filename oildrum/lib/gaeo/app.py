@@ -5,30 +5,44 @@
 
 Classes:
     GaeoApp: A WSGI-compatible application class. See PEP-333
+    DispatchPlan: The resolved controller class and action of a request.
     
 Functions:
     start_app: A shortcut to start gaeoapp.
+    get_dispatch_plan: Gets the cached dispatch plan of a controller/action.
 """
 
 # Python stdlib imports
 import os
 import sys
 import cgi
+import calendar
+import datetime
+import hashlib
 import logging
+import threading
+import types
 import urllib
+import zlib
 import wsgiref.headers
 import wsgiref.util
 from Cookie import BaseCookie
+from email.Utils import formatdate, parsedate_tz, mktime_tz
 import StringIO
 import webob
-import yaml
 
 # gaeo imports
 import router
+from gaeo import controller as controller_module
+from gaeo.cache import action_cache, fragment_cache
+from gaeo.utils import LRUCache
 
 # App imports
 import settings
 
+# the module generated by `gaeo compile-routes`.
+COMPILED_ROUTES_MODULE = 'compiled_routes'
+
 
 def _trans_http_header_key(key):
     """ Translate the environment variable into http header's name. """
@@ -105,6 +119,63 @@ class GaeoRequest(webob.Request):
         return list(set(self.params.keys()))
 
 
+# the content types compressed unless settings.COMPRESS_CONTENT_TYPES is set.
+COMPRESS_CONTENT_TYPES = (
+    'text/html',
+    'text/plain',
+    'text/css',
+    'text/xml',
+    'application/json',
+    'application/javascript',
+    'application/xml',
+)
+
+
+def _accepted_encoding(accept_encoding):
+    """Picks the content coding for the Accept-Encoding header.
+
+    Args:
+        accept_encoding: the value of the Accept-Encoding request header.
+
+    Returns:
+        'gzip' or 'deflate', the first one accepted by the client, or None.
+    """
+    qvalues = {}
+    for token in accept_encoding.split(','):
+        parts = token.split(';')
+        coding = parts[0].strip().lower()
+        q = 1.0
+        for param in parts[1:]:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[coding] = q
+
+    for coding in ('gzip', 'deflate'):
+        if qvalues.get(coding, qvalues.get('*', 0.0)) > 0:
+            return coding
+    return None
+
+
+def _compressor(coding):
+    """Creates the zlib compressor for the content coding."""
+    level = getattr(settings, 'COMPRESS_LEVEL', 6)
+    if coding == 'gzip':
+        # 16 + MAX_WBITS makes zlib write the gzip header and trailer.
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return zlib.compressobj(level)
+
+
+def _strip_weak(etag):
+    """Strips the weak indicator of an entity tag."""
+    if etag.startswith('W/'):
+        return etag[2:]
+    return etag
+
+
 class GaeoResponse(object):
     """Represents an HTTP response.
 
@@ -112,12 +183,24 @@ class GaeoResponse(object):
         set_status(status_code, message): sets the status code and message to
             be sent to the client.
         clear(): empties the output buffer for HTTP response body string.
-        wsgi_write(start_response): write out the HTTP response.
+        set_stream(chunks): sends the body from an iterable of strings.
+        set_etag(etag, weak): sets the ETag validator.
+        set_last_modified(value): sets the Last-Modified validator.
+        is_not_modified(request): checks the request's conditional headers.
+        wsgi_write(start_response, request): write out the HTTP response.
 
     Public data:
         headers: A wsgiref.headers.Headers object for holding HTTP headers to
             be sent out.
         cookies: The dict of cookie key-value pairs.
+        stream: the iterable of body chunks set by set_stream(), or None for
+            the default buffered body.
+        headers_sent: True once the status and headers are sent, e.g. while
+            the stream is sent; the headers and cookies set then are lost.
+        auto_etag: True to compute a strong ETag from the buffered body if
+            no ETag is set, defaults to settings.AUTO_ETAG.
+        compress: True to compress the body with gzip or deflate when the
+            client accepts it, defaults to settings.COMPRESS_RESPONSES.
     """
     
     def __init__(self, body=None, charset='utf-8'):
@@ -129,6 +212,10 @@ class GaeoResponse(object):
         self.cookies = {}
         self.status = (200, 'OK')
         self.out = StringIO.StringIO() # the output buffer.
+        self.stream = None
+        self.headers_sent = False
+        self.auto_etag = getattr(settings, 'AUTO_ETAG', False)
+        self.compress = getattr(settings, 'COMPRESS_RESPONSES', False)
         
     def set_status(self, status_code, message):
         """Sets the status code and message to be used in output later.
@@ -142,17 +229,135 @@ class GaeoResponse(object):
         self.status = (int(status_code), message)
 
     def clear(self):
-        """Clears the output buffer."""
+        """Clears the output buffer and drops the stream."""
         self.out.seek(0)
         self.out.truncate(0)
+        self.stream = None
+
+    def set_stream(self, chunks):
+        """Streams the body from an iterable instead of the output buffer.
+
+        The chunks are handed to the WSGI server one by one as they are
+        produced, after anything already written to the output buffer. No
+        Content-Length is sent, so the server may use chunked transfer.
+
+        Args:
+            chunks: an iterable (e.g. a generator) of str or unicode strings.
+        """
+        self.stream = chunks
+
+    def set_etag(self, etag, weak=False):
+        """Sets the ETag header of the response.
+
+        Args:
+            etag: the entity tag, quoted if it is not yet.
+            weak: True for a weak validator.
+        """
+        if not etag.startswith('"'):
+            etag = '"%s"' % etag
+        if weak:
+            etag = 'W/' + etag
+        self.headers['ETag'] = etag
+
+    def set_last_modified(self, value):
+        """Sets the Last-Modified header of the response.
+
+        Args:
+            value: a datetime in UTC or a POSIX timestamp.
+        """
+        if isinstance(value, datetime.datetime):
+            value = calendar.timegm(value.utctimetuple())
+        self.headers['Last-Modified'] = formatdate(value, usegmt=True)
+
+    def is_not_modified(self, request):
+        """Checks if the client's cached copy is still valid.
 
-    def wsgi_write(self, start_response):
+        The If-None-Match header is checked against the ETag, or if absent,
+        the If-Modified-Since header against the Last-Modified header. Only
+        successful GET and HEAD requests can be answered with a 304.
+
+        Args:
+            request: the GaeoRequest object of the response.
+
+        Returns:
+            True if the response may be replaced by a 304 Not Modified.
+        """
+        if request.method not in ('GET', 'HEAD') or self.status[0] != 200:
+            return False
+
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            etag = self.headers.get('ETag')
+            if etag is None:
+                return False
+            if if_none_match.strip() == '*':
+                return True
+            # If-None-Match uses the weak comparison
+            etag = _strip_weak(etag)
+            for tag in if_none_match.split(','):
+                if _strip_weak(tag.strip()) == etag:
+                    return True
+            return False
+
+        if_modified_since = request.headers.get('If-Modified-Since')
+        last_modified = self.headers.get('Last-Modified')
+        if if_modified_since and last_modified:
+            since = parsedate_tz(if_modified_since)
+            modified = parsedate_tz(last_modified)
+            if since and modified:
+                return mktime_tz(modified) <= mktime_tz(since)
+        return False
+
+    def wsgi_write(self, start_response, request=None):
         """Flush the output buffer to the client.
+
+        If the request is given, the response is replaced by a 304 Not
+        Modified when the request's validators match, and the body may be
+        compressed as negotiated by its Accept-Encoding header.
         
         Args:
             start_response: the callback for WSGI app per PEP-333. It will be
                 called with status string and header list as arguments.
+            request: [optional] the GaeoRequest object of the response.
+
+        Returns:
+            The iterable of the body chunks to be returned to the WSGI server
+            if the response is streamed, otherwise None.
         """
+        body = None
+        if request is not None and self.status[0] == 200:
+            if self.stream is None and self.auto_etag and \
+                    'ETag' not in self.headers:
+                body = self.__encoded_body()
+                self.set_etag(hashlib.sha1(body).hexdigest())
+            if self.is_not_modified(request):
+                self.set_status(304, 'Not Modified')
+
+        if self.status[0] == 304:
+            return self.__wsgi_not_modified(start_response)
+
+        coding = None
+        if request is not None:
+            coding = self.__content_coding(request)
+
+        if self.stream is not None:
+            return self.__wsgi_stream(start_response, coding)
+
+        if body is None:
+            body = self.__encoded_body()
+        if coding and \
+                len(body) >= getattr(settings, 'COMPRESS_MIN_SIZE', 1024):
+            compressor = _compressor(coding)
+            body = compressor.compress(body) + compressor.flush()
+            self.__set_content_encoding(coding)
+        self.headers['Content-Length'] = str(len(body))
+        write = start_response('%s %s' % self.status, self._wsgi_headers)
+        self.headers_sent = True
+        write(body)
+        self.out.close()
+
+    def __encoded_body(self):
+        """Gets the buffered body encoded in UTF-8."""
         body = self.out.getvalue()
         if isinstance(body, unicode):
             body = body.encode('utf-8')
@@ -161,12 +366,227 @@ class GaeoResponse(object):
                 body.decode('utf-8')
             except UnicodeError, e:
                 logging.warning('Response written is not UTF-8: %s', e)
-
-        self.headers['Content-Length'] = str(len(body))
-        write = start_response('%s %s' % self.status, self._wsgi_headers)
-        write(body)
+        return body
+
+    def __wsgi_not_modified(self, start_response):
+        """Starts the 304 response, which has no body."""
+        for name in ('Content-Length', 'Content-Type'):
+            if name in self.headers:
+                del self.headers[name]
+        start_response('%s %s' % self.status, self._wsgi_headers)
+        self.headers_sent = True
+        if hasattr(self.stream, 'close'):
+            self.stream.close()
         self.out.close()
 
+    def __content_coding(self, request):
+        """Negotiates the compression of the body.
+
+        Sets the Vary header for the compressible responses, whether the
+        client accepts the compression or not.
+
+        Returns:
+            'gzip', 'deflate' or None.
+        """
+        if not self.compress or self.status[0] in (204, 304) or \
+                'Content-Encoding' in self.headers:
+            return None
+
+        content_type = self.headers.get('Content-Type', '')
+        content_type = content_type.split(';')[0].strip().lower()
+        if content_type not in getattr(settings, 'COMPRESS_CONTENT_TYPES',
+                                       COMPRESS_CONTENT_TYPES):
+            return None
+
+        vary = self.headers.get('Vary')
+        if not vary:
+            self.headers['Vary'] = 'Accept-Encoding'
+        elif 'accept-encoding' not in vary.lower():
+            self.headers['Vary'] = vary + ', Accept-Encoding'
+        return _accepted_encoding(request.headers.get('Accept-Encoding', ''))
+
+    def __set_content_encoding(self, coding):
+        """Marks the body as compressed by the content coding."""
+        self.headers['Content-Encoding'] = coding
+        # the compressed body is not byte-identical to the validated one.
+        etag = self.headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            self.headers['ETag'] = 'W/' + etag
+
+    def __wsgi_stream(self, start_response, coding=None):
+        """Starts the response and returns the streamed body."""
+        if 'Content-Length' in self.headers:
+            del self.headers['Content-Length']
+        compressor = None
+        if coding:
+            compressor = _compressor(coding)
+            self.__set_content_encoding(coding)
+        start_response('%s %s' % self.status, self._wsgi_headers)
+        self.headers_sent = True
+        return _StreamBody(self.out, self.stream, compressor)
+
+
+class _StreamBody(object):
+    """The WSGI body iterable of a streamed response.
+
+    Sends whatever is written to the output buffer in between the chunks,
+    encodes unicode to UTF-8, skips the empty chunks, and closes the output
+    buffer and the underlying iterable when the WSGI server closes the body.
+    With a compressor, every chunk is compressed and flushed on its own so
+    the client still gets the chunks as they are produced.
+    """
+
+    def __init__(self, out, chunks, compressor=None):
+        self._out = out
+        self._chunks = chunks
+        self._compressor = compressor
+
+    def __iter__(self):
+        for chunk in self.__drain():
+            yield chunk
+        for chunk in self._chunks:
+            for buffered in self.__drain():
+                yield buffered
+            if chunk:
+                yield self.__encode(chunk)
+        for chunk in self.__drain():
+            yield chunk
+        if self._compressor is not None:
+            yield self._compressor.flush()
+
+    def __drain(self):
+        value = self._out.getvalue()
+        if value:
+            self._out.seek(0)
+            self._out.truncate(0)
+            yield self.__encode(value)
+
+    def __encode(self, chunk):
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        if self._compressor is not None:
+            chunk = self._compressor.compress(chunk) + \
+                self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return chunk
+
+    def close(self):
+        self._out.close()
+        if hasattr(self._chunks, 'close'):
+            self._chunks.close()
+
+
+def _save_after(chunks, session):
+    """Yields the chunks, then stores the session if it was changed."""
+    try:
+        for chunk in chunks:
+            yield chunk
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+        session.save()
+
+
+class DispatchPlan(object):
+    """The resolved controller class and action of a (controller, action) pair.
+
+    Public data:
+        controller: the controller class with the Bootstrap mixin applied, or
+            None if the controller can't be imported.
+        action: the name of the action.
+        has_action: False if the controller surely has no such action.
+        cache: the CacheOptions of the action if it is cached, or None.
+        error: the ImportError raised by importing the controller, or None.
+    """
+    __slots__ = ('controller', 'action', 'has_action', 'cache', 'error')
+
+    def __init__(self, controller, action, error=None):
+        self.controller = controller
+        self.action = action
+        self.error = error
+        self.has_action = controller is not None and \
+            (getattr(controller, action, None) is not None or
+             hasattr(controller, '__getattr__'))
+        self.cache = getattr(getattr(controller, action, None),
+                             'cache_options', None)
+
+    def bind(self, ctrl):
+        """Gets the action method of the controller instance, or None."""
+        if self.has_action:
+            return getattr(ctrl, self.action, None)
+        return None
+
+
+# (controller, action) -> DispatchPlan, shared by the whole process.
+_DISPATCH_PLANS = LRUCache(getattr(settings, 'DISPATCH_PLAN_CACHE_SIZE', 1000))
+_DISPATCH_PLANS_LOCK = threading.Lock()
+
+
+def get_dispatch_plan(controller, action):
+    """Gets the dispatch plan of the controller and action.
+
+    The controller module and the bootstrap module are imported, and the
+    Bootstrap mixin applied, only the first time the pair is dispatched.
+    Controllers failing to import are cached too, so requests for missing
+    controllers don't go through the import machinery again.
+
+    Args:
+        controller: the controller name in the routing parameters.
+        action: the action name in the routing parameters.
+
+    Returns:
+        A DispatchPlan object.
+
+    Raises:
+        Any exception other than ImportError raised by importing the modules,
+        such a plan is not cached.
+    """
+    key = (controller, action)
+    plan = _DISPATCH_PLANS.get(key)
+    if plan is not None:
+        return plan
+
+    _DISPATCH_PLANS_LOCK.acquire()
+    try:
+        plan = _DISPATCH_PLANS.get(key)
+        if plan is None:
+            plan = _build_dispatch_plan(controller, action)
+            _DISPATCH_PLANS.put(key, plan)
+        return plan
+    finally:
+        _DISPATCH_PLANS_LOCK.release()
+
+
+def _build_dispatch_plan(controller, action):
+    """Resolves the controller class of a dispatch plan."""
+    try:
+        module_name = '%s.controllers.%s' % \
+            (settings.APP_DIR.split('/')[-1], controller)
+        controller_name = controller.title().replace('-', '')
+        module = __import__(module_name,
+                            globals(),
+                            locals(),
+                            controller_name,
+                            -1)
+        action_controller = module.__dict__.get(controller_name)
+    except ImportError, e:
+        return DispatchPlan(None, action, error=e)
+
+    if action_controller is not None:
+        # apply the global init
+        application_module = \
+            __import__('%s.controllers.bootstrap' % settings.APP_DIR,
+                       globals(),
+                       locals(),
+                       'Bootstrap',
+                       -1)
+        bootstrap_clz = application_module.__dict__.get('Bootstrap')
+        if bootstrap_clz not in action_controller.__bases__:
+            action_controller.__bases__ += (bootstrap_clz, )
+
+    # warm up the view class lookup of the controllers
+    controller_module.get_view_class(settings.VIEW_CLASS)
+    return DispatchPlan(action_controller, action)
+
 
 class GaeoApp(object):
     """
@@ -179,9 +599,19 @@ class GaeoApp(object):
         """ Initialize the application."""
         self.__instance = self
         self.__router = self._init_router()
+        self.__local = threading.local()
+
+    # the request and response being handled by the current thread, for the
+    # code written against the single-threaded application.
+    request = property(lambda self: getattr(self.__local, 'request', None))
+    response = property(lambda self: getattr(self.__local, 'response', None))
         
     def __call__(self, environ, start_response):
         """Handles the call by a WSGI server.
+
+        The request state is kept in local variables (and a thread-local for
+        the request/response properties), so one application instance can
+        serve concurrent requests of a multithreaded server.
         
         Args:
             environ: a dict that contains CGI-style environment varialbes.
@@ -189,48 +619,68 @@ class GaeoApp(object):
                 returns a callable for writing out HTTP response body.
             
         Returns:
-            ['']. Note that the WSGI spec dictates that the app returns an
-            interable of strings. The framework would send each string to the
-            client unbuffered before getting the next string from the iterator.
+            [''], or the body chunks of a streamed response. Note that the
+            WSGI spec dictates that the app returns an interable of strings.
+            The framework would send each string to the client unbuffered
+            before getting the next string from the iterator.
         """
-        self.request = GaeoRequest(environ)
-        self.response = GaeoResponse()
-        
-        self._dispatch()
-        
-        if self.response.cookies:
-            for key, value in self.response.cookies.iteritems():
-                cookie = ['%s=%s' % (key, value), 
-                          'path=%s' % settings.SESSION_COOKIE_PATH]
-                domain_tokens = self.request.host.split('.')
-                domain = ''
-                if len(domain_tokens) == 1:
-                    if domain_tokens[0] != 'localhost':
-                        domain = domain_tokens[0]
-                else:
-                    domain = self.request.host
-                cookie.append('domain=%s' % domain)
-                self.response.headers.add_header('Set-Cookie', ';'.join(cookie))
+        request = GaeoRequest(environ)
+        response = GaeoResponse()
+        fragment_cache.reset_memo()
+        self.__local.request = request
+        self.__local.response = response
+        try:
+            self._dispatch(request, response)
             
-        self.response.wsgi_write(start_response)
+            if response.cookies:
+                for key, value in response.cookies.iteritems():
+                    cookie = ['%s=%s' % (key, value), 
+                              'path=%s' % settings.SESSION_COOKIE_PATH]
+                    domain_tokens = request.host.split('.')
+                    domain = ''
+                    if len(domain_tokens) == 1:
+                        if domain_tokens[0] != 'localhost':
+                            domain = domain_tokens[0]
+                    else:
+                        domain = request.host
+                    cookie.append('domain=%s' % domain)
+                    response.headers.add_header('Set-Cookie', ';'.join(cookie))
+                
+            body = response.wsgi_write(start_response, request)
+        finally:
+            self.__local.request = None
+            self.__local.response = None
+        if body is not None:
+            return body
         return ['']
 
-    def _dispatch(self):
+    def _dispatch(self, request, response):
         """Dispatch the request according to the request URI.
 
         This method identifies the controller and action from the URL path,
         creates the controller object with the right class, and calls the
         right action method of it. The controller's bootstrap(),
         before_action(), after_action() and complete() methods are called
-        at appropriate times.
+        at appropriate times. If the action is a generator, the chunks it
+        yields are streamed to the client. The actions decorated by
+        gaeo.cache.cache_action are answered from memcache when possible.
+
+        The method only works on its arguments, so it is safe to be called
+        by concurrent requests.
 
         If the controller class does not have the action specified in URL path
         and settings.HANDLE_MISSING_ACTION is True, the template named as
         {controller}/{action}.html is used for output.
 
+        Args:
+            request: the GaeoRequest object of the request.
+            response: the GaeoResponse object to write to.
+
         Sets HTTP status code:
          - 404: if the URL path doesn't match any routing rules or the
                 template for missing action doesn't exist.
+         - 405: if the URL path matches a RESTful rule which has no action
+                for the HTTP method. OPTIONS is answered with 200 instead.
          - 500: if an exception occurred while importing the controller
                 class or the bootstrap module.
 
@@ -238,81 +688,121 @@ class GaeoApp(object):
             Any exception that's raised and is not ImportError if
             settings.DEBUG is True.
         """
-        routing = self.__router.resolve(self.request.path)
-        if routing is None or routing[0] is None:
-            self.response.set_status(404, "Not Found")
+        routing = self.__router.route(request.path, request.method)
+        if routing is None:
+            response.set_status(404, "Not Found")
             return
 
-        route = routing[0]
-        
-        # check if RESTful
-        if routing[1] is not None:
-            method = self.request.method
-            route['action'] = routing[1].get(method, 'index')
+        route, allow = routing
+
+        # the RESTful rule has no action for the method
+        if route is None:
+            if request.method == 'OPTIONS':
+                response.set_status(200, 'OK')
+            else:
+                response.set_status(405, 'Method Not Allowed')
+            response.headers['Allow'] = allow
+            return
             
         if 'action' not in route:
             route['action'] = 'index'
         
         params = {}
-        for key, value in self.request.params.iteritems():
+        for key, value in request.params.iteritems():
             params[key] = value
         
         params.update(route)
-        action_controller = None
         try:
-            module_name = '%s.controllers.%s' % \
-                (settings.APP_DIR.split('/')[-1], route['controller'])
-            controller_name = route['controller'].title().replace('-', '')
-            module = __import__(module_name,
-                                globals(),
-                                locals(),
-                                controller_name,
-                                -1)
-            action_controller = module.__dict__.get(controller_name)
-        except ImportError, e:
-            logging.error('Cannot import the controller: %s', e)
-            self.response.set_status(500, 'Internal Server Error')
+            plan = get_dispatch_plan(route['controller'], route['action'])
+        except Exception, e:
+            if settings.DEBUG:
+                raise
+            response.set_status(500, 'Internal Server Error')
+            return
+
+        if plan.error is not None:
+            logging.error('Cannot import the controller: %s', plan.error)
+            response.set_status(500, 'Internal Server Error')
+            return
+
+        # serve the cached response before creating the controller
+        cacheable = plan.cache is not None and \
+            request.method in ('GET', 'HEAD')
+        # whether this request won the lock to recompute the response
+        locked = False
+        if cacheable:
+            entry, locked = action_cache.get(route['controller'],
+                                             route['action'], request,
+                                             plan.cache)
+            if entry is not None:
+                action_cache.write(entry, response)
+                return
+
+        ctrl = None
+        try:
+            # create the controller instance
+            ctrl = plan.controller(request, response, params=params)
+
+            # apply the global init
+            ctrl.bootstrap()
+
+            # invokes the action
+            action = plan.bind(ctrl)
+            if action:
+                if ctrl.before_action() is not False:
+                    result = action()
+                    if isinstance(result, types.GeneratorType):
+                        ctrl.stream(result)
+                    ctrl.after_action()
+                    ctrl.complete()
+                    if cacheable:
+                        self.__cache_response(route, request, response,
+                                              plan.cache, locked)
+                        locked = False
+            else:
+                # check if there is an appropriate template file
+                error404 = True
+                if settings.HANDLE_MISSING_ACTION:
+                    template_path = os.path.join(settings.TEMPLATE_PATH, route['controller'].lower(), route['action'].lower() + '.html')
+                    error404 = not ctrl.no_action(template_path, {})
+            
+                if error404:
+                    response.set_status(404, 'Not Found')
         except Exception, e:
             if settings.DEBUG:
                 raise
-            self.response.set_status(500, 'Internal Server Error')
+            response.set_status(500, 'Internal Server Error')
+        finally:
+            # the action was vetoed or failed, let another request recompute
+            if locked:
+                action_cache.release_response(route['controller'],
+                                              route['action'], request,
+                                              plan.cache)
+            if ctrl is not None:
+                self.__save_session(ctrl, response)
+
+    def __save_session(self, ctrl, response):
+        """Stores the session of the request once, if it was changed.
+
+        Controller.complete() has usually stored it already. The changes made
+        while a response is streamed are stored when the stream is closed,
+        except those which need a cookie (a new session, a CookieSession),
+        which can't be sent anymore: they are logged and dropped.
+        """
+        if response.stream is None:
+            ctrl.session.save()
         else:
-            try:
-                # create the controller instance
-                ctrl = action_controller(self.request, self.response, params=params)
-                
-                # apply the global init
-                application_module = \
-                    __import__('%s.controllers.bootstrap' % settings.APP_DIR,
-                               globals(),
-                               locals(),
-                               'Bootstrap',
-                               -1)
-                bootstrap_clz = application_module.__dict__.get('Bootstrap')
-                if bootstrap_clz not in action_controller.__bases__:
-                    action_controller.__bases__ += (bootstrap_clz, )
-                ctrl.bootstrap()
-                
-                # invokes the action
-                action = getattr(ctrl, route['action'], None)
-                if action:
-                    if ctrl.before_action() is not False:
-                        action()
-                        ctrl.after_action()
-                        ctrl.complete()
-                else:
-                    # check if there is an appropriate template file
-                    error404 = True
-                    if settings.HANDLE_MISSING_ACTION:
-                        template_path = os.path.join(settings.TEMPLATE_PATH, route['controller'].lower(), route['action'].lower() + '.html')
-                        error404 = not ctrl.no_action(template_path, {})
-                
-                    if error404:
-                        self.response.set_status(404, 'Not Found')
-            except Exception, e:
-                if settings.DEBUG:
-                    raise
-                self.response.set_status(500, 'Internal Server Error')
+            response.set_stream(_save_after(response.stream, ctrl.session))
+
+    def __cache_response(self, route, request, response, options, locked):
+        """Stores the response of a cached action if it can be reused, and
+        releases the recompute lock if the request won it."""
+        if response.status[0] == 200 and response.stream is None:
+            action_cache.put(route['controller'], route['action'],
+                             request, options, response, locked)
+        elif locked:
+            action_cache.release_response(route['controller'],
+                                          route['action'], request, options)
 
     @property
     def router(self):
@@ -321,15 +811,45 @@ class GaeoApp(object):
 
     def _init_router(self):      
         """Initializes the router's routing rules."""
-        the_router = router.Router()
-        route_config = yaml.safe_load(file(os.path.join(settings.ROOT_PATH, 'routes.yaml')))
-        for route in route_config.get('routes', []):
-            pattern = route.get('rule', '')
-            matches = route.get('regex', [])
-            params = route.get('parameters', {})
+        the_router = router.Router(
+            cache_size=getattr(settings, 'ROUTE_CACHE_SIZE', 1000))
+        for pattern, matches, params in self._load_routes():
             the_router.add(router.RoutingRule(pattern, *matches, **params))
         return the_router
 
+    def _load_routes(self):
+        """Loads the routing rules of the application.
+
+        The compiled routing table is used if it was built from the current
+        routes.yaml, otherwise routes.yaml is parsed (and PyYAML imported).
+
+        Returns:
+            A list of (pattern, regex group names, parameters) tuples.
+        """
+        source = file(os.path.join(settings.ROOT_PATH, 'routes.yaml')).read()
+        try:
+            compiled = __import__(COMPILED_ROUTES_MODULE,
+                                  globals(),
+                                  locals(),
+                                  [],
+                                  -1)
+        except ImportError:
+            compiled = None
+
+        if compiled is not None:
+            if getattr(compiled, 'ROUTES_HASH', None) == \
+                    hashlib.sha1(source).hexdigest():
+                return compiled.ROUTES
+            logging.warning('%s is stale, run `gaeo compile-routes` again.',
+                            COMPILED_ROUTES_MODULE)
+
+        import yaml
+        route_config = yaml.safe_load(source) or {}
+        return [(route.get('rule', ''),
+                 route.get('regex', []),
+                 route.get('parameters', {}))
+                for route in route_config.get('routes', [])]
+
 
 def _start_response(status, headers, exc_info=None):
     """The default start_response callback of GAEO per WSGI spec (PEP-333).
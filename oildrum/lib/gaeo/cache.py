@@ -0,0 +1,541 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" GAEO cache module.
+
+Classes:
+    CacheOptions: The caching options of an action.
+    CoalescingCache: The memcache-backed cache which coalesces recomputes.
+    ActionCache: The memcache-backed full-response cache of actions.
+    FragmentCache: The memcache-backed cache of rendered template fragments.
+    ContentCache: The memoized outputs of content transforms, e.g. safeout().
+
+Functions:
+    cache_action: The decorator to cache the responses of an action.
+
+Data:
+    action_cache: The ActionCache instance used by the dispatcher.
+    fragment_cache: The FragmentCache instance used by the {% cache %} tag.
+    content_cache: The ContentCache instance used by gaeo.utils.BBCodeParser.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+
+# google app engine imports
+from google.appengine.api import memcache
+
+# App imports
+import settings
+from gaeo.utils import LRUCache
+
+
+class CacheOptions(object):
+    """
+    The caching options of an action, see cache_action().
+    """
+
+    def __init__(self, ttl=None, params=None, vary=None):
+        self.ttl = ttl
+        self.params = params
+        self.vary = vary
+
+    @property
+    def timeout(self):
+        """Gets the TTL in seconds, defaults to settings.CACHE_TIMEOUT."""
+        if self.ttl is not None:
+            return self.ttl
+        return getattr(settings, 'CACHE_TIMEOUT', 3600)
+
+
+def cache_action(ttl=None, params=None, vary=None):
+    """Caches the full responses of the decorated action in memcache.
+
+    The GET and HEAD requests of a cached action are answered from memcache
+    before the controller (and its session) is created. Only 200 responses
+    that are not streamed are stored, without their Set-Cookie headers. The
+    concurrent recomputes of an expired response are coalesced, see
+    CoalescingCache.
+
+        class Post(Controller):
+            @cache_action(ttl=600, params=['page'])
+            def index(self):
+                ...
+
+    Args:
+        ttl: [optional] the seconds to keep the response, defaults to
+            settings.CACHE_TIMEOUT.
+        params: [optional] the names of the request parameters that select the
+            response, the whole query string is used if it is None.
+        vary: [optional] the names of the request headers that select the
+            response, e.g. ['Accept-Language'].
+    """
+    def decorator(action):
+        action.cache_options = CacheOptions(ttl, params, vary)
+        return action
+    return decorator
+
+
+class CoalescingCache(object):
+    """
+    The memcache-backed cache which coalesces the recomputes of an entry.
+
+    The entries expire softly: they are kept in memcache for
+    settings.CACHE_STALE_TIMEOUT seconds past their TTL. When an entry is
+    stale or missing, a single request is elected to recompute it by a
+    memcache add() of a lock with a lease of settings.CACHE_LOCK_TIMEOUT
+    seconds. Meanwhile the other requests get the stale copy, or wait up to
+    settings.CACHE_LOCK_WAIT seconds for the new entry before giving up and
+    computing it themselves.
+
+    Only the request which won the lock releases it, so a request which gave
+    up waiting never frees the lock of the request still recomputing.
+
+    Public data:
+        client: the memcache client, any object with get(), get_multi(),
+            set(), add() and delete() of google.appengine.api.memcache works.
+        stats: the counters of this process, a dict of:
+            hits: fresh entries served.
+            misses: entries computed by the request.
+            stale_hits: stale entries served while another request recomputes.
+            coalesced: requests served by another request's recompute, that
+                is the stale hits plus the successful waits.
+            lock_waits: requests which waited for another request's recompute.
+            lock_timeouts: waits which ended without an entry.
+    """
+    # seconds between the polls while waiting for a recompute
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, client=None, prefix='gaeo.cache'):
+        """Initializer.
+
+        Args:
+            client: [optional] the memcache client, defaults to the
+                google.appengine.api.memcache module.
+            prefix: the prefix of the memcache keys.
+        """
+        self.client = client if client is not None else memcache
+        self._prefix = prefix
+        self.stats = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Resets the counters to zero."""
+        for name in ('hits', 'misses', 'stale_hits', 'coalesced',
+                     'lock_waits', 'lock_timeouts'):
+            self.stats[name] = 0
+
+    def _lock_key(self, key):
+        return '%s.lock' % key
+
+    def _resolve(self, key, entry, refetch):
+        """Decides whether the request serves the entry or recomputes it.
+
+        Args:
+            key: the memcache key of the entry.
+            entry: the valid entry in memcache, or None.
+            refetch: the callable to get the valid entry again, or None.
+
+        Returns:
+            A tuple of (entry, locked). The entry to serve, or None if the
+            request should compute it; locked is True if the request won the
+            recompute lock, and then it must release it.
+        """
+        now = time.time()
+        if entry is not None and entry['expires'] > now:
+            self.stats['hits'] += 1
+            return entry, False
+
+        lease = getattr(settings, 'CACHE_LOCK_TIMEOUT', 10)
+        if self.client.add(self._lock_key(key), 1, time=lease):
+            self.stats['misses'] += 1
+            return None, True
+
+        if entry is not None:
+            self.stats['stale_hits'] += 1
+            self.stats['coalesced'] += 1
+            return entry, False
+
+        self.stats['lock_waits'] += 1
+        deadline = now + getattr(settings, 'CACHE_LOCK_WAIT', 0.5)
+        while time.time() < deadline:
+            time.sleep(self.POLL_INTERVAL)
+            entry = refetch()
+            if entry is not None:
+                self.stats['coalesced'] += 1
+                return entry, False
+
+        self.stats['lock_timeouts'] += 1
+        self.stats['misses'] += 1
+        return None, False
+
+    def _store(self, key, entry, ttl, locked):
+        """Stores the entry and releases the recompute lock if it's held.
+
+        Args:
+            key: the memcache key of the entry.
+            entry: the dict to store, its 'expires' item is set.
+            ttl: the seconds the entry stays fresh.
+            locked: whether the request won the recompute lock.
+        """
+        entry['expires'] = time.time() + ttl
+        stale = getattr(settings, 'CACHE_STALE_TIMEOUT', 60)
+        stored = self.client.set(key, entry, time=ttl + stale)
+        if locked:
+            self.release(key)
+        return stored
+
+    def release(self, key):
+        """Releases the recompute lock of the entry without storing it.
+
+        Only the request which won the lock may release it.
+        """
+        self.client.delete(self._lock_key(key))
+
+
+class ActionCache(CoalescingCache):
+    """
+    The memcache-backed full-response cache of actions.
+
+    Every (controller, action) pair has a version number in memcache, stored
+    along with its cached responses; expire() bumps the version and thereby
+    invalidates all the responses of the action at once.
+    """
+
+    def __init__(self, client=None, prefix='gaeo.action'):
+        """Initializer.
+
+        Args:
+            client: [optional] the memcache client, defaults to the
+                google.appengine.api.memcache module.
+            prefix: the prefix of the memcache keys.
+        """
+        super(ActionCache, self).__init__(client, prefix)
+
+    def version_key(self, controller, action):
+        """Gets the memcache key of the version of the action."""
+        return '%s.version:%s/%s' % (self._prefix, controller, action)
+
+    def response_key(self, controller, action, request, options):
+        """Gets the memcache key of the cached response for the request.
+
+        Args:
+            controller: the controller name.
+            action: the action name.
+            request: the GaeoRequest object.
+            options: the CacheOptions of the action.
+        """
+        if options.params is None:
+            params = sorted(request.GET.items())
+        else:
+            params = [(name, request.params.getall(name))
+                      for name in options.params]
+        vary = [(name, request.headers.get(name))
+                for name in (options.vary or [])]
+        digest = hashlib.sha1(repr((request.path, params, vary))).hexdigest()
+        return '%s:%s/%s:%s' % (self._prefix, controller, action, digest)
+
+    def get(self, controller, action, request, options):
+        """Gets the cached response for the request.
+
+        A stale response may be returned while another request recomputes it.
+        If no response is returned, the request is expected to compute the
+        response and put() it; if it won the recompute lock and doesn't put()
+        the response, it must release_response() the lock.
+
+        Returns:
+            A tuple of (entry, locked): a dict with the status, headers and
+            body of the response, or None; and whether the request won the
+            recompute lock.
+        """
+        key = self.response_key(controller, action, request, options)
+        version_key = self.version_key(controller, action)
+
+        def fetch():
+            found = self.client.get_multi([key, version_key])
+            entry = found.get(key)
+            if entry is None or found.get(version_key) is None or \
+                    entry['version'] != found[version_key]:
+                return None
+            return entry
+
+        return self._resolve(key, fetch(), fetch)
+
+    def put(self, controller, action, request, options, response,
+            locked=False):
+        """Stores the response of the request.
+
+        Args:
+            controller: the controller name.
+            action: the action name.
+            request: the GaeoRequest object.
+            options: the CacheOptions of the action.
+            response: the GaeoResponse object, with its body buffered.
+            locked: whether the request won the recompute lock, which is
+                released then.
+        """
+        key = self.response_key(controller, action, request, options)
+        version_key = self.version_key(controller, action)
+        version = self.client.get(version_key)
+        if version is None:
+            # a fresh number, so the responses cached under an evicted
+            # version never become valid again.
+            version = int(time.time() * 1000)
+            if not self.client.add(version_key, version):
+                version = self.client.get(version_key)
+                if version is None:
+                    if locked:
+                        self.release(key)
+                    return
+
+        entry = {
+            'version': version,
+            'status': response.status,
+            'headers': [(name, value) for name, value in response.headers.items()
+                        if name.lower() != 'set-cookie'],
+            'body': response.out.getvalue(),
+        }
+        if not self._store(key, entry, options.timeout, locked):
+            logging.warning('Cannot cache the response of %s/%s.',
+                            controller, action)
+
+    def release_response(self, controller, action, request, options):
+        """Releases the recompute lock won by get() when the response is not
+        stored."""
+        self.release(self.response_key(controller, action, request, options))
+
+    def expire(self, controller, action):
+        """Invalidates all the cached responses of the action.
+
+        Args:
+            controller: the controller name.
+            action: the action name.
+        """
+        self.client.delete(self.version_key(controller, action))
+
+    @staticmethod
+    def write(entry, response):
+        """Writes the cached response into the GaeoResponse object."""
+        response.set_status(*entry['status'])
+        for name in set(name for name, value in entry['headers']):
+            del response.headers[name]
+        for name, value in entry['headers']:
+            response.headers.add_header(name, value)
+        response.out.write(entry['body'])
+
+
+class FragmentCache(CoalescingCache):
+    """
+    The memcache-backed cache of rendered template fragments.
+
+    On top of memcache, the fragments are memoized for the current request
+    (per thread), so a fragment is rendered at most once per response.
+    """
+
+    def __init__(self, client=None, prefix='gaeo.fragment'):
+        """Initializer.
+
+        Args:
+            client: [optional] the memcache client, defaults to the
+                google.appengine.api.memcache module.
+            prefix: the prefix of the memcache keys.
+        """
+        super(FragmentCache, self).__init__(client, prefix)
+        self._local = threading.local()
+
+    def reset_memo(self):
+        """Forgets the fragments memoized for the previous request."""
+        self._local.memo = {}
+
+    def __memo(self):
+        memo = getattr(self._local, 'memo', None)
+        if memo is None:
+            memo = self._local.memo = {}
+        return memo
+
+    def fragment_key(self, name, vary=()):
+        """Gets the memcache key of a fragment.
+
+        Args:
+            name: the name of the fragment.
+            vary: the values which select the variant of the fragment.
+        """
+        parts = [name] + [unicode(value) for value in vary]
+        digest = hashlib.sha1(repr(parts)).hexdigest()
+        return '%s:%s' % (self._prefix, digest)
+
+    def get(self, key):
+        """Gets the rendered fragment.
+
+        If no fragment is returned, the caller is expected to render the
+        fragment and put() it; if it won the recompute lock and fails to
+        render the fragment, it must release() the lock.
+
+        Returns:
+            A tuple of (content, locked): the fragment or None, and whether
+            the caller won the recompute lock.
+        """
+        content = self.__memo().get(key)
+        if content is not None:
+            return content, False
+
+        entry, locked = self._resolve(key, self.client.get(key),
+                                      lambda: self.client.get(key))
+        if entry is None:
+            return None, locked
+        self.__memo()[key] = entry['content']
+        return entry['content'], False
+
+    def put(self, key, content, ttl=None, locked=False):
+        """Stores the rendered fragment.
+
+        Args:
+            key: the key from fragment_key().
+            content: the rendered fragment.
+            ttl: [optional] the seconds to keep the fragment, defaults to
+                settings.CACHE_TIMEOUT.
+            locked: whether the caller won the recompute lock, which is
+                released then.
+        """
+        if ttl is None:
+            ttl = getattr(settings, 'CACHE_TIMEOUT', 3600)
+        self.__memo()[key] = content
+        self._store(key, {'content': content}, ttl, locked)
+
+    def expire(self, name, vary=()):
+        """Invalidates a fragment.
+
+        Args:
+            name: the name of the fragment.
+            vary: the values which select the variant of the fragment.
+        """
+        key = self.fragment_key(name, vary)
+        self.__memo().pop(key, None)
+        self.client.delete(key)
+
+
+class ContentCache(object):
+    """
+    The memoized outputs of content transforms, keyed by the input's hash.
+
+    The outputs are kept in a bounded in-process LRU cache, and if use_memcache
+    is set, in memcache as well so the processes share them. The key is the
+    SHA-1 digest of the input along with the transform's name, which carries
+    its version, so a new version of a transform never gets stale outputs.
+
+    Public data:
+        client: the memcache client, any object with get() and set() of
+            google.appengine.api.memcache works.
+        use_memcache: whether memcache is used behind the LRU cache.
+        stats: the counters of this process, a dict of:
+            hits: outputs found in the LRU cache.
+            memcache_hits: outputs found in memcache.
+            misses: outputs computed by the transform.
+    """
+
+    def __init__(self, capacity=None, use_memcache=None, client=None,
+                 prefix='gaeo.content'):
+        """Initializer.
+
+        Args:
+            capacity: [optional] the number of outputs kept in the process,
+                defaults to settings.CONTENT_CACHE_SIZE, 0 disables the cache.
+            use_memcache: [optional] whether memcache is used, defaults to
+                settings.CONTENT_CACHE_MEMCACHE.
+            client: [optional] the memcache client, defaults to the
+                google.appengine.api.memcache module.
+            prefix: the prefix of the memcache keys.
+        """
+        if capacity is None:
+            capacity = getattr(settings, 'CONTENT_CACHE_SIZE', 1000)
+        if use_memcache is None:
+            use_memcache = getattr(settings, 'CONTENT_CACHE_MEMCACHE', False)
+        self._local = LRUCache(capacity)
+        self.use_memcache = use_memcache
+        self.client = client if client is not None else memcache
+        self._prefix = prefix
+        self.stats = {}
+        self.reset_stats()
+
+    def __len__(self):
+        return len(self._local)
+
+    @property
+    def capacity(self):
+        return self._local.capacity
+
+    def reset_stats(self):
+        """Resets the counters to zero."""
+        for name in ('hits', 'memcache_hits', 'misses'):
+            self.stats[name] = 0
+
+    def hit_rate(self):
+        """Gets the ratio of the outputs which were not computed, or None."""
+        total = sum(self.stats.values())
+        if not total:
+            return None
+        return 1.0 - float(self.stats['misses']) / total
+
+    def key(self, transform, value):
+        """Gets the key of the output of a transform.
+
+        Args:
+            transform: the name of the transform, including its version.
+            value: the input string.
+        """
+        if isinstance(value, unicode):
+            digest = hashlib.sha1(value.encode('utf-8')).hexdigest()
+            return '%s:%s:u:%s' % (self._prefix, transform, digest)
+        return '%s:%s:s:%s' % (self._prefix, transform,
+                               hashlib.sha1(value).hexdigest())
+
+    def render(self, transform, func, value):
+        """Gets the output of a transform, computing it if it isn't cached.
+
+        Args:
+            transform: the name of the transform, including its version.
+            func: the transform, called with the input if the output isn't
+                cached.
+            value: the input string.
+
+        Returns:
+            The output of func(value).
+        """
+        if self._local.capacity <= 0 or \
+                not isinstance(value, basestring):
+            return func(value)
+
+        key = self.key(transform, value)
+        output = self._local.get(key)
+        if output is not None:
+            self.stats['hits'] += 1
+            return output
+
+        if self.use_memcache:
+            output = self.client.get(key)
+            if output is not None:
+                self.stats['memcache_hits'] += 1
+                self._local.put(key, output)
+                return output
+
+        self.stats['misses'] += 1
+        output = func(value)
+        self._local.put(key, output)
+        if self.use_memcache:
+            self.client.set(key, output,
+                            time=getattr(settings, 'CACHE_TIMEOUT', 3600))
+        return output
+
+    def clear(self):
+        """Forgets the outputs kept in the process."""
+        self._local.clear()
+
+
+# the ActionCache used by the dispatcher.
+action_cache = ActionCache()
+# the FragmentCache used by the {% cache %} template tag.
+fragment_cache = FragmentCache()
+# the ContentCache used by gaeo.utils.BBCodeParser.
+content_cache = ContentCache()
@@ -5,6 +5,9 @@
 
 Classes:
     Controller:
+
+Functions:
+    get_view_class: Gets the view class by its name in gaeo.view.
 """
 
 import logging
@@ -13,11 +16,38 @@ import time
 import urllib
 
 # GAEO imports
-from gaeo.session import Session
+from gaeo.cache import action_cache
+from gaeo.session import LazySession
 
 # App imports
 import settings
 
+# view class name -> view class, resolved once per process.
+_VIEW_CLASSES = {}
+
+
+def get_view_class(name):
+    """Gets the view class by its name in the gaeo.view module.
+
+    Args:
+        name: the name of the view class, e.g. settings.VIEW_CLASS.
+
+    Returns:
+        The view class, or None if gaeo.view has no such class.
+    """
+    clz = _VIEW_CLASSES.get(name)
+    if clz is None:
+        module = __import__('gaeo.view',
+                            globals(),
+                            locals(),
+                            name,
+                            -1)
+        clz = module.__dict__.get(name)
+        if clz is not None:
+            _VIEW_CLASSES[name] = clz
+    return clz
+
+
 class Controller(object):
     """
     The GAEO Controller class.
@@ -55,12 +85,7 @@ class Controller(object):
         
         # initial the view instance
         try:
-            module = __import__('gaeo.view',
-                                globals(),
-                                locals(),
-                                settings.VIEW_CLASS,
-                                -1)
-            clz = module.__dict__.get(settings.VIEW_CLASS)
+            clz = get_view_class(settings.VIEW_CLASS)
             self.view = clz(self)
         except ImportError, e:
             logging.error('Cannot initialize the view instance: %s', e)
@@ -115,6 +140,64 @@ class Controller(object):
             self.response.out.write(h)
         self._rendered = True
 
+    def stream(self, chunks):
+        """Streams the chunks to the client without buffering them.
+
+        Anything written by output() meanwhile is sent in between the chunks.
+        An action may also just yield the chunks instead of calling this
+        method.
+
+        Args:
+            chunks: an iterable (e.g. a generator) of strings to be written out.
+
+        Side effect:
+            Marks this request as rendered.
+        """
+        self.response.set_stream(chunks)
+        self._rendered = True
+
+    def not_modified(self, etag=None, last_modified=None):
+        """Declares the validators of the response and checks the request.
+
+        Call it before doing the expensive work of an action:
+
+            if self.not_modified(etag=post.version):
+                return
+
+        Args:
+            etag: [optional] the entity tag of the content.
+            last_modified: [optional] the datetime in UTC or POSIX timestamp
+                when the content was last modified.
+
+        Returns:
+            True if the client's cached copy is still valid. The response is
+            then a 304 Not Modified and the request is marked as rendered.
+        """
+        if etag is not None:
+            self.response.set_etag(etag)
+        if last_modified is not None:
+            self.response.set_last_modified(last_modified)
+
+        if self.response.is_not_modified(self.request):
+            self.response.set_status(304, 'Not Modified')
+            self.response.clear()
+            self._rendered = True
+            return True
+        return False
+
+    def expire_action(self, action=None, controller=None):
+        """Invalidates the cached responses of an action.
+
+        See gaeo.cache.cache_action.
+
+        Args:
+            action: [optional] the action name, defaults to the current one.
+            controller: [optional] the controller name, defaults to the
+                current one.
+        """
+        action_cache.expire(controller or self.params['controller'],
+                            action or self.params['action'])
+
     def set_no_render(self):
         """Marks this request as rendered."""
         self._rendered = True
@@ -136,10 +219,12 @@ class Controller(object):
     def complete(self):
         """Completes the rendering.
         
-        Asks the view to render itself if the request isn't marked as rendered.
+        Asks the view to render itself if the request isn't marked as rendered,
+        then stores the session if it was changed.
         """
         if not self._rendered:
             self.view.render()
+        self.session.save()
 
     def no_action(self, template_path='', params={}):
         """Handles the request when no action method is found.
@@ -173,7 +258,15 @@ class Controller(object):
             name: the name of the cookie.
             value: the value of the cookie.
             max_age: [optional] the maximum age of the cookie before it expires.
+
+        Returns:
+            False if the response headers are already sent (e.g. while the
+            response is streamed), the cookie is not set then.
         """
+        if self.response.headers_sent:
+            logging.error('Cannot set the cookie %s, the response headers '
+                          'are already sent.', name)
+            return False
         cookie_data = [
             '%s=%s' % (name, value),
             'path=%s' % settings.SESSION_COOKIE_PATH
@@ -189,25 +282,19 @@ class Controller(object):
         cookie_str = '; '.join(cookie_data)
         self.response.headers.add_header('Set-Cookie', cookie_str)
         logging.debug("Set-Cookie: %s" % cookie_str)
+        return True
 
     def _get_session(self):
         """Returns the session object for this request.
 
-        1. If the session cookie is present in HTTP header, return the session
-           associated with the cookie.
-        2. Otherwise return a newly created session object with its cookie
-           inserted into the HTTP header.
+        The session is a LazySession:
+        1. If the session cookie is present in HTTP header, the session
+           associated with the cookie is fetched when it is first used.
+        2. Otherwise a new session is created, and its cookie inserted into
+           the HTTP header, when it is first written.
         """
-        session = None
-        session_key = settings.SESSION_COOKIE_NAME
-        if session_key in self.cookies:
-            session = Session(key=self.cookies[session_key], 
-                              controller=self)
-        
-        if session is None:
-            session = Session(controller=self)
-        
-        return session
+        key = self.cookies.get(settings.SESSION_COOKIE_NAME) or None
+        return LazySession(self, key)
 
     def __appender(self, dict, arr, value):
         """Sets dict[arr[0]][arr[1]]...[arr[N-1]] = value.
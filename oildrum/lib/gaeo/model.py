@@ -6,6 +6,15 @@ import logging
 # gae imports
 from google.appengine.ext import db
 
+# the most entities the datastore takes in one batch call
+MAX_BATCH_SIZE = 500
+
+
+def batches(entities):
+    """Splits the entities into lists of at most MAX_BATCH_SIZE entities."""
+    for i in xrange(0, len(entities), MAX_BATCH_SIZE):
+        yield entities[i:i + MAX_BATCH_SIZE]
+
 
 class DatastoreModel(db.Model):
     """
@@ -51,6 +60,86 @@ class DatastoreModel(db.Model):
     # alias
     update = put
 
+    def before_delete(self):
+        """The template method called before deleting the entity from DataStore.
+
+        This is a template method pattern. It is a hook that self.delete()
+        calls before actually deleting the entity from DataStore.
+
+        Returns:
+            False if the entity should NOT be deleted from DataStore.
+        """
+        return True
+
+    def after_delete(self):
+        """The template method called after deleting the entity from DataStore.
+
+        This is a template method pattern. It is a hook that self.delete()
+        calls after the entity is deleted from DataStore.
+        """
+        pass
+
+    def delete(self, **kwargs):
+        """Deletes the entity from DataStore.
+
+        Args:
+            **kwargs: the keyword arguments to be passed to db.Model.delete().
+        """
+        if self.before_delete() is not False:
+            if kwargs:
+                super(DatastoreModel, self).delete(**kwargs)
+            else:
+                super(DatastoreModel, self).delete()
+            self.after_delete()
+
+    @classmethod
+    def put_multi(cls, entities, **kwargs):
+        """Puts the entities to DataStore in batches, running their hooks.
+
+        Unlike db.put(), which skips the hooks, the before_put() of every
+        entity is called first and the entities it vetoes are left out. The
+        others are put with one datastore call per MAX_BATCH_SIZE entities,
+        then their after_put() is called.
+
+        Args:
+            entities: a list of DatastoreModel entities, of any kinds.
+            **kwargs: the keyword arguments to be passed to db.put().
+
+        Returns:
+            the keys of the entities put into DataStore, in order.
+        """
+        entities = [entity for entity in entities
+                    if entity.before_put() is not False]
+        keys = []
+        for batch in batches(entities):
+            keys.extend(db.put(batch, **kwargs))
+            for entity in batch:
+                entity.after_put()
+        return keys
+
+    @classmethod
+    def delete_multi(cls, entities, **kwargs):
+        """Deletes the entities from DataStore in batches, running their hooks.
+
+        The before_delete() of every entity is called first and the entities
+        it vetoes are left out. The others are deleted with one datastore
+        call per MAX_BATCH_SIZE entities, then their after_delete() is called.
+
+        Args:
+            entities: a list of DatastoreModel entities, of any kinds.
+            **kwargs: the keyword arguments to be passed to db.delete().
+
+        Returns:
+            the number of entities deleted from DataStore.
+        """
+        entities = [entity for entity in entities
+                    if entity.before_delete() is not False]
+        for batch in batches(entities):
+            db.delete(batch, **kwargs)
+            for entity in batch:
+                entity.after_delete()
+        return len(entities)
+
     def set_attributes(self, **attrs):
         """TODO: document this method.
         """
@@ -5,6 +5,7 @@
 
 Classes:
     RoutingRule
+    RestfulRouting
     Router
 """
 
@@ -13,6 +14,23 @@ import operator
 import re
 import logging
 
+# gaeo imports
+from gaeo.utils import LRUCache
+
+
+# a pattern segment that can be matched by plain string comparison.
+_LITERAL_SEGMENT = re.compile(r'^[\w\-~%]*$')
+# a pattern segment that is exactly one inline parameter, e.g. ':controller'.
+_PARAM_SEGMENT = re.compile(r'^:([^/.]+)$')
+# the characters the inline parameter regex ([^/.]+) refuses to match.
+_PARAM_EXCLUDED = ('/', '.')
+# the regex quantifiers which would bind to a preceding '/'.
+_QUANTIFIERS = ('*', '+', '?', '{')
+# the marker of a path not in the resolution cache.
+_MISSING = object()
+# the HTTP methods a RESTful routing can map to actions.
+RESTFUL_METHODS = ('get', 'post', 'put', 'delete', 'head', 'patch')
+
 
 class RoutingRule(object):
     """
@@ -51,6 +69,83 @@ class RoutingRule(object):
         if not self._regex.endswith('$'):
             self._regex = self._regex + '$'
 
+        self._compiled = re.compile(self._regex)
+        self._segments = self.__split_segments(matches)
+
+    def __split_segments(self, matches):
+        """Splits the pattern into segments the routing trie can walk.
+
+        Args:
+            matches: the explicit regex group names of the rule.
+
+        Returns:
+            A list of (is_param, value) tuples, one per '/'-separated segment,
+            where value is the literal text or the inline parameter name.
+            None if the pattern contains regex constructs and has to be matched
+            by its compiled RegEx instead.
+        """
+        if matches:
+            return None
+
+        # the RegEx transform above replaces ':id' inside ':identifier' too,
+        # leave such patterns to the RegEx to keep the same params.
+        for name in self.__inlines:
+            for other in self.__inlines:
+                if other != name and other.startswith(name):
+                    return None
+
+        segments = []
+        for segment in self._pattern.split('/'):
+            param = _PARAM_SEGMENT.match(segment)
+            if param:
+                segments.append((True, param.group(1)))
+            elif _LITERAL_SEGMENT.match(segment):
+                segments.append((False, segment))
+            else:
+                return None
+        return segments
+
+    def literal_prefix(self):
+        """Gets the leading literal segments of the pattern.
+
+        Any URL matched by the rule must start with these segments, so a rule
+        that has to be matched by RegEx only needs to be tried for URLs that
+        share the prefix.
+
+        Returns:
+            A (possibly empty) list of literal segments.
+        """
+        if '|' in self._pattern:
+            return []
+
+        parts = self._pattern.split('/')
+        prefix = []
+        for segment in parts[:-1]:
+            if not _LITERAL_SEGMENT.match(segment):
+                break
+            prefix.append(segment)
+
+        # a quantifier right after the separator makes the '/' optional.
+        while prefix and parts[len(prefix)][:1] in _QUANTIFIERS:
+            prefix.pop()
+        return prefix
+
+    def build_params(self, values):
+        """Builds the params dict from the values of the inline parameters.
+
+        Only valid for the rules that can be walked by the routing trie.
+
+        Args:
+            values: the matched URL segments, in the order of the inlines.
+
+        Returns:
+            The params dict, the same as match_url() gives.
+        """
+        params = copy(self._args)
+        for i in xrange(len(values)):
+            params[self._matches[i][1]] = values[i]
+        return params
+
     def match_url(self, uri):
         """Check if the URL is mapped to this rule. 
 
@@ -61,7 +156,7 @@ class RoutingRule(object):
             TODO: document the return value.
         """
         url = uri[:-1] if uri.endswith('/') else uri
-        matches = re.findall(self._regex, url)
+        matches = self._compiled.findall(url)
         params = None
         if matches:
             params = copy(self._args)
@@ -82,15 +177,152 @@ class RoutingRule(object):
         return self._regex == other._regex
 
 
+class RestfulRouting(dict):
+    """
+    The RESTful actions of a routing rule, keyed by the upper-case HTTP method.
+
+    HEAD is served by the GET action unless it is mapped explicitly, OPTIONS
+    is always allowed and answered by the framework.
+
+    Public data:
+        allow: the value of the Allow header for the rule.
+    """
+
+    def __init__(self, actions):
+        """Initializer.
+
+        Args:
+            actions: a dict of HTTP method -> action name.
+        """
+        super(RestfulRouting, self).__init__()
+        for method, action in actions.iteritems():
+            self[method.upper()] = action
+        if 'GET' in self and 'HEAD' not in self:
+            self['HEAD'] = self['GET']
+        self.allow = ', '.join(sorted(set(self.keys()) | set(['OPTIONS'])))
+
+
+class _RouteNode(object):
+    """
+    A node of the routing trie, keyed by one URL segment.
+    """
+    __slots__ = ('static', 'param', 'rules', 'fallbacks')
+
+    def __init__(self):
+        # literal segment -> _RouteNode
+        self.static = {}
+        # the child node matching any inline parameter
+        self.param = None
+        # (order, rule) ending at this node
+        self.rules = []
+        # (order, rule) matched by RegEx, sharing the literal prefix
+        self.fallbacks = []
+
+
+class RouteIndex(object):
+    """
+    The compiled routing table.
+
+    Rules whose patterns consist of literal segments and ':param' inlines are
+    stored in a segment trie; the other rules are matched by their compiled
+    RegEx, but only for the URLs sharing the rule's literal prefix. The cost of
+    resolving a URL depends on its depth instead of the number of rules.
+    """
+
+    def __init__(self, rules):
+        """Compiles the routing table.
+
+        Args:
+            rules: a list of (RoutingRule, restful routing) tuples, in the
+                order of precedence.
+        """
+        self._root = _RouteNode()
+        for order in xrange(len(rules)):
+            self.__insert(order, rules[order][0])
+
+    def __insert(self, order, rule):
+        node = self._root
+        if rule._segments is None:
+            for segment in rule.literal_prefix():
+                node = node.static.setdefault(segment, _RouteNode())
+            node.fallbacks.append((order, rule))
+            return
+
+        for is_param, value in rule._segments:
+            if is_param:
+                if node.param is None:
+                    node.param = _RouteNode()
+                node = node.param
+            else:
+                node = node.static.setdefault(value, _RouteNode())
+        node.rules.append((order, rule))
+
+    def candidates(self, uri):
+        """Finds the rules that may match the URL.
+
+        Args:
+            uri: the path of the request.
+
+        Returns:
+            A list of (order, rule, values) tuples sorted by order. values is
+            the list of inline parameter values for the trie-matched rules, or
+            None if the rule has to be matched by match_url().
+        """
+        url = uri[:-1] if uri.endswith('/') else uri
+        segments = url.split('/')
+        found = []
+
+        # RegEx rules along the literal prefix of the URL
+        node = self._root
+        found.extend((o, r, None) for o, r in node.fallbacks)
+        for segment in segments:
+            node = node.static.get(segment)
+            if node is None:
+                break
+            found.extend((o, r, None) for o, r in node.fallbacks)
+
+        self.__walk(self._root, segments, 0, [], found)
+        found.sort(key=operator.itemgetter(0))
+        return found
+
+    def __walk(self, node, segments, depth, values, found):
+        if depth == len(segments):
+            found.extend((o, r, values) for o, r in node.rules)
+            return
+
+        segment = segments[depth]
+        child = node.static.get(segment)
+        if child is not None:
+            self.__walk(child, segments, depth + 1, values, found)
+
+        if node.param is not None and segment:
+            for c in _PARAM_EXCLUDED:
+                if c in segment:
+                    return
+            self.__walk(node.param, segments, depth + 1,
+                        values + [segment], found)
+
+
 class Router(object):
     """
     The request router class.
     """
-    __rules = []
 
-    def __init__(self):
-        """Initializer."""
-        pass
+    def __init__(self, cache_size=1000):
+        """Initializer.
+
+        Args:
+            cache_size: the maximum number of paths whose resolution is cached,
+                0 disables the cache.
+        """
+        self.__rules = []
+        self.__index = None
+        self.__cache = LRUCache(cache_size)
+
+    def __invalidate(self):
+        """Drops the compiled routing table and the resolution cache."""
+        self.__index = None
+        self.__cache.clear()
 
     def add(self, rule):
         """Adds the routing rule into the Router.
@@ -102,6 +334,7 @@ class Router(object):
         """
         if rule not in (x[0] for x in self.__rules):
             self.__rules.append((rule, None))
+            self.__invalidate()
 
     def remove(self, rule):
         """Removes the routing rule from the Router.
@@ -113,34 +346,105 @@ class Router(object):
         """
         for r in self.__rules:
             if r[0] == rule:
-                self.__rules.remove(rule)
+                self.__rules.remove(r)
+                self.__invalidate()
                 break
 
     def resolve(self, uri):
         """Finds the rule that matches to the URL.
 
+        The rules are tried in the order they were added, and the first one
+        that matches wins. The resolution is cached by the normalized path, the
+        caller gets its own copy of the params so it's free to modify them.
+
         Args:
             uri: The full URL of the request.
 
         Returns:
-            TODO: document the return value.   
+            A (params, restful routing) tuple, where params is the dict of the
+            routing parameters and restful routing is the dict of the RESTful
+            actions or None. None if no rule matches the URL.
         """
-        for rule in self.__rules:
-            params = rule[0].match_url(uri)
+        path = uri[:-1] if uri.endswith('/') else uri
+        routing = self.__cache.get(path, _MISSING)
+        if routing is _MISSING:
+            routing = self.__resolve(uri)
+            self.__cache.put(path, routing)
+
+        if routing is None:
+            return None
+        return (copy(routing[0]), routing[1])
+
+    def __resolve(self, uri):
+        """Matches the URL against the compiled routing table."""
+        if self.__index is None:
+            self.__index = RouteIndex(self.__rules)
+
+        for order, rule, values in self.__index.candidates(uri):
+            if values is None:
+                params = rule.match_url(uri)
+            else:
+                params = rule.build_params(values)
             if params:
-                return (params, rule[1])
+                return (params, self.__rules[order][1])
             
         return None
 
-    def restful(self, rule, **args):
-        """Add a RESTful service routing.
+    def route(self, uri, method='GET'):
+        """Finds the route of the request by its URL and HTTP method.
 
-        TODO: document this method.
+        For a RESTful rule the action is picked by the method, the request is
+        rejected if the rule has no action for it.
 
         Args:
-            rule:
+            uri: The full URL of the request.
+            method: the upper-case HTTP method of the request.
 
         Returns:
+            A (params, allow) tuple, where params is the dict of the routing
+            parameters, or None if the matched rule does not accept the method,
+            and allow is the value of the Allow header of a RESTful rule or
+            None. None if no rule matches the URL.
+        """
+        routing = self.resolve(uri)
+        if routing is None:
+            return None
+
+        params, restful_routing = routing
+        if restful_routing is None:
+            return (params, None)
+
+        action = restful_routing.get(method)
+        if action is None:
+            return (None, restful_routing.allow)
+        params['action'] = action
+        return (params, restful_routing.allow)
+
+    def cache_stats(self):
+        """Gets the statistics of the resolution cache.
+
+        Returns:
+            A dict with the size, capacity, hits and misses of the cache.
+        """
+        return {
+            'size': len(self.__cache),
+            'capacity': self.__cache.capacity,
+            'hits': self.__cache.hits,
+            'misses': self.__cache.misses
+        }
+
+    def restful(self, rule, **args):
+        """Add a RESTful service routing.
+
+        The requests matching the rule are dispatched to the action mapped to
+        their HTTP method, see route().
+
+        Args:
+            rule: a RoutingRule object.
+            args: the lower-case HTTP method -> action name mappings to
+                override the default ones (get: show, post: create,
+                put: update, delete: destroy), for the methods listed in
+                RESTFUL_METHODS.
         """
         # default RESTful routing
         restful_routing = {
@@ -149,9 +453,10 @@ class Router(object):
             'put': 'update',
             'delete': 'destroy'
         }
-        if rule not in self.__rules:
+        if rule not in (x[0] for x in self.__rules):
             for key, val in args.iteritems():
-                if key in restful_routing.keys():
+                if key in RESTFUL_METHODS:
                     restful_routing[key] = val
 
-            self.__rules.append((rule, restful_routing))
+            self.__rules.append((rule, RestfulRouting(restful_routing)))
+            self.__invalidate()
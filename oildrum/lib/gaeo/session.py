@@ -4,32 +4,678 @@
 """ Session module. 
 
 Classes:
+    SessionStore: The base class of the server-side session stores.
+    MemcacheStore: Stores the sessions in memcache.
+    DatastoreStore: Stores the sessions in the datastore.
+    TieredStore: Stores the sessions in a local LRU, memcache and datastore.
+    SessionEntity: The datastore entity of a stored session.
+    SessionSerializer: The base class of the session serializers.
+    CompactSerializer: Stores the sessions as (compressed) JSON.
+    PickleSerializer: Stores the sessions as pickles.
     Session: A gaeo session interface.
+    CookieSession: The session stored in a signed cookie.
+    LazySession: The session of a request, loaded or created on first use.
     MemcacheSession: The memcache-based session storage.
+
+Functions:
+    get_serializer: Gets the serializer named by settings.SESSION_SERIALIZER.
+    get_session_class: Gets the session class named by settings.SESSION_CLASS.
+    get_store: Gets the session store named by settings.SESSION_STORE.
 """
 
 # python std imports
+import base64
+import binascii
+import datetime
 import hashlib
-import random
+import hmac
+import os
+import struct
+import threading
 import time
-from string import digits, letters
 import pickle
+import sys
 import urllib
 import logging
+import zlib
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
 
 # google app engine imports
 from google.appengine.api import memcache
+from google.appengine.ext import db
 
 # App imports
 import settings
+from gaeo.model import MAX_BATCH_SIZE, batches
+from gaeo.utils import LRUCache
+
+# the random bytes of a session key, which is their hex digest
+KEY_BYTES = 20
+
+class SessionStore(object):
+    """
+    The base class of the server-side session stores, which map the session
+    keys to the serialized sessions.
+    """
+
+    def get(self, key):
+        """Gets the serialized session, or None if it is not stored."""
+        raise NotImplementedError
+
+    def set(self, key, payload, timeout):
+        """Stores the serialized session.
+
+        Args:
+            key: the session key.
+            payload: the serialized session.
+            timeout: the seconds to keep the session.
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Removes the session, no op if it is not stored."""
+        raise NotImplementedError
+
+    def exists(self, key):
+        """Checks whether a session is stored with the key."""
+        return self.get(key) is not None
+
+    def add(self, key, payload, timeout):
+        """Stores the serialized session unless one is stored with the key.
+
+        The stores which can do so make it atomic.
+
+        Returns:
+            True if the session was stored.
+        """
+        if self.exists(key):
+            return False
+        self.set(key, payload, timeout)
+        return True
+
+    def update(self, key, merge, timeout):
+        """Stores the merge of the stored session and the changes to it.
+
+        The stores which can do so make it atomic, the others just get and
+        set the session.
+
+        Args:
+            key: the session key.
+            merge: a function which gets the stored serialized session (or
+                None) and returns the serialized session to store. It may be
+                called several times.
+            timeout: the seconds to keep the session.
+
+        Returns:
+            The stored serialized session, or None if it couldn't be stored.
+        """
+        payload = merge(self.get(key))
+        self.set(key, payload, timeout)
+        return payload
+
+    def _cas_client(self):
+        """Gets a memcache client for gets() and cas()."""
+        # the client keeps the CAS ids, so the module's shared client would
+        # mix up those of the concurrent requests.
+        if self.client is not memcache and hasattr(self.client, 'cas'):
+            return self.client
+        return memcache.Client()
+
+    def _compare_and_set(self, key, merge, timeout, load=None):
+        """Stores merge(stored session) in memcache with gets() and cas().
+
+        If another request stores the session in between, the merge is done
+        again, up to settings.SESSION_CAS_RETRIES times.
+
+        Args:
+            key: the session key.
+            merge: see update().
+            timeout: the seconds to keep the session.
+            load: [optional] a function which gets the stored session when
+                it's not in memcache, it is added to memcache then.
+
+        Returns:
+            The stored serialized session, or None if it couldn't be stored.
+        """
+        client = self._cas_client()
+        attempts = getattr(settings, 'SESSION_CAS_RETRIES', 5) + 1
+        for attempt in xrange(attempts):
+            current = client.gets(key)
+            if current is not None:
+                payload = merge(current)
+                if client.cas(key, payload, time=timeout):
+                    return payload
+            else:
+                payload = merge(load and load(key))
+                if client.add(key, payload, time=timeout):
+                    return payload
+        logging.warning('Cannot store the session %s in %d attempts.',
+                        key, attempts)
+        return None
+
+
+class MemcacheStore(SessionStore):
+    """
+    Stores the sessions in memcache, the sessions evicted are lost.
+    """
+
+    def __init__(self, client=None):
+        """Initializer.
+
+        Args:
+            client: [optional] the memcache client, defaults to the
+                google.appengine.api.memcache module.
+        """
+        self.client = client if client is not None else memcache
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, payload, timeout):
+        self.client.set(key, payload, time=timeout)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def add(self, key, payload, timeout):
+        return bool(self.client.add(key, payload, time=timeout))
+
+    def update(self, key, merge, timeout):
+        return self._compare_and_set(key, merge, timeout)
+
+
+class SessionEntity(db.Model):
+    """The datastore entity of a stored session, keyed by 's:<session key>'."""
+    payload = db.BlobProperty()
+    expires = db.DateTimeProperty()
+
+    @staticmethod
+    def key_name(key):
+        # key names must not start with a digit
+        return 's:%s' % key
+
+
+class DatastoreStore(SessionStore):
+    """
+    Stores the sessions in the datastore, as SessionEntity entities.
+
+    The expired entities are skipped when loaded; purge() deletes them.
+    """
+
+    def get(self, key):
+        entity = SessionEntity.get_by_key_name(SessionEntity.key_name(key))
+        if entity is None or entity.expires < datetime.datetime.utcnow():
+            return None
+        return entity.payload
+
+    def set(self, key, payload, timeout):
+        self.set_multi({key: (payload, timeout)})
+
+    def set_multi(self, sessions):
+        """Stores the sessions with one datastore call per MAX_BATCH_SIZE.
+
+        Args:
+            sessions: a dict of key -> (payload, timeout).
+        """
+        now = datetime.datetime.utcnow()
+        entities = [SessionEntity(key_name=SessionEntity.key_name(key),
+                                  payload=db.Blob(payload),
+                                  expires=now + datetime.timedelta(seconds=timeout))
+                    for key, (payload, timeout) in sessions.iteritems()]
+        for batch in batches(entities):
+            db.put(batch)
+
+    def delete(self, key):
+        db.delete(db.Key.from_path('SessionEntity',
+                                   SessionEntity.key_name(key)))
+
+    def purge(self, limit=500):
+        """Deletes up to limit expired sessions, e.g. from a cron job.
+
+        Returns:
+            The number of sessions deleted.
+        """
+        keys = SessionEntity.all(keys_only=True) \
+            .filter('expires <', datetime.datetime.utcnow()).fetch(limit)
+        db.delete(keys)
+        return len(keys)
+
+
+class TieredStore(SessionStore):
+    """
+    Stores the sessions in three tiers: a bounded LRU of the process, kept
+    for a few seconds only as the other instances may change the sessions,
+    then memcache, then the datastore, which keeps them durable.
+
+    The sessions are written to the LRU and memcache at once, and to the
+    datastore behind them: the writes are queued in the process and put in
+    batches once settings.SESSION_WRITE_BEHIND_INTERVAL seconds have passed
+    since the last flush, or as soon as MAX_BATCH_SIZE sessions are queued,
+    so a session changed by many requests is written once per interval. A
+    session missing from the faster tiers is copied back to them when it is
+    loaded.
+
+    The queue is only flushed by the requests which use a session, so the
+    last writes of an instance which goes idle stay in memcache alone until
+    the next one; call flush() (e.g. from a warmup or cron handler) to write
+    them sooner. The writes of a failed flush are queued again.
+
+    Public data:
+        client: the memcache client.
+        durable: the durable SessionStore, with set_multi().
+        stats: the counters of this process, a dict of tier ('local',
+            'memcache' or 'datastore') -> dict of 'hits' and 'misses', the
+            datastore also counts the batches written as 'writes'.
+    """
+    TIERS = ('local', 'memcache', 'datastore')
+
+    def __init__(self, capacity=None, ttl=None, interval=None, client=None,
+                 durable=None):
+        """Initializer.
+
+        Args:
+            capacity: [optional] the number of sessions in the LRU, defaults
+                to settings.SESSION_LOCAL_CACHE_SIZE.
+            ttl: [optional] the seconds a session is kept in the LRU, defaults
+                to settings.SESSION_LOCAL_TTL.
+            interval: [optional] the seconds between the datastore batches,
+                defaults to settings.SESSION_WRITE_BEHIND_INTERVAL.
+            client: [optional] the memcache client, defaults to the
+                google.appengine.api.memcache module.
+            durable: [optional] the durable store, defaults to a
+                DatastoreStore.
+        """
+        if capacity is None:
+            capacity = getattr(settings, 'SESSION_LOCAL_CACHE_SIZE', 1000)
+        if ttl is None:
+            ttl = getattr(settings, 'SESSION_LOCAL_TTL', 5)
+        if interval is None:
+            interval = getattr(settings, 'SESSION_WRITE_BEHIND_INTERVAL', 60)
+        self._local = LRUCache(capacity)
+        self.ttl = ttl
+        self.interval = interval
+        self.client = client if client is not None else memcache
+        self.durable = durable if durable is not None else DatastoreStore()
+        self._lock = threading.Lock()
+        # key -> (payload, timeout) of the writes not in the datastore yet
+        self._pending = {}
+        self._flushed = 0
+        # when the last flush failed, the full queue then waits an interval
+        self._failed = 0
+        self.stats = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Resets the counters to zero."""
+        for tier in self.TIERS:
+            self.stats[tier] = {'hits': 0, 'misses': 0}
+        self.stats['datastore']['writes'] = 0
+
+    def hit_ratios(self):
+        """Gets the ratio of the lookups each tier answered.
+
+        Returns:
+            A dict of tier -> ratio, or None for the tiers never asked.
+        """
+        ratios = {}
+        for tier in self.TIERS:
+            hits = self.stats[tier]['hits']
+            total = hits + self.stats[tier]['misses']
+            ratios[tier] = total and float(hits) / total or None
+        return ratios
+
+    def __count(self, tier, found):
+        self.stats[tier][found and 'hits' or 'misses'] += 1
+
+    def get(self, key):
+        self.__flush_due()
+        entry = self._local.get(key)
+        found = entry is not None and time.time() - entry[1] < self.ttl
+        self.__count('local', found)
+        if found:
+            return entry[0]
+
+        payload = self.client.get(key)
+        self.__count('memcache', payload is not None)
+        if payload is not None:
+            self._local.put(key, (payload, time.time()))
+            return payload
+
+        payload = self.__load_durable(key)
+        if payload is not None:
+            self._local.put(key, (payload, time.time()))
+            self.client.set(key, payload,
+                            time=settings.SESSION_COOKIE_TIMEOUT)
+        return payload
+
+    def __load_durable(self, key):
+        """Gets the session queued for the datastore or stored in it."""
+        self._lock.acquire()
+        try:
+            pending = self._pending.get(key)
+        finally:
+            self._lock.release()
+        if pending is not None:
+            return pending[0]
+        payload = self.durable.get(key)
+        self.__count('datastore', payload is not None)
+        return payload
+
+    def set(self, key, payload, timeout):
+        self.client.set(key, payload, time=timeout)
+        self.__write_behind(key, payload, timeout)
+
+    def add(self, key, payload, timeout):
+        # the keys are random, memcache alone tells the races apart
+        if not self.client.add(key, payload, time=timeout):
+            return False
+        self.__write_behind(key, payload, timeout)
+        return True
+
+    def update(self, key, merge, timeout):
+        payload = self._compare_and_set(key, merge, timeout,
+                                        self.__load_durable)
+        if payload is not None:
+            self.__write_behind(key, payload, timeout)
+        return payload
+
+    def __write_behind(self, key, payload, timeout):
+        """Stores the session in the LRU and queues it for the datastore."""
+        self._local.put(key, (payload, time.time()))
+        self._lock.acquire()
+        try:
+            self._pending[key] = (payload, timeout)
+            full = len(self._pending) >= MAX_BATCH_SIZE and \
+                time.time() - self._failed >= self.interval
+        finally:
+            self._lock.release()
+        if full:
+            self.flush()
+        else:
+            self.__flush_due()
+
+    def __flush_due(self):
+        """Flushes the queue if the interval has passed since the last flush."""
+        if self._pending and time.time() - self._flushed >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Writes the queued sessions to the datastore.
+
+        A failure is logged, not raised, and the sessions are queued again
+        unless they were written since.
+
+        Returns:
+            The number of sessions written.
+        """
+        self._lock.acquire()
+        try:
+            pending, self._pending = self._pending, {}
+            self._flushed = time.time()
+        finally:
+            self._lock.release()
+        if not pending:
+            return 0
+        try:
+            self.durable.set_multi(pending)
+        except Exception, e:
+            logging.error('Cannot write %d sessions to the datastore: %s',
+                          len(pending), e)
+            self._failed = time.time()
+            self._lock.acquire()
+            try:
+                for key, entry in pending.iteritems():
+                    self._pending.setdefault(key, entry)
+            finally:
+                self._lock.release()
+            return 0
+        self.stats['datastore']['writes'] += 1
+        return len(pending)
+
+    def delete(self, key):
+        self._local.remove(key)
+        self.client.delete(key)
+        self._lock.acquire()
+        try:
+            self._pending.pop(key, None)
+        finally:
+            self._lock.release()
+        self.durable.delete(key)
+
+
+# the header of the serialized sessions: a byte no pickle starts with, the
+# version of the format and the encoding of the payload.
+SERIALIZER_MAGIC = '\x00'
+SERIALIZER_VERSION = '\x01'
+SERIALIZER_JSON = 'j'
+SERIALIZER_ZLIB_JSON = 'z'
+SERIALIZER_PICKLE = 'p'
+
+
+class SessionSerializer(object):
+    """
+    The base class of the session serializers.
+
+    Subclasses implement dumps(). loads() reads every format, the ones of
+    CompactSerializer as well as the pickled sessions of the earlier
+    versions, so the serializer can be switched without losing the sessions.
+    """
+
+    def dumps(self, data):
+        """Serializes the items of a session.
+
+        Args:
+            data: the session, or a dict of its items.
+
+        Returns:
+            The str to store.
+        """
+        raise NotImplementedError
+
+    def loads(self, payload):
+        """Deserializes the items of a session.
+
+        Args:
+            payload: the stored str.
+
+        Returns:
+            A dict of the items.
+
+        Raises:
+            ValueError: if the payload has an unknown format.
+        """
+        if payload[:1] != SERIALIZER_MAGIC:
+            # a session pickled by PickleSerializer or an earlier version
+            return dict(pickle.loads(payload))
+        if payload[1:3] == SERIALIZER_VERSION + SERIALIZER_PICKLE:
+            # a session CompactSerializer couldn't store as JSON
+            return dict(pickle.loads(payload[3:]))
+        return _loads_json(payload)
+
+
+def _loads_json(payload):
+    """Deserializes a payload of the JSON formats of CompactSerializer.
+
+    Unlike SessionSerializer.loads(), it never unpickles, so it is safe for
+    the payloads which come from the client.
+
+    Raises:
+        ValueError: if the payload is not in a JSON format.
+    """
+    if payload[:1] != SERIALIZER_MAGIC:
+        raise ValueError('The session payload is not JSON')
+    if payload[1:2] != SERIALIZER_VERSION:
+        raise ValueError('Unknown session format version: %r' % payload[1:2])
+    encoding, body = payload[2:3], payload[3:]
+    if encoding == SERIALIZER_ZLIB_JSON:
+        body = zlib.decompress(body)
+    elif encoding != SERIALIZER_JSON:
+        raise ValueError('Unknown session encoding: %r' % encoding)
+    return json.loads(body)
+
+
+def _is_json(value):
+    """Checks whether the value comes back from JSON as it is.
+
+    That is dicts with string keys, lists, strings, numbers, booleans and
+    None, the str values come back as unicode though.
+    """
+    if value is None or isinstance(value, (basestring, bool, int, long, float)):
+        return True
+    if type(value) is list:
+        for item in value:
+            if not _is_json(item):
+                return False
+        return True
+    if type(value) is dict:
+        for key, item in value.iteritems():
+            if not isinstance(key, basestring) or not _is_json(item):
+                return False
+        return True
+    return False
+
+
+class CompactSerializer(SessionSerializer):
+    """
+    Stores the sessions as JSON, compressed if they are large.
+
+    A session with values JSON would change (e.g. datetimes, model keys,
+    tuples or dicts with int keys) is pickled instead, so it comes back as
+    it was; keep the sessions JSON-like to keep them compact.
+    """
+
+    def __init__(self, min_size=None, level=6):
+        """Initializer.
+
+        Args:
+            min_size: [optional] the size in bytes from which the JSON is
+                compressed, defaults to settings.SESSION_COMPRESS_MIN_SIZE.
+            level: the zlib compression level.
+        """
+        if min_size is None:
+            min_size = getattr(settings, 'SESSION_COMPRESS_MIN_SIZE', 1024)
+        self.min_size = min_size
+        self.level = level
+
+    def dumps(self, data):
+        data = dict(data)
+        try:
+            return self.dumps_json(data)
+        except TypeError:
+            return SERIALIZER_MAGIC + SERIALIZER_VERSION + SERIALIZER_PICKLE + \
+                pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+
+    def dumps_json(self, data):
+        """Serializes the items of a session as JSON, never pickled.
+
+        Raises:
+            TypeError: if a value would not come back from JSON as it is.
+        """
+        data = dict(data)
+        if not _is_json(data):
+            raise TypeError('The session has values which are not JSON')
+        try:
+            body = json.dumps(data, separators=(',', ':'))
+        except ValueError, e:
+            # e.g. a str which is not UTF-8
+            raise TypeError(str(e))
+        if len(body) >= self.min_size:
+            compressed = zlib.compress(body, self.level)
+            if len(compressed) < len(body):
+                return SERIALIZER_MAGIC + SERIALIZER_VERSION + \
+                    SERIALIZER_ZLIB_JSON + compressed
+        return SERIALIZER_MAGIC + SERIALIZER_VERSION + SERIALIZER_JSON + body
+
+
+class PickleSerializer(SessionSerializer):
+    """
+    Stores the sessions as pickles, so any picklable value can be stored.
+    """
+
+    def dumps(self, data):
+        return pickle.dumps(dict(data), pickle.HIGHEST_PROTOCOL)
+
+
+# serializer name -> serializer instance.
+_SERIALIZERS = {}
+
+
+def _import_class(name):
+    """Gets a class by its name in this module, or by its dotted path."""
+    if '.' in name:
+        module_name, class_name = name.rsplit('.', 1)
+        module = __import__(module_name, globals(), locals(), [class_name], -1)
+    else:
+        module, class_name = sys.modules[__name__], name
+    return getattr(module, class_name)
+
+
+def get_serializer():
+    """Gets the serializer named by settings.SESSION_SERIALIZER.
+
+    The name is either the name of a class in this module, or the dotted
+    path of a SessionSerializer subclass elsewhere.
+    """
+    name = getattr(settings, 'SESSION_SERIALIZER', 'CompactSerializer')
+    serializer = _SERIALIZERS.get(name)
+    if serializer is None:
+        serializer = _SERIALIZERS[name] = _import_class(name)()
+    return serializer
+
+
+def get_session_class():
+    """Gets the session class named by settings.SESSION_CLASS.
 
-POOL = digits + letters
+    The name is either the name of a class in this module ('Session' for the
+    server-side store, 'CookieSession'), or the dotted path of a Session
+    subclass elsewhere.
+    """
+    return _import_class(getattr(settings, 'SESSION_CLASS', 'Session'))
+
+
+# store name -> store instance.
+_STORES = {}
+
+
+def get_store():
+    """Gets the store named by settings.SESSION_STORE.
+
+    The name is either the name of a SessionStore class in this module
+    ('MemcacheStore', 'TieredStore'), or the dotted path of one elsewhere.
+    """
+    name = getattr(settings, 'SESSION_STORE', 'MemcacheStore')
+    store = _STORES.get(name)
+    if store is None:
+        store = _STORES[name] = _import_class(name)()
+    return store
 
 
 class Session(dict):
-    """The base session class."""
+    """The base session class.
+
+    The changes are tracked and stored at once by save(), which the request
+    lifecycle calls when the action is done. Changing a mutable value in
+    place is not noticed, call touch() after doing it.
+
+    Only the changed keys are written: save() merges them into the session
+    as currently stored, with memcache compare-and-set, so the concurrent
+    requests of a client (e.g. parallel XHRs) can change different keys
+    safely. If they change the same key, the last one wins.
+    """
     __key = None
     __destroyed = False
+    # whether the session was changed since it was loaded or saved
+    __dirty = False
+    # whether the client has the cookie, a new session gets it when written
+    __issued = True
+    # whether the session is in the store, a new session is added to it
+    __stored = True
+    # whether the key was generated for a new session
+    __generated = False
     
     __controller = None
     
@@ -45,35 +691,68 @@ class Session(dict):
             controller:
         """
         session = None
-        cls.__controller = controller
         
         if key is None:
-            key = Session.generate_session_key()
+            session = cls._create(Session.generate_session_key(), controller)
+            session.__generated = True
         else:
-            data = memcache.get(key)
+            data = get_store().get(key)
             if data is not None:
-                session = pickle.loads(data)
+                try:
+                    session = cls._create(key, controller,
+                                          get_serializer().loads(data))
+                except Exception, e:
+                    logging.warning('Cannot load the session %s: %s', key, e)
         
-        if not session:
-            session = dict.__new__(cls, {})
-            session.__key = key
-            session['started'] = time.time()
-            cookie_value = urllib.quote_plus(key)
-            cls.__controller.set_cookie(settings.SESSION_COOKIE_NAME, 
-                                        cookie_value,
-                                        settings.SESSION_COOKIE_TIMEOUT)
+        if session is None:
+            session = cls._create(key, controller)
         
         return session
     
     def __init__(self, *args, **kwds):
         pass
+
+    @classmethod
+    def _create(cls, key, controller, items=None):
+        """Creates the session object.
+
+        Args:
+            key: the session key.
+            controller: the controller of the request.
+            items: [optional] the stored items, a new session is created if
+                it is None.
+        """
+        session = dict.__new__(cls, {})
+        session.__key = key
+        session.__controller = controller
+        # the keys set and deleted since the session was loaded or saved
+        session.__changed = set()
+        session.__deleted = set()
+        if items is None:
+            session.__issued = False
+            session.__stored = False
+            dict.__setitem__(session, 'started', time.time())
+            session.__changed.add('started')
+        else:
+            dict.update(session, items)
+        return session
     
-    def __del__(self):
-        self._put()
-    
+    def __getstate__(self):
+        # the controller belongs to the request, it is not stored.
+        state = self.__dict__.copy()
+        state.pop('_Session__controller', None)
+        state.pop('_Session__issued', None)
+        state.pop('_Session__stored', None)
+        state.pop('_Session__generated', None)
+        state.pop('_Session__dirty', None)
+        state.pop('_Session__changed', None)
+        state.pop('_Session__deleted', None)
+        return state
+
     def __setitem__(self, key, value):
+        self._check_value(value)
         super(Session, self).__setitem__(key, value)
-        self._put()
+        self.__change(key)
         
     def __getitem__(self, key):
         try:
@@ -83,37 +762,490 @@ class Session(dict):
         
     def __delitem__(self, key):
         super(Session, self).__delitem__(key)
-        self._put()
+        self.__change(key, deleted=True)
+
+    def update(self, *args, **kwds):
+        items = dict(*args, **kwds)
+        for value in items.itervalues():
+            self._check_value(value)
+        super(Session, self).update(items)
+        for key in items:
+            self.__change(key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return super(Session, self).__getitem__(key)
+
+    def pop(self, key, *args):
+        if key in self:
+            self.__change(key, deleted=True)
+        return super(Session, self).pop(key, *args)
+
+    def popitem(self):
+        item = super(Session, self).popitem()
+        self.__change(item[0], deleted=True)
+        return item
+
+    def clear(self):
+        for key in self.keys():
+            self.__change(key, deleted=True)
+        super(Session, self).clear()
+
+    def _check_value(self, value):
+        """Checks a value before it is set, any value is fine by default.
+
+        Raises:
+            TypeError: if the session can't store the value.
+        """
+        pass
+
+    @property
+    def dirty(self):
+        """Whether the session has changes which are not saved yet."""
+        return self.__dirty
+
+    def touch(self, key=None):
+        """Marks a value as changed, so save() stores it.
+
+        Args:
+            key: [optional] the key of the value changed in place, all the
+                values are marked if it is None.
+        """
+        if key is None:
+            for key in self.keys():
+                self.__change(key)
+        else:
+            self.__change(key)
+
+    def __change(self, key, deleted=False):
+        if deleted:
+            self.__changed.discard(key)
+            self.__deleted.add(key)
+        else:
+            self.__deleted.discard(key)
+            self.__changed.add(key)
+        self.__dirty = True
+        self._issue_cookie()
+
+    def save(self):
+        """Stores the session if it was changed.
 
+        Returns:
+            True if the session was stored.
+        """
+        if not self.__dirty or self.__destroyed:
+            return False
+        self.__dirty = False
+        return self._put()
     
     @property
     def key(self):
         return self.__key
+
+    @property
+    def controller(self):
+        return self.__controller
     
     def destroy(self):
         logging.info('session destroyed.')
         self.__destroyed = True
-        memcache.delete(self.__key)
-        self.__controller.set_cookie(settings.SESSION_COOKIE_NAME,
-                                     '',
-                                     -time.time())
+        self._delete()
+        self._set_cookie('', -time.time())
+
+    def _set_cookie(self, value, max_age):
+        """Sets the session cookie through the controller, if there is one.
+
+        Returns:
+            False if the cookie could not be set, e.g. the response headers
+            are already sent.
+        """
+        if self.__controller is None:
+            return False
+        return self.__controller.set_cookie(settings.SESSION_COOKIE_NAME,
+                                            value, max_age) is not False
         
+    def _issue_cookie(self):
+        """Sets the cookie of a new session, once it is written.
+
+        A new session which can't get its cookie (it is written while the
+        response is streamed) is not stored, no one could find it.
+        """
+        if not self.__issued and self.__controller is not None:
+            self.__issued = self._set_cookie(urllib.quote_plus(self.__key),
+                                             settings.SESSION_COOKIE_TIMEOUT)
+
     def _put(self):
-        if not self.__destroyed:
-            memcache.set(self.key, pickle.dumps(self), 
-                         time=settings.SESSION_COOKIE_TIMEOUT)
+        # a session which was never written has no cookie to find it with.
+        if self.__destroyed:
+            return False
+        if not self.__issued:
+            if self.__controller is not None:
+                logging.error('The new session %s is not stored, it has no '
+                              'cookie.', self.__key)
+            return False
+
+        serializer = get_serializer()
+        if not self.__stored:
+            # a new session is claimed with an atomic add, without a merge
+            if get_store().add(self.__key, serializer.dumps(self),
+                               settings.SESSION_COOKIE_TIMEOUT):
+                self.__stored = True
+                self.__changed = set()
+                self.__deleted = set()
+                return True
+            if self.__generated:
+                # practically impossible with KEY_BYTES random bytes
+                logging.error('The new session key %s is taken.', self.__key)
+                self.__key = Session.generate_session_key()
+                self.__issued = False
+                self._issue_cookie()
+                return self._put()
+            # another request with the same stale cookie created it first
+            self.__stored = True
+
+        deleted = self.__deleted
+        changes = dict((key, dict.__getitem__(self, key))
+                       for key in self.__changed)
+        merged = []
+
+        def merge(payload):
+            items = {}
+            if payload is not None:
+                try:
+                    items = serializer.loads(payload)
+                except Exception, e:
+                    logging.warning('Cannot load the session %s: %s',
+                                    self.__key, e)
+            for key in deleted:
+                items.pop(key, None)
+            items.update(changes)
+            merged[:] = [items]
+            return serializer.dumps(items)
+
+        if get_store().update(self.__key, merge,
+                              settings.SESSION_COOKIE_TIMEOUT) is None:
+            self.__dirty = True
+            return False
+        self.__changed = set()
+        self.__deleted = set()
+        # the session now has the keys changed by the other requests too
+        dict.clear(self)
+        dict.update(self, merged[0])
+        return True
+
+    def _delete(self):
+        get_store().delete(self.__key)
 
     @staticmethod    
     def generate_session_key():
-        """ Generate a random key. """
-        while True:
-            key = ''.join([random.choice(POOL) for i in range(settings.SESSION_COOKIE_NAME_LENGTH)])
-            seed = 'session|%s|%s' % (key, time.time())
-            session_key = hashlib.sha1(seed).hexdigest()
-            if not Session.exists_key(session_key):
-                return session_key
+        """Generates a random key from the OS CSPRNG.
+
+        The KEY_BYTES random bytes make a collision so unlikely that the
+        store is not checked, the key is claimed when the session is added.
+        """
+        return binascii.hexlify(os.urandom(KEY_BYTES))
 
     @staticmethod
     def exists_key(key):
-        return memcache.get(key) is not None
+        return get_store().exists(key)
             
+
+
+# the prefixes of the CookieSession cookies, signed or signed and encrypted.
+COOKIE_SIGNED = 'c1'
+COOKIE_ENCRYPTED = 'e1'
+
+# secret -> (signing key, encryption key)
+_COOKIE_KEYS = {}
+
+
+def _cookie_keys():
+    """Gets the keys derived from settings.SESSION_SECRET."""
+    secret = getattr(settings, 'SESSION_SECRET', None)
+    if not secret:
+        raise ValueError('settings.SESSION_SECRET is required by CookieSession')
+    keys = _COOKIE_KEYS.get(secret)
+    if keys is None:
+        keys = _COOKIE_KEYS[secret] = (
+            hmac.new(secret, 'gaeo.session.sign', hashlib.sha256).digest(),
+            hmac.new(secret, 'gaeo.session.encrypt', hashlib.sha256).digest())
+    return keys
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _keystream_xor(key, nonce, data):
+    """Encrypts or decrypts the data with HMAC-SHA256 in counter mode."""
+    if not data:
+        return data
+    blocks = []
+    for counter in xrange((len(data) + 31) // 32):
+        blocks.append(hmac.new(key, nonce + struct.pack('>I', counter),
+                               hashlib.sha256).digest())
+    stream = ''.join(blocks)[:len(data)]
+    value = long(binascii.hexlify(data), 16) ^ \
+        long(binascii.hexlify(stream), 16)
+    return binascii.unhexlify('%0*x' % (len(data) * 2, value))
+
+
+def _constant_time_equals(a, b):
+    if len(a) != len(b):
+        return False
+    result = 0
+    for x, y in zip(a, b):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
+
+class CookieSession(Session):
+    """
+    The session stored in the session cookie itself, so no memcache round
+    trip is needed and no session is lost to a memcache eviction.
+
+    The cookie value is "c1.<expiry>.<payload>.<signature>": the items
+    serialized as JSON by CompactSerializer, whatever the SESSION_SERIALIZER,
+    in URL-safe base64, and an HMAC-SHA256 of
+    the rest keyed by settings.SESSION_SECRET. If settings.SESSION_ENCRYPT
+    is set, the payload is encrypted (HMAC-SHA256 in counter mode with a
+    random nonce, then signed) and the prefix is "e1". A cookie with a bad
+    signature or past its expiry is ignored.
+
+    When the cookie would exceed settings.SESSION_COOKIE_MAX_SIZE bytes, the
+    session moves to the server-side store of Session, and the cookie then
+    holds its key as usual.
+    """
+
+    def __new__(cls, key=None, auto_create=False, controller=None):
+        """Constructor.
+
+        Args:
+            key: [optional] the value of the session cookie.
+            auto_create:
+            controller: the controller of the request.
+        """
+        if key is not None and \
+                key[:3] not in (COOKIE_SIGNED + '.', COOKIE_ENCRYPTED + '.'):
+            # a session which was moved to the server-side store
+            return Session(key=key, controller=controller)
+
+        items = None
+        if key is not None:
+            try:
+                items = cls.decode(key)
+            except Exception, e:
+                logging.warning('Cannot load the session cookie: %s', e)
+        session = cls._create(None, controller, items)
+        session.__server = None
+        return session
+
+    def __getstate__(self):
+        state = super(CookieSession, self).__getstate__()
+        state.pop('_CookieSession__server', None)
+        return state
+
+    @staticmethod
+    def encode(items, expires=None):
+        """Encodes the items to a signed cookie value.
+
+        Args:
+            items: a dict of the session items.
+            expires: [optional] the POSIX timestamp when the cookie expires,
+                defaults to settings.SESSION_COOKIE_TIMEOUT from now.
+        """
+        sign_key, encrypt_key = _cookie_keys()
+        if expires is None:
+            expires = time.time() + settings.SESSION_COOKIE_TIMEOUT
+        # never pickled, the client must not choose what is unpickled
+        payload = CompactSerializer().dumps_json(items)
+        if getattr(settings, 'SESSION_ENCRYPT', False):
+            prefix = COOKIE_ENCRYPTED
+            nonce = os.urandom(16)
+            payload = nonce + _keystream_xor(encrypt_key, nonce, payload)
+        else:
+            prefix = COOKIE_SIGNED
+        value = '%s.%d.%s' % (prefix, expires, _b64encode(payload))
+        signature = hmac.new(sign_key, value, hashlib.sha256).digest()
+        return '%s.%s' % (value, _b64encode(signature))
+
+    @staticmethod
+    def decode(value):
+        """Decodes a signed cookie value.
+
+        Returns:
+            A dict of the session items, or None if the cookie is expired or
+            its signature doesn't match.
+
+        Raises:
+            ValueError: if the payload is not JSON, e.g. a pickle.
+        """
+        sign_key, encrypt_key = _cookie_keys()
+        value = str(value)
+        signed, _, signature = value.rpartition('.')
+        expected = hmac.new(sign_key, signed, hashlib.sha256).digest()
+        if not _constant_time_equals(_b64encode(expected), signature):
+            logging.warning('The session cookie has a bad signature.')
+            return None
+        prefix, expires, payload = signed.split('.')
+        if int(expires) < time.time():
+            return None
+        payload = _b64decode(payload)
+        if prefix == COOKIE_ENCRYPTED:
+            payload = _keystream_xor(encrypt_key, payload[:16], payload[16:])
+        return _loads_json(payload)
+
+    def _issue_cookie(self):
+        # the cookie is set along with the content by _put().
+        pass
+
+    def _check_value(self, value):
+        if not _is_json(value):
+            raise TypeError('A CookieSession only stores JSON values '
+                            '(dicts with string keys, lists, strings, '
+                            'numbers, booleans and None), not %r' % (value,))
+
+    def _put(self):
+        try:
+            value = self.encode(self)
+        except TypeError, e:
+            # a value changed in place to something which is not JSON
+            logging.error('Cannot store the cookie session: %s', e)
+            return False
+        max_size = getattr(settings, 'SESSION_COOKIE_MAX_SIZE', 4000)
+        if self.__server is None and \
+                len(settings.SESSION_COOKIE_NAME) + 1 + len(value) <= max_size:
+            if self._set_cookie(value, settings.SESSION_COOKIE_TIMEOUT):
+                return True
+            # all of the session is in the cookie
+            logging.error('The changes of the cookie session are lost.')
+            return False
+
+        # too big for a cookie, stored in the server-side store instead
+        server = self.__server
+        if server is None:
+            server = self.__server = Session(controller=self.controller)
+        for key in [key for key in server if key not in self]:
+            del server[key]
+        server.update(self)
+        return server.save()
+
+    def _delete(self):
+        if self.__server is not None:
+            self.__server.destroy()
+
+
+class LazySession(object):
+    """
+    The session of a request, which is loaded or created on first use.
+
+    The stored session is only fetched the first time the session is read or
+    written, and a new session is only created when it is written, so the
+    requests which never touch the session cost no memcache round trips and
+    issue no cookie. Until then, a request without a session cookie reads an
+    empty session.
+
+    It works like the Session object it stands for, which is available as
+    the session property.
+    """
+
+    def __init__(self, controller, key=None):
+        """Initializer.
+
+        Args:
+            controller: the controller of the request.
+            key: [optional] the session key from the cookie.
+        """
+        self.__controller = controller
+        self.__key = key
+        self.__session = None
+
+    @property
+    def loaded(self):
+        """Whether the session has been loaded or created."""
+        return self.__session is not None
+
+    @property
+    def session(self):
+        """Gets the Session object, loading or creating it if needed."""
+        if self.__session is None:
+            self.__session = get_session_class()(key=self.__key,
+                                                 controller=self.__controller)
+        return self.__session
+
+    def __peek(self):
+        """Gets the Session object, or None if there is none to load."""
+        if self.__session is None and self.__key is None:
+            return None
+        return self.session
+
+    @property
+    def key(self):
+        return self.session.key
+
+    def save(self):
+        """Stores the session if it was loaded and changed, see Session.save.
+
+        Returns:
+            True if the session was stored.
+        """
+        if self.__session is None:
+            return False
+        return self.__session.save()
+
+    def destroy(self):
+        if self.__peek() is not None:
+            self.__session.destroy()
+
+    def __getitem__(self, key):
+        session = self.__peek()
+        if session is None:
+            return None
+        return session[key]
+
+    def __setitem__(self, key, value):
+        self.session[key] = value
+
+    def __delitem__(self, key):
+        del self.session[key]
+
+    def __contains__(self, key):
+        session = self.__peek()
+        return session is not None and key in session
+
+    def __iter__(self):
+        return iter(self.__peek() or ())
+
+    def __len__(self):
+        return len(self.__peek() or ())
+
+    def __repr__(self):
+        return repr(self.__peek() or {})
+
+    def get(self, key, default=None):
+        session = self.__peek()
+        if session is None:
+            return default
+        return session.get(key, default)
+
+    has_key = __contains__
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return (self.__peek() or {}).items()
+
+    def values(self):
+        return (self.__peek() or {}).values()
+
+    def __getattr__(self, name):
+        # the other dict methods, e.g. update(), pop() and setdefault()
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.session, name)
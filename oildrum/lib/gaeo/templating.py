@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" GAEO templating module.
+
+Resolves the {% extends %} chains of Django templates at the source level,
+for `gaeo compile-templates` and StreamingTemplateView. It depends neither
+on Django nor on the application settings.
+
+Classes:
+    TemplateNotCompilable: The template can't be flattened ahead of time.
+
+Functions:
+    flatten_template: Resolves the {% extends %} chain of a template.
+    needs_template_dir: Checks if a template source loads other templates.
+    chain_digest: Gets the SHA-1 of the template files of a chain.
+"""
+
+import hashlib
+import os
+import re
+
+
+BLOCK_TAG = re.compile(r'{%\s*(block|endblock)(?:\s+(\w+))?\s*%}')
+EXTENDS_TAG = re.compile(r'{%\s*extends\s+(.+?)\s*%}')
+LOAD_TAG = re.compile(r'{%\s*load\s+[^%]*%}')
+SUPER_VAR = re.compile(r'{{\s*block\.super\s*}}')
+# the tags which need the template directory at runtime.
+RUNTIME_TAGS = re.compile(r'{%\s*(extends|include|ssi|url)\b')
+
+
+class TemplateNotCompilable(Exception):
+    """The template can't be flattened ahead of time."""
+    pass
+
+
+def parse_blocks(source):
+    """Splits a template source into strings and (name, parts) blocks."""
+    root = []
+    stack = [(None, root)]
+    pos = 0
+    for m in BLOCK_TAG.finditer(source):
+        stack[-1][1].append(source[pos:m.start()])
+        pos = m.end()
+        if m.group(1) == 'block':
+            if not m.group(2):
+                raise TemplateNotCompilable('block without a name')
+            block = (m.group(2), [])
+            stack[-1][1].append(block)
+            stack.append(block)
+        else:
+            if len(stack) == 1:
+                raise TemplateNotCompilable('unexpected endblock')
+            stack.pop()
+    if len(stack) != 1:
+        raise TemplateNotCompilable('unclosed block')
+    root.append(source[pos:])
+    return root
+
+
+def collect_blocks(parts, blocks):
+    """Maps the names of all (nested) blocks to their parts."""
+    for part in parts:
+        if not isinstance(part, basestring):
+            blocks[part[0]] = part[1]
+            collect_blocks(part[1], blocks)
+    return blocks
+
+
+def has_blocks(parts):
+    for part in parts:
+        if not isinstance(part, basestring):
+            return True
+    return False
+
+
+def join_blocks(parts, overrides, supers, current=None):
+    """Serializes the parts, replacing the blocks by their overrides."""
+    out = []
+    for part in parts:
+        if isinstance(part, basestring):
+            if current is not None:
+                part = SUPER_VAR.sub(lambda m: supers.get(current, ''), part)
+            out.append(part)
+            continue
+        name, children = part
+        if name in overrides:
+            body = join_blocks(overrides[name], overrides, supers, name)
+        else:
+            body = join_blocks(children, overrides, supers)
+        out.append('{%% block %s %%}%s{%% endblock %%}' % (name, body))
+    return ''.join(out)
+
+
+def flatten_template(templates_dir, name, chain=()):
+    """Resolves the {% extends %} chain of a template into a single source.
+
+    Returns:
+        A (source, chain) tuple, chain is the list of the template names the
+        source was built from.
+
+    Raises:
+        TemplateNotCompilable: if the chain can't be resolved ahead of time.
+    """
+    if name in chain:
+        raise TemplateNotCompilable('circular extends')
+    path = os.path.join(templates_dir, *name.split('/'))
+    if not os.path.isfile(path):
+        raise TemplateNotCompilable('%s does not exist' % name)
+    source = file(path).read()
+
+    m = EXTENDS_TAG.search(source)
+    if m is None:
+        return source, [name]
+
+    parent = m.group(1)
+    if len(parent) < 2 or parent[0] not in '"\'' or parent[-1] != parent[0]:
+        raise TemplateNotCompilable('extends a variable')
+    # like webapp, which renders with the directory of the template as the
+    # template dirs, every parent of the chain is looked up relative to the
+    # directory of the template rendered, not of the one it extends from
+    top = chain[0] if chain else name
+    parent = os.path.normpath(os.path.join(os.path.dirname(top),
+                                           parent[1:-1])).replace(os.sep, '/')
+    if parent.startswith('..'):
+        raise TemplateNotCompilable('extends a template out of the tree')
+    parent_source, parent_chain = flatten_template(templates_dir, parent,
+                                                   chain + (name, ))
+
+    parent_parts = parse_blocks(parent_source)
+    parent_blocks = collect_blocks(parent_parts, {})
+    child_parts = parse_blocks(source)
+    overrides = collect_blocks(child_parts, {})
+
+    supers = {}
+    for block_name, children in parent_blocks.iteritems():
+        if has_blocks(children):
+            supers[block_name] = None
+        else:
+            supers[block_name] = ''.join(children)
+    for block_name, children in overrides.iteritems():
+        if supers.get(block_name, '') is None and \
+                SUPER_VAR.search(''.join(p for p in children
+                                         if isinstance(p, basestring))):
+            raise TemplateNotCompilable('block.super of nested blocks')
+
+    # the libraries loaded by the child apply to the whole template
+    loads = [LOAD_TAG.findall(p) for p in child_parts
+             if isinstance(p, basestring)]
+    head = ''.join(tag for tags in loads for tag in tags)
+    return head + join_blocks(parent_parts, overrides, supers), \
+        [name] + parent_chain
+
+
+def needs_template_dir(source):
+    """Checks if the template source needs the template directory to render.
+
+    That is, it still extends a template, or has include, ssi or url tags.
+    """
+    return RUNTIME_TAGS.search(source) is not None
+
+
+def chain_digest(templates_dir, chain):
+    """Gets the SHA-1 of the template files of a chain.
+
+    Args:
+        templates_dir: the root directory of the templates.
+        chain: the template names from flatten_template().
+
+    Raises:
+        IOError: if a template file can't be read.
+    """
+    digest = hashlib.sha1()
+    for name in chain:
+        digest.update(file(os.path.join(templates_dir, *name.split('/'))).read())
+    return digest.hexdigest()
@@ -2,6 +2,8 @@
 
 """ GAEO Utility methods."""
 import re
+import threading
+from itertools import izip
 from datetime import tzinfo, timedelta
 
 def select_trusy(x, y):
@@ -17,62 +19,389 @@ def select_trusy(x, y):
     """
     return x if x else y
 
-def bbcode(value):    
+
+# the bbcode tags which wrap their parsed content
+BBCODE_WRAPPERS = {
+    'b': ('<b>', '</b>'),
+    'i': ('<i>', '</i>'),
+    'u': ('<u>', '</u>'),
+    'big': ('<big>', '</big>'),
+    'small': ('<small>', '</small>'),
+    'quote': ('<blockquote class="content-quote">', '</blockquote>'),
+    'center': ('<div align="center">', '</div>'),
+}
+
+# the bbcode tags whose content is not parsed ([url] and [email] only when
+# they have no argument)
+BBCODE_RAW_TAGS = ('url', 'email', 'img', 'code')
+
+# matches an opening or closing tag, the arguments cannot contain brackets so
+# every "[/tag]" in the input is a token.
+_BBCODE_TOKEN = re.compile(r'\[(/?)(%s|\*)(?:=([^\[\]\r\n]+))?\]' % '|'.join(
+    sorted(BBCODE_WRAPPERS.keys() + ['url', 'email', 'img', 'code', 'list'],
+           key=len, reverse=True)))
+# the tags which take an argument, i.e. [tag=argument]
+_BBCODE_ARG_TAGS = frozenset(['url', 'email', 'img', 'list'])
+
+# the kinds of the tags in _BBCODE_TAGS
+_OPEN, _CLOSE, _LIST, _ITEM, _RAW, _LITERAL = range(6)
+# what is in between the brackets of a tag without argument -> (kind, name,
+# HTML). BBCodeParser._render_nested() keeps the open tags on its stack by
+# these names, and the open lists by the keys of _BBCODE_LIST_ENDINGS.
+_BBCODE_TAGS = {
+    'list': (_LIST, 'ul', '<ul>'),
+    '/list': (_CLOSE, 'list', None),
+    '*': (_ITEM, '*', None),
+    '/*': (_LITERAL, '*', None),
+}
+for _name, (_opening, _ending) in BBCODE_WRAPPERS.iteritems():
+    _BBCODE_TAGS[_name] = (_OPEN, _name, _opening)
+    _BBCODE_TAGS['/' + _name] = (_CLOSE, _name, _ending)
+for _name in BBCODE_RAW_TAGS:
+    _BBCODE_TAGS[_name] = (_RAW, _name, None)
+    # [/url] and [/email] also close [url=...] and [email=...]
+    _BBCODE_TAGS['/' + _name] = (_CLOSE, _name, '</a>')
+del _name, _opening, _ending
+# the open lists, without and with items -> their closing HTML
+_BBCODE_LIST_ENDINGS = {'ul': '</ul>', 'ol': '</ol>',
+                        'ul*': '</li></ul>', 'ol*': '</li></ol>'}
+_BBCODE_LIST_HEADS = ('ul', 'ol')
+
+
+def _bbcode_attr(value):
+    return value.replace('<', '&lt;').replace('>', '&gt;') \
+                .replace('"', '&quot;')
+
+
+class BBCodeParser(object):
+    """Converts the bbcodes to HTML in a single pass.
+
+    The tags of the input are looked up in a table as it is split by the
+    brackets, and their HTML is written out as they are found, while the
+    open tags are kept on a stack. If a tag turns out to be never closed (or
+    closed out of order), the input is tokenized again by one precompiled
+    regular expression, and the open tags are written out as placeholders,
+    which are replaced by the HTML when their closing tags are found. So the
+    nesting is handled properly, and such tags are left as they are. The
+    content of [img], [code], and of [url] and [email] without argument, is
+    not parsed.
+
+    The parser keeps no state while rendering, so an instance can be shared
+    by threads.
+
+    Public API:
+        render(value): converts the bbcodes of the input string.
+        render_cached(value): render() memoized by gaeo.cache.content_cache.
+
+    Public data:
+        signature: the name of the transform, which changes along with the
+            options and VERSION.
+    """
+    # bump it when the output changes, so the memoized outputs are ignored
+    VERSION = 1
+
+    def __init__(self, escape=False, linebreaks=False, link_class=None):
+        """Initializer.
+
+        Args:
+            escape: replaces the angle brackets of the input with &lt; and
+                &gt;, so no HTML tags but the converted bbcodes are output.
+            linebreaks: replaces the newlines with <br> tags.
+            link_class: [optional] the CSS class of the [url=...] links.
+        """
+        self.escape = escape
+        self.linebreaks = linebreaks
+        self.link_class = link_class
+
+    @property
+    def signature(self):
+        return 'bbcode:%d:%d:%d:%s' % (self.VERSION, self.escape,
+                                       self.linebreaks, self.link_class or '')
+
+    def _raw(self, name, arg, content):
+        """Gets the HTML of a tag whose content is not parsed."""
+        if name == 'img':
+            if arg is None:
+                return '<img src="%s">' % _bbcode_attr(content)
+            return '<img src="%s" alt="%s">' % (_bbcode_attr(arg),
+                                                _bbcode_attr(content))
+        if name == 'code':
+            if content[:1].isspace():
+                content = content[1:]
+            return '<blockquote class="code-segment"><code><pre>%s' \
+                   '</pre></code></blockquote>' % content
+        href = content if name == 'url' else 'mailto:' + content
+        return '<a href="%s">%s</a>' % (_bbcode_attr(href), content)
+
+    def _wrap(self, name, arg):
+        """Gets the opening and closing HTML of a parsed tag."""
+        if name == 'list':
+            if arg is None:
+                return '<ul>', '</ul>'
+            return '<ol type="%s">' % _bbcode_attr(arg), '</ol>'
+        if name == 'url':
+            if self.link_class:
+                return '<a class="%s" href="%s">' % (
+                    self.link_class, _bbcode_attr(arg)), '</a>'
+            return '<a href="%s">' % _bbcode_attr(arg), '</a>'
+        if name == 'email':
+            return '<a href="mailto:%s">' % _bbcode_attr(arg), '</a>'
+        return BBCODE_WRAPPERS[name]
+
+    def render(self, value):
+        """Converts the bbcodes of the input string to HTML.
+
+        Args:
+            value: the input string that may contain bbcodes.
+
+        Returns:
+            The string with bbcodes converted to HTML.
+        """
+        if self.escape:
+            value = value.replace('<', '&lt;').replace('>', '&gt;')
+        if '[' in value:
+            html = self._render_nested(value)
+            if html is None:
+                html = self._render_stack(value)
+            value = html
+        if self.linebreaks:
+            value = value.replace('\n', '<br>')
+        return value
+
+    def _arg_tag(self, body):
+        """Gets the (kind, name, HTML) of a tag with argument, like
+        _BBCODE_TAGS, or None if it is not a tag. The HTML of [img=...] is
+        its argument.
+        """
+        name, arg = body.split('=', 1)
+        if not arg or '\r' in arg or '\n' in arg or name not in _BBCODE_TAGS:
+            return None
+        if name == 'url' or name == 'email':
+            return _OPEN, name, self._wrap(name, arg)[0]
+        if name == 'list':
+            return _LIST, 'ol', self._wrap(name, arg)[0]
+        if name == 'img':
+            return _RAW, name, arg
+        return _LITERAL, name, None
+
+    def _render_nested(self, value):
+        """Converts the bbcodes if the tags are nested properly.
+
+        The common case: the HTML is written out as the tags are found, so
+        there are no placeholders to replace.
+
+        Returns:
+            The string with bbcodes converted to HTML, or None if a tag is
+            left open or closed out of order, which _render_stack() handles.
+        """
+        OPEN, CLOSE, LIST, ITEM, RAW = _OPEN, _CLOSE, _LIST, _ITEM, _RAW
+        list_endings, list_heads = _BBCODE_LIST_ENDINGS, _BBCODE_LIST_HEADS
+        get_tag = _BBCODE_TAGS.get
+        pieces = iter(value.split('['))
+        out = [pieces.next()]
+        append = out.append
+        # the names of the open tags
+        stack = []
+        push, pop = stack.append, stack.pop
+        # the depth of the lists without items -> indices of the blanks
+        # before their first [*]
+        leads = {}
+        for piece in pieces:
+            body, bracket, text = piece.partition(']')
+            tag = get_tag(body)
+            if tag is None or not bracket:
+                if bracket and '=' in body:
+                    tag = self._arg_tag(body)
+                if tag is None or not bracket:
+                    # the text goes on, it was no blank
+                    if leads:
+                        indices = leads.get(len(stack))
+                        if indices and indices[-1] == len(out) - 1:
+                            indices.pop()
+                    append('[' + piece)
+                    continue
+
+            kind, name, html = tag
+            if kind == OPEN:
+                push(name)
+                append(html)
+            elif kind == CLOSE:
+                if stack and stack[-1] == name:
+                    pop()
+                    append(html)
+                elif name == 'list' and stack and stack[-1] in list_endings:
+                    leads.pop(len(stack), None)
+                    append(list_endings[pop()])
+                elif name in stack or name == 'list' and \
+                        [1 for top in stack if top in list_endings]:
+                    return None
+                else:
+                    append('[' + body + ']')
+            elif kind == LIST:
+                push(name)
+                append(html)
+            elif kind == ITEM:
+                top = stack[-1] if stack else None
+                if top in list_heads:
+                    stack[-1] = top + '*'
+                    for index in leads.pop(len(stack), ()):
+                        out[index] = ''
+                    append('<li>')
+                elif top in list_endings:
+                    append('</li><li>')
+                elif [1 for top in stack if top in list_endings]:
+                    return None
+                else:
+                    append('[*]')
+            elif kind == RAW:
+                # the content is not parsed, up to the closing tag
+                append('[' + body + ']')
+                index = len(out)
+                append(text)
+                closing = '/' + name
+                for piece in pieces:
+                    body, bracket, text = piece.partition(']')
+                    if body == closing and bracket:
+                        break
+                    append('[' + piece)
+                else:
+                    # unclosed, it is left as it is
+                    return None
+                content = ''.join(out[index:])
+                if content:
+                    del out[index - 1:]
+                    append(self._raw(name, html, content))
+                else:
+                    append('[' + body + ']')
+            else:
+                # [/*], or a tag with misplaced argument
+                append('[' + body + ']')
+
+            if text:
+                if stack and stack[-1] in list_heads and not text.strip():
+                    leads.setdefault(len(stack), []).append(len(out))
+                append(text)
+
+        if stack:
+            return None
+        return ''.join(out)
+
+    def _render_stack(self, value):
+        """Converts the bbcodes, leaving the tags open or closed out of
+        order as they are.
+        """
+        # the text and the groups of the tokens, interleaved
+        parts = _BBCODE_TOKEN.split(value)
+        out = [parts[0]]
+        append = out.append
+        # the open tags, as (name, arg, index of the placeholder, indices of
+        # the [*] placeholders, indices of the blanks before the first [*])
+        stack = []
+        # the open tag whose content is not parsed, as (name, arg, index of
+        # the placeholder), and the number of the closing tags ahead
+        raw = None
+        ahead = dict((name, value.count('[/%s]' % name))
+                     for name in BBCODE_RAW_TAGS)
+        for closing, name, arg, text in izip(parts[1::4], parts[2::4],
+                                             parts[3::4], parts[4::4]):
+            if arg is None:
+                token = '[' + closing + name + ']'
+                if closing and name in ahead:
+                    ahead[name] -= 1
+            else:
+                token = '[' + closing + name + '=' + arg + ']'
+
+            if raw is not None:
+                if closing and name == raw[0] and arg is None:
+                    name, arg, index = raw
+                    raw = None
+                    content = ''.join(out[index + 1:])
+                    if content:
+                        del out[index:]
+                        token = self._raw(name, arg, content)
+                append(token)
+            elif arg is not None and (closing or
+                                      name not in _BBCODE_ARG_TAGS):
+                append(token)
+            elif closing:
+                for depth in xrange(len(stack) - 1, -1, -1):
+                    if stack[depth][0] == name:
+                        break
+                else:
+                    append(token)
+                    depth = None
+                if depth is not None:
+                    name, arg, index, items, leads = stack[depth]
+                    # the tags left open inside stay as they are
+                    del stack[depth:]
+                    opening, ending = self._wrap(name, arg)
+                    out[index] = opening
+                    if items:
+                        for index in leads:
+                            out[index] = ''
+                        out[items[0]] = '<li>'
+                        for index in items[1:]:
+                            out[index] = '</li><li>'
+                        ending = '</li>' + ending
+                    append(ending)
+            elif name == '*':
+                for depth in xrange(len(stack) - 1, -1, -1):
+                    if stack[depth][0] == 'list':
+                        del stack[depth + 1:]
+                        stack[depth][3].append(len(out))
+                        break
+                append(token)
+            elif name in ahead and (arg is None or name == 'img'):
+                # unclosed, it is left as it is
+                if ahead[name]:
+                    raw = (name, arg, len(out))
+                append(token)
+            else:
+                stack.append((name, arg, len(out), [], []))
+                append(token)
+
+            if text:
+                if raw is None and stack and stack[-1][0] == 'list' and \
+                        not stack[-1][3] and not text.strip():
+                    stack[-1][4].append(len(out))
+                append(text)
+        return ''.join(out)
+
+    def render_cached(self, value):
+        """Converts the bbcodes of the input string, memoized by content.
+
+        See render() and gaeo.cache.ContentCache.
+        """
+        # gaeo.cache imports this module
+        from gaeo.cache import content_cache
+        return content_cache.render(self.signature, self.render, value)
+
+
+# the parser of bbcode()
+_bbcode_parser = BBCodeParser()
+# the parser of safeout()
+_safeout_parser = BBCodeParser(escape=True, linebreaks=True)
+
+
+def bbcode(value):
     """Convert the bbcodes to their HTML counterparts.
 
+    The outputs are memoized by gaeo.cache.content_cache.
+
     Args:
         value: the input string that may contain bbcodes.
 
     Returns:
         The string with bbcodes converted to HTML.
     """
-    bbdata = [
-        (r'\[url\](.+?)\[/url\]', r'<a href="\1">\1</a>'),
-        (r'\[url=(.+?)\](.+?)\[/url\]', r'<a href="\1">\2</a>'),
-        (r'\[email\](.+?)\[/email\]', r'<a href="mailto:\1">\1</a>'),
-        (r'\[email=(.+?)\](.+?)\[/email\]', r'<a href="mailto:\1">\2</a>'),
-        (r'\[img\](.+?)\[/img\]', r'<img src="\1">'),
-        (r'\[img=(.+?)\](.+?)\[/img\]', r'<img src="\1" alt="\2">'),
-        (r'\[b\](.+?)\[/b\]', r'<b>\1</b>'),
-        (r'\[i\](.+?)\[/i\]', r'<i>\1</i>'),
-        (r'\[u\](.+?)\[/u\]', r'<u>\1</u>'),
-        (r'\[quote\](.+?)\[/quote\]', r'<blockquote class="content-quote">\1</blockquote>'),
-        (r'\[center\](.+?)\[/center\]', r'<div align="center">\1</div>'),
-        (r'\[code\]\s?(.+?)\[/code\]', r'<blockquote class="code-segment"><code><pre>\1</pre></code></blockquote>'),
-        (r'\[big\](.+?)\[/big\]', r'<big>\1</big>'),
-        (r'\[small\](.+?)\[/small\]', r'<small>\1</small>'),
-        ]
-
-    for bbset in bbdata:
-        p = re.compile(bbset[0], re.DOTALL)
-        value = p.sub(bbset[1], value)
-
-    #The following two code parts handle the more complex list statements
-    temp = ''
-    p = re.compile(r'\[list\](.+?)\[/list\]', re.DOTALL)
-    m = p.search(value)
-    if m:
-        items = re.split(re.escape('[*]'), m.group(1))
-        for i in items[1:]:
-            temp = temp + '<li>' + i + '</li>'
-        value = p.sub(r'<ul>'+temp+'</ul>', value)
-
-    temp = ''
-    p = re.compile(r'\[list=(.)\](.+?)\[/list\]', re.DOTALL)
-    m = p.search(value)
-    if m:
-        items = re.split(re.escape('[*]'), m.group(2))
-        for i in items[1:]:
-            temp = temp + '<li>' + i + '</li>'
-        value = p.sub(r'<ol type=\1>'+temp+'</ol>', value)
-
-    return value
+    return _bbcode_parser.render_cached(value)
 
 
 def safeout(value):
     """Converts the input string to an HTML segment.
 
-    This function does 3 things:
+    This function does 3 things in a single pass (see BBCodeParser), the
+    outputs are memoized by gaeo.cache.content_cache:
      1. replaces angle brackets of HTML tags with &lt; and &gt;,
      2. converts the bbcodes to HTML tags,
      3. replaces newlines with <br> tags.
@@ -83,13 +412,114 @@ def safeout(value):
     Returns:
         The escape-encoded string.
     """
-    # strip tags
-    pat = re.compile(r'<([^>]*?)>', re.DOTALL | re.M)
-    value = re.sub(pat, '&lt;\\1&gt;', value)
-    # apply bbcode
-    value =  bbcode(value)
-    # apply nl2br
-    return re.sub(r'\n', '<br>', value)
+    return _safeout_parser.render_cached(value)
+
+
+class LRUCache(object):
+    """A bounded, thread-safe mapping that evicts the least recently used key.
+
+    Public API:
+        get(key, default): gets the value of the key, marking it as used.
+        put(key, value): stores the value, evicting the oldest key if full.
+        remove(key): removes the key if it is cached.
+        clear(): removes all the keys.
+
+    Public data:
+        capacity: the maximum number of keys kept.
+        hits: the number of get() calls that found the key.
+        misses: the number of get() calls that did not.
+    """
+    # indices of the linked list node fields
+    PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def __len__(self):
+        return len(self._map)
+
+    def __contains__(self, key):
+        return key in self._map
+
+    def clear(self):
+        """Removes all the keys, the counters are kept."""
+        self._lock.acquire()
+        try:
+            self._map = {}
+            # the sentinel of the circular list, root[NEXT] is the oldest.
+            self._root = []
+            self._root[:] = [self._root, self._root, None, None]
+        finally:
+            self._lock.release()
+
+    def get(self, key, default=None):
+        """Gets the value of the key, marking it as the most recently used.
+
+        Args:
+            key: the key to look up.
+            default: the value to return if the key is not cached.
+        """
+        self._lock.acquire()
+        try:
+            node = self._map.get(key)
+            if node is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.__unlink(node)
+            self.__append(node)
+            return node[self.VALUE]
+        finally:
+            self._lock.release()
+
+    def put(self, key, value):
+        """Stores the value of the key, evicting the oldest key if full.
+
+        Args:
+            key: the key to store.
+            value: the value of the key.
+        """
+        if self.capacity <= 0:
+            return
+        self._lock.acquire()
+        try:
+            node = self._map.get(key)
+            if node is not None:
+                self.__unlink(node)
+            elif len(self._map) >= self.capacity:
+                oldest = self._root[self.NEXT]
+                self.__unlink(oldest)
+                del self._map[oldest[self.KEY]]
+            node = [None, None, key, value]
+            self._map[key] = node
+            self.__append(node)
+        finally:
+            self._lock.release()
+
+    def remove(self, key):
+        """Removes the key, no op if it is not cached."""
+        self._lock.acquire()
+        try:
+            node = self._map.pop(key, None)
+            if node is not None:
+                self.__unlink(node)
+        finally:
+            self._lock.release()
+
+    def __unlink(self, node):
+        node[self.PREV][self.NEXT] = node[self.NEXT]
+        node[self.NEXT][self.PREV] = node[self.PREV]
+
+    def __append(self, node):
+        last = self._root[self.PREV]
+        node[self.PREV] = last
+        node[self.NEXT] = self._root
+        last[self.NEXT] = node
+        self._root[self.PREV] = node
 
 
 class TaiwanTimeZone(tzinfo):
@@ -5,17 +5,87 @@
 Classes:
     View: Base view interface.
     DjangoTemplateView: 
+    StreamingTemplateView: Renders the template as a stream of chunks.
+
+Functions:
+    compiled_template_source: Gets the template source precompiled by
+        `gaeo compile-templates`.
 """
 
 import re
 import os
+import logging
+import threading
 
 # gaeo imports
+from gaeo import templating
 from gaeo import utils
 
 # App imports
 import settings
 
+# the template filter libraries are registered once per process.
+_template_lock = threading.Lock()
+_template_initialized = False
+
+# (template path, flattened) -> (mtime, compiled template)
+_templates = {}
+
+# the module generated by `gaeo compile-templates`.
+COMPILED_TEMPLATES_MODULE = 'compiled_templates'
+# the TEMPLATES table of the module, loaded on demand
+_compiled_templates = None
+
+
+def compiled_template_source(path, validate=False):
+    """Gets the template source precompiled by `gaeo compile-templates`.
+
+    The precompiled source has its {% extends %} chain resolved, so it can be
+    compiled without reading any template file.
+
+    Args:
+        path: the path of the template file under settings.TEMPLATE_PATH.
+        validate: True to check the template files the source was built from,
+            a stale source is ignored.
+
+    Returns:
+        The template source, or None if the template isn't precompiled.
+    """
+    global _compiled_templates
+    if _compiled_templates is None:
+        try:
+            module = __import__(COMPILED_TEMPLATES_MODULE,
+                                globals(),
+                                locals(),
+                                [],
+                                -1)
+            _compiled_templates = module.TEMPLATES
+        except ImportError:
+            _compiled_templates = {}
+    if not _compiled_templates:
+        return None
+
+    root = os.path.normpath(settings.TEMPLATE_PATH) + os.sep
+    path = os.path.normpath(path)
+    if not path.startswith(root):
+        return None
+    entry = _compiled_templates.get(path[len(root):].replace(os.sep, '/'))
+    if entry is None:
+        return None
+
+    digest, chain, source = entry
+    if validate:
+        try:
+            current = templating.chain_digest(root, chain)
+        except IOError:
+            current = None
+        if current != digest:
+            logging.warning('The precompiled %s is stale, run '
+                            '`gaeo compile-templates` again.', chain[0])
+            return None
+    return source
+
+
 class View(object):
     """ 
     Base view class
@@ -32,6 +102,7 @@ class AppengineTemplateView(View):
     
     """ This view is implemented by using appengine's template. """
     
+    # the defaults of the render path, see set_render_path()
     __view_options = {
         'folder': '',
         'script': '',
@@ -41,8 +112,24 @@ class AppengineTemplateView(View):
     def __init__(self, controller, template_path=settings.TEMPLATE_PATH):
         super(AppengineTemplateView, self).__init__(controller)
         self._template_path = template_path
+        # the render path belongs to the request, the views of the concurrent
+        # requests must not share it
+        self.__view_options = dict(self.__view_options)
         
+    # True to compile the templates from their flattened {% extends %} chain
+    _flatten_templates = False
+
     def render(self, data=None, **kwds):
+        compiled, response_data = self._prepare(data)
+        from django.template import Context
+        self._controller.response.out.write(compiled.render(Context(response_data)))
+
+    def _prepare(self, data=None):
+        """Gets the compiled template and the data to render it with.
+
+        Returns:
+            A (compiled template, template data dict) tuple.
+        """
         # get template
         template = self.__init_template()
         
@@ -59,7 +146,7 @@ class AppengineTemplateView(View):
         path = os.path.join(self._template_path, 
                             folder,
                             script + opt['ext'])
-        self._controller.response.out.write(template.render(path, response_data))
+        return self.__load_template(template, path), response_data
     
     def set_render_path(self, folder='', script='', ext='.html'):
         self.options.update({
@@ -72,14 +159,95 @@ class AppengineTemplateView(View):
     def options(self):
         return self.__view_options
 
+    def __load_template(self, template, path):
+        """Gets the compiled template, compiling it only once.
+
+        In DEBUG mode the template is parsed again when its file is modified
+        (the templates it extends or includes are not checked). Otherwise the
+        file is never checked again.
+
+        Args:
+            template: the template module from __init_template().
+            path: the path of the template file.
+
+        Returns:
+            The compiled template.
+        """
+        key = (path, self._flatten_templates)
+        entry = _templates.get(key)
+        if settings.DEBUG:
+            mtime = os.path.getmtime(path)
+            if entry is None or entry[0] != mtime:
+                entry = (mtime, self.__compile_template(template, path))
+                _templates[key] = entry
+        elif entry is None:
+            entry = (None, self.__compile_template(template, path))
+            _templates[key] = entry
+        return entry[1]
+
+    def __compile_template(self, template, path):
+        """Compiles the template, preferring its precompiled source.
+
+        The precompiled sources are validated against the template files if
+        settings.VALIDATE_COMPILED_TEMPLATES is True, which defaults to DEBUG.
+        """
+        validate = getattr(settings, 'VALIDATE_COMPILED_TEMPLATES',
+                           settings.DEBUG)
+        source = compiled_template_source(path, validate)
+        if source is None and self._flatten_templates:
+            source = self.__flatten_template(path)
+        if source is not None:
+            from django.template import Template
+            compiled = Template(source)
+            compiled.gaeo_flattened = True
+            return compiled
+        return template.load(path, debug=settings.DEBUG)
+
+    def __flatten_template(self, path):
+        """Resolves the {% extends %} chain of the template file.
+
+        Returns:
+            The flattened source, or None if the template can't be flattened.
+        """
+        root = os.path.normpath(self._template_path) + os.sep
+        path = os.path.normpath(path)
+        if not path.startswith(root):
+            return None
+        name = path[len(root):].replace(os.sep, '/')
+        try:
+            source, chain = templating.flatten_template(root, name)
+        except templating.TemplateNotCompilable, e:
+            logging.debug('Cannot flatten %s: %s', name, e)
+            return None
+        if templating.needs_template_dir(source):
+            return None
+        return source
+
     def __init_template(self):
         """Pre-process the template module like register filters.
 
+        The filters are registered only the first time it's called.
+
         Return
             The processed template module.
         """
+        global _template_initialized
         from google.appengine.ext.webapp import template
 
+        if _template_initialized:
+            return template
+
+        _template_lock.acquire()
+        try:
+            if not _template_initialized:
+                self.__register_filters(template)
+                _template_initialized = True
+        finally:
+            _template_lock.release()
+        return template
+
+    def __register_filters(self, template):
+        """Registers the built-in and the custom filter libraries."""
         # GAEO-provided filters
         cur_dir = os.path.dirname(__file__)
         dirs = [{
@@ -103,4 +271,63 @@ class AppengineTemplateView(View):
                     module = '%s.%s' % (d['package'], f.replace('.py', ''))
                     template.register_template_library(module)
 
-        return template
\ No newline at end of file
+
+class StreamingTemplateView(AppengineTemplateView):
+    """Renders the template as a stream of chunks.
+
+    Set settings.VIEW_CLASS to 'StreamingTemplateView' to use it. The
+    template's {% extends %} chain is flattened, so the layout's head and
+    the blocks on top of the page are sent to the client while the rest of
+    the template is still being rendered. The templates which can't be
+    flattened are sent in one chunk.
+
+    A streamed response can't be stored by gaeo.cache.cache_action, nor get
+    an ETag from settings.AUTO_ETAG, so the template is rendered into the
+    buffer as AppengineTemplateView does when the whole body is needed: for
+    the GET and HEAD requests of a cached action, and while
+    response.auto_etag is True and no ETag is set. Set
+    self.response.auto_etag to False in an action to stream it anyway.
+    """
+
+    _flatten_templates = True
+
+    def render(self, data=None, **kwds):
+        if self.__needs_body():
+            return super(StreamingTemplateView, self).render(data, **kwds)
+        compiled, response_data = self._prepare(data)
+        from django.template import Context
+        self._controller.response.set_stream(
+            self.__iter_render(compiled, Context(response_data)))
+
+    def __needs_body(self):
+        """Checks if the whole body is needed before the response is sent."""
+        ctrl = self._controller
+        response = ctrl.response
+        if response.auto_etag and 'ETag' not in response.headers:
+            return True
+        action = getattr(ctrl, ctrl.params.get('action') or '', None)
+        return getattr(action, 'cache_options', None) is not None and \
+            ctrl.request.method in ('GET', 'HEAD')
+
+    def __iter_render(self, compiled, context):
+        """Yields the rendered top-level nodes and blocks one by one."""
+        if not getattr(compiled, 'gaeo_flattened', False):
+            # loaded by the template module, which sets up its directory
+            yield compiled.render(context)
+            return
+        for chunk in self.__iter_nodes(compiled.nodelist, context):
+            yield chunk
+
+    def __iter_nodes(self, nodelist, context):
+        from django.template.loader_tags import BlockNode
+        for node in nodelist:
+            if isinstance(node, BlockNode):
+                context.push()
+                try:
+                    context['block'] = node
+                    for chunk in self.__iter_nodes(node.nodelist, context):
+                        yield chunk
+                finally:
+                    context.pop()
+            else:
+                yield node.render(context)
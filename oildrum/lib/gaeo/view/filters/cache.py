@@ -0,0 +1,73 @@
+from google.appengine.ext import webapp
+from django.template import Node, TemplateSyntaxError, VariableDoesNotExist
+from django.template import resolve_variable
+from gaeo.cache import fragment_cache
+
+# get template register
+register = webapp.template.create_template_register()
+
+
+class CacheNode(Node):
+    """Renders the enclosed nodes through the fragment cache."""
+
+    def __init__(self, nodelist, name, ttl, vary):
+        self.nodelist = nodelist
+        self.name = name
+        self.ttl = ttl
+        self.vary = vary
+
+    def render(self, context):
+        name = self.name
+        if name[:1] in ('"', "'") and name[-1:] == name[:1]:
+            name = name[1:-1]
+        else:
+            name = resolve_variable(name, context)
+
+        ttl = self.ttl
+        if not ttl.isdigit():
+            ttl = resolve_variable(ttl, context)
+        try:
+            ttl = int(ttl)
+        except (ValueError, TypeError):
+            raise TemplateSyntaxError('"cache" tag got a non-integer ttl: %r' % ttl)
+
+        vary = []
+        for var in self.vary:
+            try:
+                vary.append(resolve_variable(var, context))
+            except VariableDoesNotExist:
+                vary.append(None)
+        key = fragment_cache.fragment_key(name, vary)
+        content, locked = fragment_cache.get(key)
+        if content is None:
+            try:
+                content = self.nodelist.render(context)
+            except:
+                if locked:
+                    fragment_cache.release(key)
+                raise
+            fragment_cache.put(key, content, ttl, locked)
+        return content
+
+
+@register.tag('cache')
+def do_cache(parser, token):
+    """
+    Caches the enclosed template fragment in memcache.
+
+        {% cache "sidebar" 600 user.language %}
+            ...
+        {% endcache %}
+
+    The first argument is the fragment name, a quoted string or a context
+    variable; the second is the TTL in seconds. The values of the optional
+    context variables that follow are part of the key, so every combination
+    is cached on its own. A fragment is rendered at most once per request.
+    """
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise TemplateSyntaxError('"%s" tag requires at least 2 arguments: '
+                                  'the fragment name and the ttl.' % bits[0])
+    nodelist = parser.parse(('endcache',))
+    parser.delete_first_token()
+    return CacheNode(nodelist, bits[1], bits[2], bits[3:])
@@ -1,56 +1,15 @@
 from google.appengine.ext import webapp
+from gaeo.utils import BBCodeParser
 
 # get template register
 register = webapp.template.create_template_register()
 
+# the parser of bbcode_content, shared by the renders
+_content_parser = BBCodeParser(escape=True, link_class='link-segment')
+
 @register.filter
 def bbcode_content(value):
     """ 
     Ref. http://code.djangoproject.com/wiki/CookBookTemplateFilterBBCode 
     """
-    import re
-    
-    pat = re.compile(r'<([^>]*?)>', re.DOTALL | re.M)
-    value = re.sub(pat, '&lt;\\1&gt;', value)
-    
-    bbdata = [
-        (r'\[url\](.+?)\[/url\]', r'<a href="\1">\1</a>'),
-        (r'\[url=(.+?)\](.+?)\[/url\]', r'<a class="link-segment" href="\1">\2</a>'),
-        (r'\[email\](.+?)\[/email\]', r'<a href="mailto:\1">\1</a>'),
-        (r'\[email=(.+?)\](.+?)\[/email\]', r'<a href="mailto:\1">\2</a>'),
-        (r'\[img\](.+?)\[/img\]', r'<img src="\1">'),
-        (r'\[img=(.+?)\](.+?)\[/img\]', r'<img src="\1" alt="\2">'),
-        (r'\[b\](.+?)\[/b\]', r'<b>\1</b>'),
-        (r'\[i\](.+?)\[/i\]', r'<i>\1</i>'),
-        (r'\[u\](.+?)\[/u\]', r'<u>\1</u>'),
-        (r'\[quote\](.+?)\[/quote\]', r'<blockquote class="content-quote">\1</blockquote>'),
-        (r'\[center\](.+?)\[/center\]', r'<div align="center">\1</div>'),
-        (r'\[code\]\s?(.+?)\[/code\]', r'<blockquote class="code-segment"><code><pre>\1</pre></code></blockquote>'),
-        (r'\[big\](.+?)\[/big\]', r'<big>\1</big>'),
-        (r'\[small\](.+?)\[/small\]', r'<small>\1</small>'),
-        ]
-
-    for bbset in bbdata:
-        p = re.compile(bbset[0], re.DOTALL)
-        value = p.sub(bbset[1], value)
-
-    #The following two code parts handle the more complex list statements
-    temp = ''
-    p = re.compile(r'\[list\](.+?)\[/list\]', re.DOTALL)
-    m = p.search(value)
-    if m:
-        items = re.split(re.escape('[*]'), m.group(1))
-        for i in items[1:]:
-            temp = temp + '<li>' + i + '</li>'
-        value = p.sub(r'<ul>'+temp+'</ul>', value)
-
-    temp = ''
-    p = re.compile(r'\[list=(.)\](.+?)\[/list\]', re.DOTALL)
-    m = p.search(value)
-    if m:
-        items = re.split(re.escape('[*]'), m.group(2))
-        for i in items[1:]:
-            temp = temp + '<li>' + i + '</li>'
-        value = p.sub(r'<ol type=\1>'+temp+'</ol>', value)
-
-    return value
\ No newline at end of file
+    return _content_parser.render_cached(value)
@@ -13,16 +13,23 @@ def safe_append(path):
     if path not in sys.path:
         sys.path.append(path)
 
-def main():
+def setup_paths():
     cur_path = os.path.dirname(__file__)
     safe_append(cur_path)
     
     for p in PATHS:
         path = os.path.join(cur_path, p)
         safe_append(path)
-    
-    from gaeo.app import GaeoApp, start_app
-    application = GaeoApp()
+
+setup_paths()
+
+from gaeo.app import GaeoApp, start_app
+
+# The long-lived WSGI application, it is thread-safe and can be served
+# directly by a (multithreaded) WSGI server, e.g. `script: main.application`.
+application = GaeoApp()
+
+def main():
     start_app(application)
 
 if __name__ == '__main__':
@@ -16,16 +16,51 @@ PLUGIN_DIR = 'plugins'
 PLUGIN_FILTERS_DIR = 'filters'
 PLUGIN_FILTERS_PATH = os.path.join(ROOT_PATH, PLUGIN_DIR, PLUGIN_FILTERS_DIR)
 CACHE_TIMEOUT = 3600
+CACHE_STALE_TIMEOUT = 60 # seconds a stale entry is served while recomputed
+CACHE_LOCK_TIMEOUT = 10 # lease of the recompute lock, in seconds
+CACHE_LOCK_WAIT = 0.5 # seconds to wait for a recompute if nothing is cached
+CONTENT_CACHE_SIZE = 1000 # number of safeout/bbcode outputs to memoize, 0 to disable
+CONTENT_CACHE_MEMCACHE = False # memoize the safeout/bbcode outputs in memcache too
+AUTO_ETAG = False # compute ETags from the buffered response bodies for conditional GETs
+
+# Response compression
+COMPRESS_RESPONSES = False # gzip/deflate as negotiated by Accept-Encoding
+COMPRESS_MIN_SIZE = 1024 # bytes, smaller buffered bodies are sent as is
+COMPRESS_LEVEL = 6 # 1 (fastest) - 9 (smallest)
+COMPRESS_CONTENT_TYPES = ('text/html', 'text/plain', 'text/css', 'text/xml',
+                          'application/json', 'application/javascript',
+                          'application/xml')
 
 # Session
 SESSION_COOKIE_NAME = 'GAEOSSID'
-SESSION_COOKIE_NAME_LENGTH = 64
 SESSION_COOKIE_TIMEOUT = 21600 # 6 hours
 SESSION_COOKIE_PATH = '/'
+SESSION_CLASS = 'Session' # or 'CookieSession' to keep the sessions in signed cookies
+SESSION_SECRET = '' # the HMAC key of CookieSession, set a long random string
+SESSION_ENCRYPT = False # encrypt the CookieSession cookies too
+SESSION_COOKIE_MAX_SIZE = 4000 # larger CookieSession sessions are stored as Session
+SESSION_STORE = 'MemcacheStore' # or 'TieredStore' to back memcache with the datastore
+SESSION_LOCAL_CACHE_SIZE = 1000 # number of sessions TieredStore keeps in the process
+SESSION_LOCAL_TTL = 5 # seconds TieredStore trusts a session kept in the process
+SESSION_WRITE_BEHIND_INTERVAL = 60 # seconds between the TieredStore datastore batches
+SESSION_CAS_RETRIES = 5 # merges retried when concurrent requests store a session
+# CompactSerializer stores JSON-like sessions (dicts with string keys, lists,
+# strings, numbers, booleans, None) as JSON, and pickles the others (datetimes,
+# model keys, tuples, int keys...) so they come back as they were. CookieSession
+# always uses JSON and rejects the other values when they are set.
+SESSION_SERIALIZER = 'CompactSerializer' # or 'PickleSerializer', or the dotted path of a class
+SESSION_COMPRESS_MIN_SIZE = 1024 # bytes of JSON from which a session is compressed
+
+# Router
+ROUTE_CACHE_SIZE = 1000 # number of resolved paths to cache, 0 to disable
 
 # Controller
 HANDLE_MISSING_ACTION = True
+DISPATCH_PLAN_CACHE_SIZE = 1000 # number of (controller, action) plans to cache
 
 # View
-VIEW_CLASS = 'AppengineTemplateView'
+# StreamingTemplateView buffers the responses of the @cache_action actions,
+# and while AUTO_ETAG is on, since both need the whole body before sending it
+VIEW_CLASS = 'AppengineTemplateView' # or 'StreamingTemplateView' to stream the responses
+VALIDATE_COMPILED_TEMPLATES = DEBUG # ignore stale `gaeo compile-templates` output
 
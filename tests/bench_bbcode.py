@@ -0,0 +1,51 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Benchmarks gaeo.utils.BBCodeParser over posts of growing sizes.
+
+The time per KB should stay flat as the posts grow, for the well-formed
+posts as well as for those whose tags are never closed.
+
+Usage: python tests/bench_bbcode.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'oildrum', 'lib'))
+
+from gaeo.utils import BBCodeParser
+
+# about 300 bytes of a typical post
+WELL_FORMED = (
+    'Some <text> with [b]bold[/b], [i]italic[/i] and '
+    '[url=http://example.com/]a [u]link[/u][/url].\n'
+    '[quote]quoted [small]words[/small][/quote]\n'
+    '[list][*]one\n[*]two [b]2[/b]\n[*]three[/list]\n'
+    '[code]for i in x:\n    print i[/code] [img=a.png]pic[/img] '
+    '[email]a@b.c[/email]\n')
+UNCLOSED = 'text [b]x [url=y]z [quote]q\n'
+PLAIN = 'Some plain text, with no tags at all.\n'
+
+
+def bench(label, unit, sizes, render):
+    print label
+    for size in sizes:
+        post = unit * size
+        number = max(1, 2000 // size)
+        best = min(timeit.repeat(lambda: render(post), number=number,
+                                 repeat=5)) / number
+        print '  %8d KB: %9.3f ms  (%.3f ms/KB)' % (
+            len(post) // 1024, best * 1000, best * 1000 * 1024 / len(post))
+
+
+def main():
+    # as safeout() renders
+    render = BBCodeParser(escape=True, linebreaks=True).render
+    bench('well-formed posts', WELL_FORMED, (5, 50, 500, 1000, 5000), render)
+    bench('unclosed tags', UNCLOSED, (10, 100, 1000, 10000), render)
+    bench('no tags', PLAIN, (40, 400, 4000), render)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Benchmarks the creation of new sessions.
+
+Compares the key generation and the first save of a new session with the
+way they were done before the keys came from os.urandom: 64 random.choice()
+picks hashed with SHA-1 and checked against the store, then a first save
+through the compare-and-set merge. The sessions go to the memcache stand-in
+of tests/stubs, with no latency for the key generation and a round trip
+latency for the sessions saved.
+
+Usage: python tests/bench_session_keys.py
+"""
+import hashlib
+import random
+import string
+import time
+import timeit
+
+import support
+from support import FakeController
+
+from google.appengine.api import memcache
+from gaeo.session import Session, get_serializer, get_store
+
+# the round trip latency of memcache, in seconds
+MEMCACHE_LATENCY = 0.001
+KEYS = 20000
+SESSIONS = 1000
+
+# the former settings.SESSION_COOKIE_NAME_LENGTH and its pool of characters
+KEY_LENGTH = 64
+POOL = string.digits + string.letters
+
+
+def old_session_key():
+    """Session.generate_session_key() before the keys came from os.urandom."""
+    while True:
+        key = ''.join([random.choice(POOL) for i in range(KEY_LENGTH)])
+        seed = 'session|%s|%s' % (key, time.time())
+        session_key = hashlib.sha1(seed).hexdigest()
+        if not get_store().exists(session_key):
+            return session_key
+
+
+def old_new_session():
+    """Creates and saves a session the way it was done before."""
+    key = old_session_key()
+    payload = get_serializer().dumps({'user': 1})
+    get_store().update(key, lambda current: payload, 3600)
+
+
+def new_session():
+    session = Session(controller=FakeController())
+    session['user'] = 1
+    session.save()
+
+
+def slow_down():
+    """Makes every call of the memcache stand-in wait a round trip."""
+    def slow(func):
+        def call(*args, **kwds):
+            time.sleep(MEMCACHE_LATENCY)
+            return func(*args, **kwds)
+        return call
+    for name in ('get', 'get_multi', 'set', 'add', 'delete'):
+        setattr(memcache, name, slow(getattr(memcache, name)))
+    for name in ('gets', 'cas'):
+        setattr(memcache.Client, name,
+                slow(getattr(memcache.Client, name).im_func))
+
+
+def main():
+    support.reset()
+    print 'key generation, no memcache latency'
+    for label, generate in (('before', old_session_key),
+                            ('after', Session.generate_session_key)):
+        best = min(timeit.repeat(generate, number=KEYS, repeat=3))
+        print '  %-7s %9.0f keys/s' % (label, KEYS / best)
+
+    slow_down()
+    print 'new session + first save, %g ms per memcache round trip' % (
+        MEMCACHE_LATENCY * 1000)
+    for label, create in (('before', old_new_session),
+                          ('after', new_session)):
+        support.reset()
+        start = time.time()
+        for i in xrange(SESSIONS):
+            create()
+        seconds = time.time() - start
+        print '  %-7s %9.0f sessions/s, %.1f memcache calls each' % (
+            label, SESSIONS / seconds,
+            float(len(memcache.calls)) / SESSIONS)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Benchmarks the size and speed of the session serializers.
+
+Compares PickleSerializer and CompactSerializer with the earlier format,
+the Session object itself pickled, on a small session and on a session
+holding a large shopping cart.
+
+Usage: python tests/bench_session_serializers.py
+"""
+import pickle
+import timeit
+
+import support
+from support import FakeController
+
+from gaeo.session import CompactSerializer, PickleSerializer, Session
+
+
+class OldPickle(object):
+    """The earlier format: pickle.dumps() of the Session object."""
+
+    def dumps(self, session):
+        return pickle.dumps(session)
+
+    def loads(self, payload):
+        return dict(pickle.loads(payload))
+
+
+def session_of(data):
+    session = Session(key='0' * 40, controller=FakeController())
+    session.update(data)
+    return session
+
+
+SMALL = {
+    'user_id': 48213,
+    'name': u'Alice Chen',
+    'lang': 'zh-tw',
+    'flash': u'Your post was published.',
+    'started': 1286000000.25,
+}
+
+CART = dict(SMALL)
+CART['cart'] = [{'sku': 'SKU-%05d' % i, 'title': u'Item number %d' % i,
+                 'qty': i % 5 + 1, 'price': 9.99 + i}
+                for i in xrange(400)]
+
+
+def bench(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def main():
+    for label, data, number, unit, scale in (
+            ('small session (%d keys)' % len(SMALL), SMALL, 2000, 'us', 1e6),
+            ('%d-item cart' % len(CART['cart']), CART, 20, 'ms', 1e3)):
+        print '%-26s %7s %9s %9s' % (label, 'bytes', 'dumps', 'loads')
+        for name, serializer in (('pickle (before)', OldPickle()),
+                                 ('PickleSerializer', PickleSerializer()),
+                                 ('CompactSerializer', CompactSerializer())):
+            value = data
+            if isinstance(serializer, OldPickle):
+                value = session_of(data)
+            payload = serializer.dumps(value)
+            assert serializer.loads(payload) == data
+            dumps = bench(lambda: serializer.dumps(value), number)
+            loads = bench(lambda: serializer.loads(payload), number)
+            print '  %-24s %7d %6.2f %s %6.2f %s' % (
+                name, len(payload), dumps * scale, unit, loads * scale, unit)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Benchmarks MemcacheStore against TieredStore.
+
+Several instances serve the requests of a set of sessions, over the memcache
+and datastore stand-ins of tests/stubs slowed down to a round trip latency.
+Each store runs the steady load, then the same load with memcache and the
+local LRUs flushed midway, as when memcache evicts everything or the
+instances restart. For each run it prints the time taken, the memcache and
+datastore calls, the requests which lost their session, and the hit ratio of
+each tier of TieredStore.
+
+Usage: python tests/bench_session_store.py
+"""
+import random
+import time
+
+import support
+
+from google.appengine.api import memcache
+from google.appengine.ext import db
+from gaeo.session import DatastoreStore, MemcacheStore, TieredStore
+
+# the round trip latencies, in seconds
+MEMCACHE_LATENCY = 0.001
+DATASTORE_LATENCY = 0.01
+INSTANCES = 4
+SESSIONS = 200
+REQUESTS = 3000
+# the share of the requests which change their session
+WRITES = 0.3
+# the seconds between the write-behind batches of TieredStore
+WRITE_BEHIND_INTERVAL = 0.25
+TIMEOUT = 3600
+
+
+class SlowMemcache(object):
+    """A memcache client which waits a round trip on every call."""
+
+    # the calls made by all the clients, memcache.calls is emptied along with
+    # the cache
+    calls = 0
+
+    def __init__(self):
+        self._client = memcache.Client()
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def call(*args, **kwds):
+            SlowMemcache.calls += 1
+            time.sleep(MEMCACHE_LATENCY)
+            return method(*args, **kwds)
+        return call
+
+
+class SlowDatastore(DatastoreStore):
+    """A DatastoreStore which waits a round trip on every datastore call."""
+
+    def __wait(self, method, *args):
+        count = len(db.rpcs)
+        try:
+            return method(self, *args)
+        finally:
+            time.sleep(DATASTORE_LATENCY * (len(db.rpcs) - count))
+
+    def get(self, key):
+        return self.__wait(DatastoreStore.get, key)
+
+    def set_multi(self, sessions):
+        return self.__wait(DatastoreStore.set_multi, sessions)
+
+    def delete(self, key):
+        return self.__wait(DatastoreStore.delete, key)
+
+
+def memcache_store():
+    return MemcacheStore(client=SlowMemcache())
+
+
+def tiered_store():
+    return TieredStore(interval=WRITE_BEHIND_INTERVAL, client=SlowMemcache(),
+                       durable=SlowDatastore())
+
+
+def run(new_store, flush_midway):
+    """Serves the requests with the stores of new_store().
+
+    Returns:
+        A tuple of (seconds, the requests which lost their session, the
+        stores).
+    """
+    support.reset()
+    stores = [new_store() for i in xrange(INSTANCES)]
+    rand = random.Random(42)
+    keys = ['%040x' % rand.getrandbits(160) for i in xrange(SESSIONS)]
+    for key in keys:
+        rand.choice(stores).add(key, 'new', TIMEOUT)
+    for store in stores:
+        if isinstance(store, TieredStore):
+            store.flush()
+            store.reset_stats()
+    SlowMemcache.calls = 0
+    del db.rpcs[:]
+
+    lost = 0
+    start = time.time()
+    for i in xrange(REQUESTS):
+        if flush_midway and i == REQUESTS // 2:
+            memcache.reset()
+            for store in stores:
+                if isinstance(store, TieredStore):
+                    store._local.clear()
+        store = rand.choice(stores)
+        key = rand.choice(keys)
+        if store.get(key) is None:
+            lost += 1
+        if rand.random() < WRITES:
+            store.update(key, lambda current: 'request %d' % i, TIMEOUT)
+    for store in stores:
+        if isinstance(store, TieredStore):
+            store.flush()
+    return time.time() - start, lost, stores
+
+
+def report(name, seconds, lost, stores):
+    line = '  %-14s %6.2f s  memcache %5d calls  datastore %4d calls' \
+        '  lost %4d' % (name, seconds, SlowMemcache.calls, len(db.rpcs), lost)
+    print line
+    if isinstance(stores[0], TieredStore):
+        stats = {}
+        for tier in TieredStore.TIERS:
+            stats[tier] = {'hits': 0, 'misses': 0}
+        writes = 0
+        for store in stores:
+            for tier in TieredStore.TIERS:
+                for count in ('hits', 'misses'):
+                    stats[tier][count] += store.stats[tier][count]
+            writes += store.stats['datastore']['writes']
+        ratios = []
+        for tier in TieredStore.TIERS:
+            total = stats[tier]['hits'] + stats[tier]['misses']
+            if total:
+                ratios.append('%s %3.0f%%' % (
+                    tier, 100.0 * stats[tier]['hits'] / total))
+            else:
+                ratios.append('%s    -' % tier)
+        print '  %-14s hit ratios: %s, %d write-behind batches' % (
+            '', ', '.join(ratios), writes)
+
+
+def main():
+    print '%d instances, %d sessions, %d requests, %d%% writes, ' \
+        'memcache %g ms, datastore %g ms' % (
+            INSTANCES, SESSIONS, REQUESTS, WRITES * 100,
+            MEMCACHE_LATENCY * 1000, DATASTORE_LATENCY * 1000)
+    for label, flush_midway in (('steady', False),
+                                ('memcache and LRUs flushed midway', True)):
+        print label
+        for name, new_store in (('MemcacheStore', memcache_store),
+                                ('TieredStore', tiered_store)):
+            report(name, *run(new_store, flush_midway))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+
+class Bootstrap:
+    """
+    The base controller init mixin
+    """
+    def bootstrap(self):
+        """
+        default initialization method invoked by dispatcher
+        """
+        pass
@@ -0,0 +1,23 @@
+from gaeo.cache import cache_action
+from gaeo.controller import Controller
+
+
+class Cached(Controller):
+    """Has cached actions, for the action cache tests."""
+
+    def before_action(self):
+        if self.params.get('action') == 'guarded':
+            self.redirect('/login')
+            return False
+
+    @cache_action(ttl=60)
+    def index(self):
+        self.output('fresh')
+
+    @cache_action(ttl=60)
+    def guarded(self):
+        self.output('never')
+
+    @cache_action(ttl=60)
+    def broken(self):
+        raise ValueError('broken')
@@ -0,0 +1,15 @@
+import time
+
+from gaeo.controller import Controller
+
+
+class Echo(Controller):
+    """Answers with what the request sent, for the concurrency tests."""
+
+    def index(self):
+        self.response.headers['X-Echo'] = self.params['key']
+        self.output('key=%s;' % self.params['key'])
+        # let the other requests run in between the writes
+        time.sleep(0.001)
+        self.output('q=%s;' % self.params.get('q'),
+                    'agent=%s' % self.request.headers.get('User-Agent'))
@@ -0,0 +1,14 @@
+from gaeo.controller import Controller
+
+
+class Pages(Controller):
+    """Renders templates, for the view tests and the template benchmark."""
+
+    def show(self):
+        self.view.title = 'Page %s' % self.params.get('key', '')
+        self.view.body = 'A [b]small[/b] post with a [url=/x]link[/url].'
+        self.view.tags = ['One', 'Two', 'Three']
+
+    def moved(self):
+        self.view.title = 'Page %s' % self.params.get('key', '')
+        self.view.set_render_path(script='other')
@@ -0,0 +1,25 @@
+from gaeo.controller import Controller
+
+# a listing page of about 100 KB
+HTML = '<html><head><title>Posts</title></head><body><table>%s</table>' \
+    '</body></html>' % ''.join([
+        '<tr class="row%d"><td><a href="/post/show/%d">Post number %d</a>'
+        '</td><td>user%d</td><td>2010-10-%02d</td><td>%d comments</td>'
+        '</tr>\n' % (i % 2, i, i, i % 37, i % 28 + 1, i % 13)
+        for i in xrange(800)])
+
+# a list of about 100 KB of JSON records
+RECORDS = [{'id': i, 'title': 'Post number %d' % i, 'author': 'user%d' % (i % 37),
+            'date': '2010-10-%02d' % (i % 28 + 1), 'comments': i % 13,
+            'tags': ['tag%d' % (i % 7), 'tag%d' % (i % 11)]}
+           for i in xrange(800)]
+
+
+class Payloads(Controller):
+    """Outputs large bodies, for the compression benchmark."""
+
+    def html(self):
+        self.output(HTML)
+
+    def json(self):
+        self.json_output(RECORDS)
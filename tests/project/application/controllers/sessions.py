@@ -0,0 +1,21 @@
+from gaeo.controller import Controller
+
+
+class Sessions(Controller):
+    """Uses the session, for the session write tests."""
+
+    def before_action(self):
+        if self.params.get('action') == 'guard':
+            self.session['flash'] = 'denied'
+            return False
+
+    def five(self):
+        for i in xrange(5):
+            self.session['k%d' % i] = i
+        self.output('five')
+
+    def peek(self):
+        self.output('k0=%s' % self.session['k0'])
+
+    def guard(self):
+        self.output('never')
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" The settings of the project the tests run against. """
+
+import os
+
+# General
+DEBUG = True
+ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = 'application'
+APP_PATH = os.path.join(ROOT_PATH, APP_DIR)
+TEMPLATE_DIR = 'templates'
+TEMPLATE_PATH = os.path.join(ROOT_PATH, APP_DIR, TEMPLATE_DIR)
+PLUGIN_DIR = 'plugins'
+PLUGIN_FILTERS_DIR = 'filters'
+PLUGIN_FILTERS_PATH = os.path.join(ROOT_PATH, PLUGIN_DIR, PLUGIN_FILTERS_DIR)
+CACHE_TIMEOUT = 3600
+
+# Session
+SESSION_COOKIE_NAME = 'GAEOSSID'
+SESSION_COOKIE_TIMEOUT = 21600
+SESSION_COOKIE_PATH = '/'
+SESSION_CLASS = 'Session'
+SESSION_STORE = 'MemcacheStore'
+SESSION_CAS_RETRIES = 5
+
+# Controller
+HANDLE_MISSING_ACTION = False
+
+# View
+VIEW_CLASS = 'AppengineTemplateView'
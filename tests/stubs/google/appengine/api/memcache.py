@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" An in-process stand-in for google.appengine.api.memcache.
+
+Only the calls GAEO makes are implemented. Every call is recorded in `calls`
+as a (name, key) tuple, so the tests can count the round trips. The timeouts
+are ignored, nothing expires.
+"""
+
+import threading
+
+# key -> value
+_data = {}
+# key -> CAS id, bumped on every write
+_versions = {}
+_lock = threading.RLock()
+
+# the (name, key) of the calls made, in order
+calls = []
+
+
+def reset():
+    """Empties the cache and forgets the calls."""
+    _lock.acquire()
+    try:
+        _data.clear()
+        _versions.clear()
+        del calls[:]
+    finally:
+        _lock.release()
+
+
+def count(name):
+    """Gets the number of the calls of the named function or method."""
+    return len([call for call in calls if call[0] == name])
+
+
+def _store(key, value):
+    _data[key] = value
+    _versions[key] = _versions.get(key, 0) + 1
+
+
+def get(key, namespace=None):
+    calls.append(('get', key))
+    return _data.get(key)
+
+
+def get_multi(keys, key_prefix='', namespace=None):
+    calls.append(('get_multi', tuple(keys)))
+    _lock.acquire()
+    try:
+        return dict((key, _data[key_prefix + key]) for key in keys
+                    if key_prefix + key in _data)
+    finally:
+        _lock.release()
+
+
+def set(key, value, time=0, namespace=None):
+    calls.append(('set', key))
+    _lock.acquire()
+    try:
+        _store(key, value)
+        return True
+    finally:
+        _lock.release()
+
+
+def add(key, value, time=0, namespace=None):
+    calls.append(('add', key))
+    _lock.acquire()
+    try:
+        if key in _data:
+            return False
+        _store(key, value)
+        return True
+    finally:
+        _lock.release()
+
+
+def delete(key, seconds=0, namespace=None):
+    calls.append(('delete', key))
+    _lock.acquire()
+    try:
+        _versions.pop(key, None)
+        if _data.pop(key, None) is None:
+            return 1
+        return 2
+    finally:
+        _lock.release()
+
+
+class Client(object):
+    """A client which keeps the CAS ids of the values it gets()."""
+
+    def __init__(self):
+        self._cas_ids = {}
+
+    def get(self, key, namespace=None):
+        return get(key, namespace)
+
+    def set(self, key, value, time=0, namespace=None):
+        return set(key, value, time, namespace)
+
+    def add(self, key, value, time=0, namespace=None):
+        return add(key, value, time, namespace)
+
+    def delete(self, key, seconds=0, namespace=None):
+        return delete(key, seconds, namespace)
+
+    def gets(self, key, namespace=None):
+        calls.append(('gets', key))
+        _lock.acquire()
+        try:
+            if key in _data:
+                self._cas_ids[key] = _versions[key]
+            return _data.get(key)
+        finally:
+            _lock.release()
+
+    def cas(self, key, value, time=0, namespace=None):
+        """Stores the value unless the key was written since gets()."""
+        calls.append(('cas', key))
+        _lock.acquire()
+        try:
+            cas_id = self._cas_ids.pop(key, None)
+            if key not in _data or cas_id != _versions[key]:
+                return False
+            _store(key, value)
+            return True
+        finally:
+            _lock.release()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" An in-process stand-in for google.appengine.ext.db.
+
+Only what GAEO uses is implemented. Every datastore call is recorded in
+`rpcs` as a (name, number of entities) tuple, and like the datastore, a
+batch call takes at most MAX_BATCH_SIZE entities.
+"""
+
+import itertools
+import threading
+
+MAX_BATCH_SIZE = 500
+
+# Key -> property values
+_entities = {}
+_ids = itertools.count(1)
+_lock = threading.RLock()
+
+# the (name, number of entities) of the datastore calls made, in order
+rpcs = []
+
+
+def reset():
+    """Empties the datastore and forgets the calls."""
+    _lock.acquire()
+    try:
+        _entities.clear()
+        del rpcs[:]
+    finally:
+        _lock.release()
+
+
+class Error(Exception):
+    pass
+
+
+class BadArgumentError(Error):
+    pass
+
+
+class NotSavedError(Error):
+    pass
+
+
+class Blob(str):
+    pass
+
+
+class Key(object):
+
+    def __init__(self, kind, name):
+        self.__kind = kind
+        self.__name = name
+
+    @classmethod
+    def from_path(cls, kind, name):
+        return cls(kind, name)
+
+    def kind(self):
+        return self.__kind
+
+    def name(self):
+        return self.__name
+
+    def __eq__(self, other):
+        return isinstance(other, Key) and \
+            (self.__kind, self.__name) == (other.__kind, other.__name)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.__kind, self.__name))
+
+    def __repr__(self):
+        return 'Key(%r, %r)' % (self.__kind, self.__name)
+
+
+class Property(object):
+
+    def __init__(self, default=None, **kwds):
+        self.default = default
+        self.name = None
+
+    def __get__(self, model, cls):
+        if model is None:
+            return self
+        return model._values.get(self.name, self.default)
+
+    def __set__(self, model, value):
+        model._values[self.name] = value
+
+
+class BlobProperty(Property):
+    pass
+
+
+class DateTimeProperty(Property):
+    pass
+
+
+class IntegerProperty(Property):
+    pass
+
+
+class StringProperty(Property):
+    pass
+
+
+class _ModelMeta(type):
+    """Names the properties of a model class."""
+
+    def __init__(cls, name, bases, attrs):
+        super(_ModelMeta, cls).__init__(name, bases, attrs)
+        properties = {}
+        for base in bases:
+            properties.update(getattr(base, '_properties', {}))
+        for attr, value in attrs.iteritems():
+            if isinstance(value, Property):
+                value.name = attr
+                properties[attr] = value
+        cls._properties = properties
+
+
+class Model(object):
+    __metaclass__ = _ModelMeta
+
+    def __init__(self, key_name=None, **kwds):
+        self._values = {}
+        self._key_name = key_name
+        for name, value in kwds.iteritems():
+            setattr(self, name, value)
+
+    @classmethod
+    def kind(cls):
+        return cls.__name__
+
+    @classmethod
+    def properties(cls):
+        return dict(cls._properties)
+
+    def key(self):
+        if self._key_name is None:
+            raise NotSavedError()
+        return Key(self.kind(), self._key_name)
+
+    def is_saved(self):
+        return self._key_name is not None and self.key() in _entities
+
+    def put(self, **kwds):
+        return put(self, **kwds)
+
+    def delete(self, **kwds):
+        delete(self, **kwds)
+
+    @classmethod
+    def get_by_key_name(cls, key_name):
+        rpcs.append(('get', 1))
+        values = _entities.get(Key(cls.kind(), key_name))
+        if values is None:
+            return None
+        entity = cls(key_name=key_name)
+        entity._values = dict(values)
+        return entity
+
+    @classmethod
+    def all(cls, keys_only=False):
+        return Query(cls, keys_only)
+
+
+class Query(object):
+    """Supports the filters on a property with the '<' operator only."""
+
+    def __init__(self, model_class, keys_only=False):
+        self.__model_class = model_class
+        self.__keys_only = keys_only
+        self.__filters = []
+
+    def filter(self, property_operator, value):
+        name, operator = property_operator.split()
+        if operator != '<':
+            raise BadArgumentError('unsupported operator %s' % operator)
+        self.__filters.append((name, value))
+        return self
+
+    def fetch(self, limit):
+        rpcs.append(('query', 1))
+        kind = self.__model_class.kind()
+        keys = [key for key, values in _entities.items()
+                if key.kind() == kind and
+                all(values.get(name) < value
+                    for name, value in self.__filters)][:limit]
+        if self.__keys_only:
+            return keys
+        return [self.__model_class.get_by_key_name(key.name())
+                for key in keys]
+
+
+def _check_batch(entities):
+    if len(entities) > MAX_BATCH_SIZE:
+        raise BadArgumentError('cannot write more than %d entities in a '
+                               'call, got %d' % (MAX_BATCH_SIZE,
+                                                 len(entities)))
+
+
+def put(models, **kwds):
+    multiple = isinstance(models, (list, tuple))
+    if not multiple:
+        models = [models]
+    _check_batch(models)
+    rpcs.append(('put', len(models)))
+    keys = []
+    _lock.acquire()
+    try:
+        for model in models:
+            if model._key_name is None:
+                model._key_name = 'id%d' % _ids.next()
+            _entities[model.key()] = dict(model._values)
+            keys.append(model.key())
+    finally:
+        _lock.release()
+    if multiple:
+        return keys
+    return keys[0]
+
+
+def delete(models, **kwds):
+    if not isinstance(models, (list, tuple)):
+        models = [models]
+    _check_batch(models)
+    rpcs.append(('delete', len(models)))
+    _lock.acquire()
+    try:
+        for model in models:
+            if not isinstance(model, Key):
+                model = model.key()
+            _entities.pop(model, None)
+    finally:
+        _lock.release()
@@ -0,0 +1,6 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" A stand-in for google.appengine.ext.webapp, only its template module. """
+
+from google.appengine.ext.webapp import template
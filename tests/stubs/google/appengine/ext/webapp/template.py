@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" A stand-in for google.appengine.ext.webapp.template, over the installed
+Django.
+
+Like the webapp module, a template is loaded with its own directory as the
+template directory, and cached unless it is loaded in debug mode. The
+template loads and the library registrations are counted in `loads` and
+`registrations`.
+"""
+
+import os
+
+import django.conf
+if not django.conf.settings.configured:
+    django.conf.settings.configure(TEMPLATE_DEBUG=False, TEMPLATE_DIRS=())
+import django.template
+from django.template import loader
+
+# the templates parsed, and the calls of register_template_library()
+loads = 0
+registrations = 0
+
+# absolute path -> compiled template, of the templates loaded out of debug
+_cache = {}
+
+
+def reset():
+    """Forgets the cached templates and zeroes the counters."""
+    global loads, registrations
+    _cache.clear()
+    loads = 0
+    registrations = 0
+
+
+def create_template_register():
+    return django.template.Library()
+
+
+def register_template_library(package_name):
+    global registrations
+    registrations += 1
+    if package_name not in django.template.libraries:
+        django.template.add_to_builtins(package_name)
+        django.template.libraries[package_name] = django.template.builtins[-1]
+
+
+def load(path, debug=False):
+    global loads
+    abspath = os.path.abspath(path)
+    compiled = _cache.get(abspath)
+    if compiled is None or debug:
+        loads += 1
+        directory, file_name = os.path.split(abspath)
+        django.conf.settings.TEMPLATE_DIRS = (directory, )
+        compiled = loader.get_template(file_name)
+        if not debug:
+            _cache[abspath] = compiled
+    return compiled
+
+
+def render(path, template_dict, debug=False):
+    return load(path, debug).render(django.template.Context(template_dict))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" The common setup of the tests.
+
+Puts the test project (tests/project), the GAEO library and the stand-ins of
+the App Engine APIs (tests/stubs) on sys.path, the way main.py sets up a
+project. Run the tests from the repository root with:
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.join(TESTS_DIR, 'project')
+LIB_DIR = os.path.normpath(os.path.join(TESTS_DIR, '..', 'oildrum', 'lib'))
+STUBS_DIR = os.path.join(TESTS_DIR, 'stubs')
+
+for path in (os.path.join(LIB_DIR, 'gaeo'), LIB_DIR, PROJECT_DIR,
+             STUBS_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from google.appengine.api import memcache
+from google.appengine.ext import db
+
+import settings
+
+
+def request(app, path, **kwds):
+    """Sends a request to the WSGI application.
+
+    Args:
+        app: the WSGI application, e.g. a GaeoApp.
+        path: the path and query string of the request.
+        **kwds: the other arguments of webob.Request.blank(), e.g. headers.
+
+    Returns:
+        The webob.Response.
+    """
+    import webob
+    return webob.Request.blank(path, **kwds).get_response(app)
+
+
+def reset():
+    """Empties the memcache and datastore stand-ins."""
+    memcache.reset()
+    db.reset()
+
+
+def override_settings(test, **values):
+    """Changes the settings for the duration of the test case method.
+
+    Args:
+        test: the unittest.TestCase, which restores the settings on cleanup.
+        **values: the setting names and their values.
+    """
+    for name, value in values.iteritems():
+        test.addCleanup(_restore_setting, name,
+                        getattr(settings, name, _MISSING))
+        setattr(settings, name, value)
+
+
+_MISSING = object()
+
+
+def _restore_setting(name, value):
+    if value is _MISSING:
+        delattr(settings, name)
+    else:
+        setattr(settings, name, value)
+
+
+class FakeController(object):
+    """Takes the session cookies in place of a Controller."""
+
+    def __init__(self):
+        self.cookies = []
+
+    def set_cookie(self, key, value='', max_age=None, *args, **kwds):
+        self.cookies.append((key, value))
+        return True
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Tests the recompute lock of the cached actions. """
+
+import unittest
+
+import support
+import webob
+from support import override_settings
+
+from google.appengine.api import memcache
+from gaeo.app import GaeoApp
+from gaeo.cache import CacheOptions, action_cache
+
+
+class ActionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        support.reset()
+        action_cache.reset_stats()
+        self.app = GaeoApp()
+        # keep the tests short if a lock is left behind
+        override_settings(self, CACHE_LOCK_WAIT=0.1)
+
+    def lock_key(self, action, path):
+        request = webob.Request.blank(path)
+        key = action_cache.response_key('cached', action, request,
+                                        CacheOptions(ttl=60))
+        return action_cache._lock_key(key)
+
+    def test_response_is_cached(self):
+        for i in xrange(3):
+            response = support.request(self.app, '/cached')
+            self.assertEqual(response.body, 'fresh')
+        self.assertEqual(action_cache.stats['misses'], 1)
+        self.assertEqual(action_cache.stats['hits'], 2)
+        self.assertTrue(memcache.get(self.lock_key('index', '/cached'))
+                        is None)
+
+    def test_vetoed_action_releases_the_lock(self):
+        for i in xrange(3):
+            response = support.request(self.app, '/cached/guarded')
+            self.assertEqual(response.status_int, 302)
+        self.assertTrue(memcache.get(self.lock_key('guarded',
+                                                   '/cached/guarded')) is None)
+        self.assertEqual(action_cache.stats['misses'], 3)
+        self.assertEqual(action_cache.stats['lock_waits'], 0)
+
+    def test_failed_action_releases_the_lock(self):
+        for i in xrange(3):
+            self.assertRaises(ValueError, support.request, self.app,
+                              '/cached/broken')
+        override_settings(self, DEBUG=False)
+        response = support.request(self.app, '/cached/broken')
+        self.assertEqual(response.status_int, 500)
+        self.assertTrue(memcache.get(self.lock_key('broken',
+                                                   '/cached/broken')) is None)
+        self.assertEqual(action_cache.stats['misses'], 4)
+        self.assertEqual(action_cache.stats['lock_waits'], 0)
+
+    def test_timed_out_request_keeps_the_lock(self):
+        # another request is recomputing the response
+        lock_key = self.lock_key('index', '/cached')
+        memcache.add(lock_key, 1)
+        response = support.request(self.app, '/cached')
+        self.assertEqual(response.body, 'fresh')
+        self.assertEqual(action_cache.stats['lock_timeouts'], 1)
+        self.assertEqual(memcache.get(lock_key), 1)
+        # the response is stored all the same
+        self.assertEqual(support.request(self.app, '/cached').body, 'fresh')
+        self.assertEqual(action_cache.stats['hits'], 1)
+
+    def test_timed_out_request_keeps_the_lock_on_veto(self):
+        lock_key = self.lock_key('guarded', '/cached/guarded')
+        memcache.add(lock_key, 1)
+        response = support.request(self.app, '/cached/guarded')
+        self.assertEqual(response.status_int, 302)
+        self.assertEqual(memcache.get(lock_key), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
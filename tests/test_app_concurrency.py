@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Tests one GaeoApp serving concurrent requests. """
+
+import threading
+import unittest
+
+import support
+
+from gaeo.app import GaeoApp
+
+THREADS = 16
+REQUESTS = 25
+
+
+class AppConcurrencyTest(unittest.TestCase):
+
+    def setUp(self):
+        support.reset()
+
+    def test_parallel_requests_get_their_own_responses(self):
+        app = GaeoApp()
+        start = threading.Event()
+        errors = []
+
+        def send(thread):
+            start.wait()
+            for i in xrange(REQUESTS):
+                key = '%d-%d' % (thread, i)
+                response = support.request(
+                    app, '/echo/index/%s?q=%d' % (key, i),
+                    headers={'User-Agent': 'agent-%s' % key})
+                expected = 'key=%s;q=%d;agent=agent-%s' % (key, i, key)
+                if response.status_int != 200 or \
+                        response.body != expected or \
+                        response.headers.get('X-Echo') != key:
+                    errors.append((key, response.status, response.body))
+
+        threads = [threading.Thread(target=send, args=(i, ))
+                   for i in xrange(THREADS)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        # nothing of the requests is left on the application
+        self.assertTrue(app.request is None)
+        self.assertTrue(app.response is None)
+
+    def test_render_paths_are_per_request(self):
+        app = GaeoApp()
+        start = threading.Event()
+        errors = []
+
+        def send(thread):
+            start.wait()
+            for i in xrange(REQUESTS):
+                key = '%d-%d' % (thread, i)
+                # every other request renders another template
+                if (thread + i) % 2:
+                    path, expected = '/pages/moved/%s', 'other Page %s'
+                else:
+                    path, expected = '/pages/show/%s', '<h1>PAGE %s</h1>'
+                response = support.request(app, path % key)
+                if response.status_int != 200 or \
+                        expected % key not in response.body:
+                    errors.append((path % key, response.status,
+                                   response.body))
+
+        threads = [threading.Thread(target=send, args=(i, ))
+                   for i in xrange(THREADS)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_request_properties_are_per_thread(self):
+        app = GaeoApp()
+        seen = {}
+        entered = threading.Event()
+        leave = threading.Event()
+
+        def dispatch(request, response):
+            seen['request'] = app.request
+            entered.set()
+            leave.wait()
+            response.out.write('done')
+
+        app._dispatch = dispatch
+        thread = threading.Thread(target=support.request,
+                                  args=(app, '/echo/index/x'))
+        thread.start()
+        entered.wait()
+        try:
+            # another thread does not see the request in progress
+            self.assertTrue(seen['request'] is not None)
+            self.assertTrue(app.request is None)
+        finally:
+            leave.set()
+            thread.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Tests the HTML of bbcode(), safeout() and the bbcode_content filter. """
+
+import random
+import unittest
+
+import support
+
+from gaeo.cache import content_cache
+from gaeo.utils import BBCodeParser, bbcode, safeout
+from gaeo.view.filters.content import bbcode_content
+
+# the pieces of the random inputs of the agreement test
+TEXTS = ('text', ' ', '\n', ' \n ', '<', '"', '=', ']')
+WRAPPERS = ('b', 'i', 'quote', 'center', 'url=http://x/"y', 'email=a@b.c')
+RAW = ('url', 'email', 'img', 'img=p.png', 'code')
+NOISE = ('[b]', '[/b]', '[/i]', '[url]', '[/url]', '[code]', '[list]',
+         '[/list]', '[*]', '[/*]', '[b=1]', '[url=]', '[B]', '[')
+
+
+def random_bbcode(rand, depth=0):
+    """Makes up an input of mostly well-nested tags, with some noise."""
+    out = []
+    for i in xrange(rand.randint(0, 4)):
+        roll = rand.random()
+        if roll < 0.3 or depth > 3:
+            out.append(rand.choice(TEXTS))
+        elif roll < 0.55:
+            tag = rand.choice(WRAPPERS)
+            out.append('[%s]%s[/%s]' % (tag, random_bbcode(rand, depth + 1),
+                                        tag.split('=')[0]))
+        elif roll < 0.75:
+            items = [rand.choice(('', ' ', '\n'))]
+            for j in xrange(rand.randint(0, 3)):
+                items.append('[*]' + random_bbcode(rand, depth + 1))
+            out.append('[%s]%s[/list]' % (rand.choice(('list', 'list=a')),
+                                          ''.join(items)))
+        elif roll < 0.9:
+            tag = rand.choice(RAW)
+            out.append('[%s]%s[/%s]' % (tag, rand.choice(TEXTS + ('[b]', '')),
+                                        tag.split('=')[0]))
+        else:
+            out.append(rand.choice(NOISE))
+    return ''.join(out)
+
+
+class BBCodeTest(unittest.TestCase):
+
+    def setUp(self):
+        content_cache.clear()
+        content_cache.reset_stats()
+
+    def assertHtml(self, value, html, render=bbcode):
+        self.assertEqual(render(value), html)
+
+    def test_plain_text(self):
+        self.assertHtml('plain text', 'plain text')
+        self.assertHtml('[]', '[]')
+
+    def test_wrappers(self):
+        self.assertHtml('[b]b[/b] [i]i[/i] [u]u[/u] [big]B[/big] '
+                        '[small]s[/small]',
+                        '<b>b</b> <i>i</i> <u>u</u> <big>B</big> '
+                        '<small>s</small>')
+        self.assertHtml('[quote]q [b]x[/b][/quote]',
+                        '<blockquote class="content-quote">q <b>x</b>'
+                        '</blockquote>')
+        self.assertHtml('[center]c[/center]', '<div align="center">c</div>')
+
+    def test_nesting(self):
+        self.assertHtml('[b][i][u]x[/u][/i][/b]', '<b><i><u>x</u></i></b>')
+        self.assertHtml('[url=/a][b]bold[/b] link[/url]',
+                        '<a href="/a"><b>bold</b> link</a>')
+
+    def test_links(self):
+        self.assertHtml('[url]http://a.com/?x=1[/url]',
+                        '<a href="http://a.com/?x=1">http://a.com/?x=1</a>')
+        self.assertHtml('[email]a@b.c[/email]',
+                        '<a href="mailto:a@b.c">a@b.c</a>')
+        self.assertHtml('[email=a@b.c]mail me[/email]',
+                        '<a href="mailto:a@b.c">mail me</a>')
+
+    def test_images(self):
+        self.assertHtml('[img]a.png[/img]', '<img src="a.png">')
+        self.assertHtml('[img=a.png]a picture[/img]',
+                        '<img src="a.png" alt="a picture">')
+        self.assertHtml('[img][/img]', '[img][/img]')
+
+    def test_attributes_are_quoted(self):
+        self.assertHtml('[url=http://a.com/"x]link[/url]',
+                        '<a href="http://a.com/&quot;x">link</a>')
+        self.assertHtml('[url]/?q="2"[/url]',
+                        '<a href="/?q=&quot;2&quot;">/?q="2"</a>')
+        self.assertHtml('[img=a"b.png]alt "x"[/img]',
+                        '<img src="a&quot;b.png" alt="alt &quot;x&quot;">')
+
+    def test_raw_content_is_not_parsed(self):
+        self.assertHtml('[code] for i in x:\n  [b]print[/b] i[/code]',
+                        '<blockquote class="code-segment"><code><pre>'
+                        'for i in x:\n  [b]print[/b] i</pre></code>'
+                        '</blockquote>')
+        self.assertHtml('[url]/a[b]x[/b][/url]',
+                        '<a href="/a[b]x[/b]">/a[b]x[/b]</a>')
+
+    def test_lists(self):
+        self.assertHtml('[list]\n[*]one\n[*]two\n[/list]',
+                        '<ul><li>one\n</li><li>two\n</li></ul>')
+        self.assertHtml('[list=1][*]a[*]b[/list]',
+                        '<ol type="1"><li>a</li><li>b</li></ol>')
+        self.assertHtml('[list][*]a[list][*]b[/list][/list]',
+                        '<ul><li>a<ul><li>b</li></ul></li></ul>')
+        self.assertHtml('[list][/list]', '<ul></ul>')
+        self.assertHtml('[*]no list', '[*]no list')
+
+    def test_unclosed_and_misnested_tags_are_left(self):
+        self.assertHtml('[b]open', '[b]open')
+        self.assertHtml('[b]x[i]y[/b]z[/i]', '<b>x[i]y</b>z[/i]')
+        self.assertHtml('[/b]stray', '[/b]stray')
+        self.assertHtml('[code]unclosed', '[code]unclosed')
+        self.assertHtml('[url]a[/url] and [url]b',
+                        '<a href="a">a</a> and [url]b')
+        self.assertHtml('[list][*]a', '[list][*]a')
+        self.assertHtml('[quote][b]x[/quote]',
+                        '<blockquote class="content-quote">[b]x'
+                        '</blockquote>')
+
+    def test_unknown_tags_are_left(self):
+        self.assertHtml('[B]upper[/B]', '[B]upper[/B]')
+        self.assertHtml('[b=1]x[/b]', '[b=1]x[/b]')
+        self.assertHtml('[url=]x[/url]', '[url=]x[/url]')
+
+    def test_bbcode_does_not_escape(self):
+        self.assertHtml('a <b>c</b>\n[i]d[/i]', 'a <b>c</b>\n<i>d</i>')
+
+    def test_safeout_escapes(self):
+        self.assertHtml('a < b > c\n[b]d[/b]', 'a &lt; b &gt; c<br><b>d</b>',
+                        safeout)
+        self.assertHtml('<script>[url]/<x>[/url]',
+                        '&lt;script&gt;<a href="/&lt;x&gt;">/&lt;x&gt;</a>',
+                        safeout)
+        self.assertHtml('[code]<a>\n[/code]',
+                        '<blockquote class="code-segment"><code><pre>'
+                        '&lt;a&gt;<br></pre></code></blockquote>', safeout)
+
+    def test_bbcode_content_filter(self):
+        self.assertHtml('<i>[url=/x]link[/url]\n',
+                        '&lt;i&gt;<a class="link-segment" href="/x">link</a>'
+                        '\n', bbcode_content)
+
+    def test_outputs_are_memoized(self):
+        self.assertEqual(bbcode('[b]x[/b]'), '<b>x</b>')
+        self.assertEqual(bbcode('[b]x[/b]'), '<b>x</b>')
+        self.assertEqual(safeout('[b]x[/b]\n'), '<b>x</b><br>')
+        self.assertEqual(content_cache.stats['hits'], 1)
+        self.assertEqual(content_cache.stats['misses'], 2)
+
+    def test_the_two_paths_agree(self):
+        # _render_nested() handles the well-nested inputs, which the general
+        # _render_stack() must render the same
+        rand = random.Random(16)
+        parsers = (BBCodeParser(), BBCodeParser(link_class='link'))
+        nested = 0
+        for i in xrange(5000):
+            value = random_bbcode(rand)
+            for parser in parsers:
+                html = parser._render_nested(value)
+                if html is not None:
+                    nested += 1
+                    self.assertEqual(html, parser._render_stack(value),
+                                     'the paths differ on %r' % value)
+        # the noise breaks some inputs, make sure enough of them are left
+        self.assertTrue(nested > 5000, nested)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Counts the datastore calls of DatastoreModel.put_multi/delete_multi. """
+
+import unittest
+
+import support
+
+from google.appengine.ext import db
+from gaeo.model import DatastoreModel, MAX_BATCH_SIZE
+
+# the hooks called, as (hook, entity title, datastore calls made before)
+events = []
+
+
+class Note(DatastoreModel):
+    title = db.StringProperty()
+    # True to veto the puts and deletes of the entity
+    locked = db.IntegerProperty(default=0)
+
+    def before_put(self):
+        events.append(('before_put', self.title, len(db.rpcs)))
+        return not self.locked
+
+    def after_put(self):
+        events.append(('after_put', self.title, len(db.rpcs)))
+
+    def before_delete(self):
+        events.append(('before_delete', self.title, len(db.rpcs)))
+        return not self.locked
+
+    def after_delete(self):
+        events.append(('after_delete', self.title, len(db.rpcs)))
+
+
+def notes(count, locked=()):
+    return [Note(key_name='n%d' % i, title='n%d' % i,
+                 locked=int(i in locked)) for i in xrange(count)]
+
+
+def stored(entities):
+    return [Note.get_by_key_name(entity.title) is not None
+            for entity in entities]
+
+
+class ModelBatchesTest(unittest.TestCase):
+
+    def setUp(self):
+        support.reset()
+        del events[:]
+
+    def calls(self):
+        return [rpc for rpc in db.rpcs if rpc[0] != 'get']
+
+    def test_put_multi_batches_the_puts(self):
+        entities = notes(2 * MAX_BATCH_SIZE + 1)
+        keys = Note.put_multi(entities)
+        self.assertEqual(self.calls(), [('put', MAX_BATCH_SIZE),
+                                        ('put', MAX_BATCH_SIZE),
+                                        ('put', 1)])
+        self.assertEqual(keys, [entity.key() for entity in entities])
+
+    def test_put_multi_runs_the_hooks_around_each_batch(self):
+        Note.put_multi(notes(MAX_BATCH_SIZE + 1))
+        before = [event for event in events if event[0] == 'before_put']
+        after = [event for event in events if event[0] == 'after_put']
+        # every entity is asked before the first call
+        self.assertEqual(events[:MAX_BATCH_SIZE + 1], before)
+        self.assertEqual(set(event[2] for event in before), set([0]))
+        # then each batch is told once it is put
+        self.assertEqual([event[1] for event in after],
+                         ['n%d' % i for i in xrange(MAX_BATCH_SIZE + 1)])
+        self.assertEqual([event[2] for event in after],
+                         [1] * MAX_BATCH_SIZE + [2])
+
+    def test_put_multi_leaves_out_the_vetoed(self):
+        entities = notes(5, locked=(1, 3))
+        keys = Note.put_multi(entities)
+        self.assertEqual(self.calls(), [('put', 3)])
+        self.assertEqual(keys, [entities[i].key() for i in (0, 2, 4)])
+        self.assertEqual(stored(entities), [True, False, True, False, True])
+        self.assertEqual([event[1] for event in events
+                          if event[0] == 'after_put'], ['n0', 'n2', 'n4'])
+
+    def test_put_multi_of_vetoed_only_makes_no_call(self):
+        self.assertEqual(Note.put_multi(notes(3, locked=(0, 1, 2))), [])
+        self.assertEqual(self.calls(), [])
+
+    def test_delete_multi_batches_the_deletes(self):
+        entities = notes(2 * MAX_BATCH_SIZE + 1)
+        for i in xrange(0, len(entities), MAX_BATCH_SIZE):
+            db.put(entities[i:i + MAX_BATCH_SIZE])
+        del db.rpcs[:]
+        self.assertEqual(Note.delete_multi(entities), len(entities))
+        self.assertEqual(self.calls(), [('delete', MAX_BATCH_SIZE),
+                                        ('delete', MAX_BATCH_SIZE),
+                                        ('delete', 1)])
+        self.assertEqual([event[2] for event in events
+                          if event[0] == 'after_delete'],
+                         [1] * MAX_BATCH_SIZE + [2] * MAX_BATCH_SIZE + [3])
+
+    def test_delete_multi_leaves_out_the_vetoed(self):
+        entities = notes(4, locked=(0, ))
+        Note.put_multi([entity for entity in entities if not entity.locked])
+        entities[0].locked = 0
+        entities[0].put()
+        entities[0].locked = 1
+        del db.rpcs[:]
+        del events[:]
+        self.assertEqual(Note.delete_multi(entities), 3)
+        self.assertEqual(self.calls(), [('delete', 3)])
+        self.assertEqual(stored(entities), [True, False, False, False])
+        self.assertEqual([event[0] for event in events],
+                         ['before_delete'] * 4 + ['after_delete'] * 3)
+
+    def test_single_put_and_delete_run_the_hooks(self):
+        note = Note(key_name='one', title='one')
+        self.assertEqual(note.put(), note.key())
+        note.delete()
+        self.assertEqual(self.calls(), [('put', 1), ('delete', 1)])
+        self.assertEqual([event[:2] for event in events],
+                         [('before_put', 'one'), ('after_put', 'one'),
+                          ('before_delete', 'one'), ('after_delete', 'one')])
+        locked = Note(key_name='locked', title='locked', locked=1)
+        self.assertTrue(locked.put() is None)
+        self.assertEqual(len(self.calls()), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
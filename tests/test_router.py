@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Tests that the compiled routing table resolves as the linear scan. """
+
+import unittest
+
+import support
+
+from gaeo.router import Router, RoutingRule
+
+# (pattern, explicit group names, args, whether the rule is RESTful), in the
+# order of precedence
+RULES = (
+    ('/', (), {'controller': 'welcome', 'action': 'index'}, False),
+    ('/about', (), {'controller': 'pages', 'action': 'about'}, False),
+    ('/about/:page', (), {'controller': 'pages'}, False),
+    (r'/blog/(\d+)', ('id', ), {'controller': 'blog', 'action': 'show'},
+     False),
+    ('/blog/:year/:month', (), {'controller': 'blog', 'action': 'archive'},
+     False),
+    # a quantifier after '/' makes it optional
+    ('/feed/?:format', (), {'controller': 'feed', 'action': 'index'}, False),
+    ('/tag/+:name', (), {'controller': 'tags', 'action': 'show'}, False),
+    # an alternation has no literal prefix
+    ('/(news|press)/:slug', ('section', ), {'controller': 'news'}, False),
+    ('/docs|/manual', (), {'controller': 'docs', 'action': 'index'}, False),
+    ('/help/index|/faq', (), {'controller': 'help', 'action': 'index'},
+     False),
+    # ':id' is also replaced inside ':identifier'
+    ('/user/:id/:identifier', (), {'controller': 'users'}, False),
+    ('/files/.*', (), {'controller': 'files', 'action': 'get'}, False),
+    ('/api/v:version/:resource', (), {'controller': 'api'}, False),
+    ('/items/:id', (), {'controller': 'items'}, True),
+    ('/:controller/:action/:id', (), {}, False),
+    ('/:controller/:action', (), {}, False),
+    ('/:controller', (), {'action': 'index'}, False),
+    # shadowed by the rules above
+    ('/admin/:action', (), {'controller': 'admin'}, False),
+    ('/pages/about', (), {'controller': 'never'}, False),
+)
+
+URLS = (
+    '', '/', '//', '/about', '/about/', '/about/team', '/about/team.html',
+    '/blog/2010', '/blog/2010/', '/blog/2010/10', '/blog/x', '/blog/x/y',
+    '/blog/2010/10/3', '/feed', '/feed/', '/feedrss', '/feed/rss',
+    '/feed//rss', '/tag/x', '/tag//x', '/tagx', '/news/hello', '/press/x.y',
+    '/other/x', '/docs', '/manual', '/docs/', '/user/1/abc', '/user/1',
+    '/files/', '/files/a/b.txt', '/files', '/api/v2/posts', '/api/2/posts',
+    '/api/v/posts', '/items/5', '/items/5/edit', '/items', '/a', '/a/b',
+    '/a/b/c', '/a/b/c/d', '/a.b', '/a/b.c', '/a//b', '/%41/b', '/a-b/c~d',
+    '/admin/list', '/pages/about', '/help/index', '/help', '/faq', '/x/faq',
+    '/help/index/x', 'about', 'a/b',
+)
+
+
+def make_rule(pattern, matches, args):
+    return RoutingRule(pattern, *matches, **args)
+
+
+def linear_resolve(uri):
+    """Resolves the URL as the router did before the routing trie: the
+    first rule whose RegEx matches, in order, wins.
+
+    Returns:
+        A (params, whether the rule is RESTful) tuple, or None.
+    """
+    for pattern, matches, args, restful in RULES:
+        params = make_rule(pattern, matches, args).match_url(uri)
+        if params:
+            return params, restful
+    return None
+
+
+class RouterTest(unittest.TestCase):
+
+    def make_router(self, cache_size):
+        router = Router(cache_size=cache_size)
+        for pattern, matches, args, restful in RULES:
+            if restful:
+                router.restful(make_rule(pattern, matches, args))
+            else:
+                router.add(make_rule(pattern, matches, args))
+        return router
+
+    def assertResolvesLinearly(self, router):
+        for uri in URLS:
+            routing = router.resolve(uri)
+            if routing is not None:
+                routing = routing[0], routing[1] is not None
+            self.assertEqual(routing, linear_resolve(uri),
+                             'the resolutions of %r differ' % uri)
+
+    def test_rules_mix_the_trie_and_regex(self):
+        kinds = [make_rule(*rule[:3])._segments is None for rule in RULES]
+        self.assertTrue(kinds.count(True) >= 8, kinds)
+        self.assertTrue(kinds.count(False) >= 8, kinds)
+
+    def test_resolves_as_the_linear_scan(self):
+        self.assertResolvesLinearly(self.make_router(0))
+
+    def test_cached_resolutions_agree(self):
+        router = self.make_router(1000)
+        self.assertResolvesLinearly(router)
+        self.assertResolvesLinearly(router)
+        # every path but the first of each is answered by the cache
+        paths = set([uri[:-1] if uri.endswith('/') else uri for uri in URLS])
+        self.assertEqual(router.cache_stats()['hits'],
+                         2 * len(URLS) - len(paths))
+
+    def test_first_match_wins(self):
+        router = self.make_router(0)
+        self.assertEqual(router.resolve('/admin/list')[0],
+                         {'controller': 'admin', 'action': 'list'})
+        self.assertEqual(router.resolve('/pages/about')[0],
+                         {'controller': 'pages', 'action': 'about'})
+        self.assertEqual(router.resolve('/blog/2010')[0],
+                         {'controller': 'blog', 'action': 'show',
+                          'id': '2010'})
+        self.assertEqual(router.resolve('/blog/x')[0],
+                         {'controller': 'blog', 'action': 'x'})
+
+    def test_regex_rules_params(self):
+        router = self.make_router(0)
+        self.assertEqual(router.resolve('/feedrss')[0],
+                         {'controller': 'feed', 'action': 'index',
+                          'format': 'rss'})
+        self.assertEqual(router.resolve('/press/x')[0],
+                         {'controller': 'news', 'section': 'press',
+                          'slug': 'x'})
+        self.assertEqual(router.resolve('/x/faq')[0],
+                         {'controller': 'help', 'action': 'index'})
+        self.assertEqual(router.resolve('/api/v2/posts')[0],
+                         {'controller': 'api', 'version': '2',
+                          'resource': 'posts'})
+        params, restful = router.resolve('/items/5')
+        self.assertEqual(params, {'controller': 'items', 'id': '5'})
+        self.assertEqual(restful['GET'], 'show')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Tests the compare-and-set merges of the concurrent session saves. """
+
+import logging
+import threading
+import time
+import unittest
+
+import support
+from support import FakeController, override_settings
+
+from google.appengine.api import memcache
+from gaeo import session
+from gaeo.session import DatastoreStore, MemcacheStore, Session, TieredStore
+
+_Client = memcache.Client
+_get = memcache.get
+
+
+def slow_get(key, namespace=None):
+    """Waits after getting the value, so the concurrent saves interleave."""
+    value = _get(key, namespace)
+    time.sleep(0.002)
+    return value
+
+
+class SlowClient(_Client):
+    """Waits between gets() and cas(), so the concurrent saves interleave."""
+
+    def gets(self, key, namespace=None):
+        value = _Client.gets(self, key, namespace)
+        time.sleep(0.002)
+        return value
+
+
+class RacedClient(_Client):
+    """Lets another request store the session after the first gets()."""
+
+    # the items the other request stores
+    items = None
+
+    def gets(self, key, namespace=None):
+        value = _Client.gets(self, key, namespace)
+        if RacedClient.items is not None:
+            payload = session.get_serializer().dumps(RacedClient.items)
+            memcache.set(key, payload)
+            RacedClient.items = None
+        return value
+
+
+class LosingClient(_Client):
+    """Always loses the compare-and-set to another request."""
+
+    def cas(self, key, value, time=0, namespace=None):
+        memcache.calls.append(('cas', key))
+        return False
+
+
+class SessionCasTest(unittest.TestCase):
+
+    def setUp(self):
+        support.reset()
+        session._STORES.clear()
+        self.addCleanup(session._STORES.clear)
+        self.addCleanup(setattr, memcache, 'Client', _Client)
+        self.addCleanup(setattr, memcache, 'get', _get)
+
+    def use_client(self, client_class):
+        memcache.Client = client_class
+
+    def slow_down(self):
+        memcache.Client = SlowClient
+        memcache.get = slow_get
+
+    def new_session(self, **items):
+        sess = Session(controller=FakeController())
+        sess.update(items)
+        self.assertTrue(sess.save())
+        return sess.key
+
+    def stored(self, key):
+        return session.get_serializer().loads(session.get_store().get(key))
+
+    def race(self, key, count):
+        """Saves a different key in each of the concurrent sessions, and
+        deletes 'base' in the first one.
+        """
+        sessions = [Session(key=key, controller=FakeController())
+                    for i in xrange(count)]
+        start = threading.Event()
+        results = [None] * count
+
+        def save(i):
+            sessions[i]['k%d' % i] = i
+            if i == 0:
+                del sessions[i]['base']
+            start.wait()
+            results[i] = sessions[i].save()
+
+        threads = [threading.Thread(target=save, args=(i, ))
+                   for i in xrange(count)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def assertRaceMerged(self, key, count):
+        items = self.stored(key)
+        for i in xrange(count):
+            self.assertEqual(items.get('k%d' % i), i)
+        self.assertFalse('base' in items)
+
+    def test_concurrent_saves_merge_in_memcache(self):
+        override_settings(self, SESSION_STORE='MemcacheStore',
+                          SESSION_CAS_RETRIES=50)
+        key = self.new_session(base=1)
+        self.slow_down()
+        self.assertEqual(self.race(key, 8), [True] * 8)
+        self.assertRaceMerged(key, 8)
+
+    def test_concurrent_saves_merge_in_tiered_store(self):
+        override_settings(self, SESSION_STORE='TieredStore',
+                          SESSION_CAS_RETRIES=50)
+        key = self.new_session(base=1)
+        self.slow_down()
+        self.assertEqual(self.race(key, 8), [True] * 8)
+        self.assertRaceMerged(key, 8)
+        # the datastore gets the merged session too
+        session.get_store().flush()
+        memcache.reset()
+        session._STORES.clear()
+        self.assertRaceMerged(key, 8)
+
+    def test_save_merges_again_when_raced(self):
+        self.use_client(RacedClient)
+        key = self.new_session(base=1)
+        sess = Session(key=key, controller=FakeController())
+        sess['mine'] = 1
+        started = sess['started']
+        RacedClient.items = {'base': 2, 'theirs': 3, 'started': started}
+        del memcache.calls[:]
+        self.assertTrue(sess.save())
+        self.assertEqual(memcache.count('cas'), 2)
+        expected = {'base': 2, 'theirs': 3, 'mine': 1, 'started': started}
+        self.assertEqual(self.stored(key), expected)
+        # the session has the changes of the other request now
+        self.assertEqual(dict(sess), expected)
+
+    def test_save_gives_up_after_retries(self):
+        override_settings(self, SESSION_CAS_RETRIES=2)
+        self.use_client(LosingClient)
+        key = self.new_session(base=1)
+        sess = Session(key=key, controller=FakeController())
+        sess['mine'] = 1
+        del memcache.calls[:]
+        logging.disable(logging.WARNING)
+        try:
+            self.assertFalse(sess.save())
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual(memcache.count('cas'), 3)
+        self.assertTrue(sess.dirty)
+        self.assertFalse('mine' in self.stored(key))
+
+    def test_compare_and_set_adds_a_missing_session(self):
+        merged = []
+
+        def merge(payload):
+            merged.append(payload)
+            return 'new'
+
+        self.assertEqual(MemcacheStore().update('key', merge, 60), 'new')
+        self.assertEqual(merged, [None])
+        self.assertEqual(memcache.get('key'), 'new')
+        self.assertEqual(memcache.count('add'), 1)
+        self.assertEqual(memcache.count('cas'), 0)
+
+    def test_compare_and_set_loads_the_durable_session(self):
+        DatastoreStore().set('key', 'durable', 60)
+        merged = []
+
+        def merge(payload):
+            merged.append(payload)
+            return payload + '+new'
+
+        store = TieredStore()
+        self.assertEqual(store.update('key', merge, 60), 'durable+new')
+        self.assertEqual(merged, ['durable'])
+        self.assertEqual(memcache.get('key'), 'durable+new')
+        store.flush()
+        self.assertEqual(DatastoreStore().get('key'), 'durable+new')
+
+
+if __name__ == '__main__':
+    unittest.main()
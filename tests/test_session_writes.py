@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Counts the memcache calls of the session in the request lifecycle. """
+
+import gc
+import unittest
+
+import support
+
+from google.appengine.api import memcache
+from gaeo import session
+from gaeo.app import GaeoApp
+
+# the memcache calls which write a session
+WRITES = ('set', 'add', 'cas')
+
+
+class SessionWritesTest(unittest.TestCase):
+
+    def setUp(self):
+        support.reset()
+        session._STORES.clear()
+        self.addCleanup(session._STORES.clear)
+        self.app = GaeoApp()
+        self.cookie = None
+
+    def request(self, path):
+        headers = {}
+        if self.cookie is not None:
+            headers['Cookie'] = self.cookie
+        del memcache.calls[:]
+        response = support.request(self.app, path, headers=headers)
+        self.assertEqual(response.status_int, 200)
+        cookie = response.headers.get('Set-Cookie')
+        if cookie is not None:
+            self.cookie = cookie.split(';')[0]
+        return response
+
+    def writes(self):
+        # the objects of the request are gone, nothing writes later
+        gc.collect()
+        return [call for call in memcache.calls if call[0] in WRITES]
+
+    def stored(self):
+        key = self.cookie.split('=', 1)[1]
+        return session.get_serializer().loads(memcache.get(key))
+
+    def test_new_session_is_added_once(self):
+        self.assertEqual(self.request('/sessions/five').body, 'five')
+        self.assertTrue(self.cookie is not None)
+        self.assertEqual([call[0] for call in self.writes()], ['add'])
+        items = self.stored()
+        for i in xrange(5):
+            self.assertEqual(items['k%d' % i], i)
+
+    def test_five_keys_are_written_once(self):
+        self.request('/sessions/five')
+        self.request('/sessions/five')
+        self.assertEqual([call[0] for call in self.writes()], ['cas'])
+        self.assertEqual(memcache.count('gets'), 1)
+
+    def test_read_only_request_writes_nothing(self):
+        self.request('/sessions/five')
+        self.assertEqual(self.request('/sessions/peek').body, 'k0=0')
+        self.assertEqual(self.writes(), [])
+        self.assertEqual(memcache.count('get'), 1)
+
+    def test_request_without_session_touches_nothing(self):
+        self.request('/echo/index/x')
+        self.assertEqual(memcache.calls, [])
+        self.assertTrue(self.cookie is None)
+
+    def test_vetoed_action_still_saves_once(self):
+        self.request('/sessions/five')
+        self.request('/sessions/guard')
+        self.assertEqual([call[0] for call in self.writes()], ['cas'])
+        self.assertEqual(self.stored()['flash'], 'denied')
+
+
+if __name__ == '__main__':
+    unittest.main()